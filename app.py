@@ -2,12 +2,12 @@ import streamlit as st
 import time
 import re
 import gspread
-from groq import Groq
+from groq import Groq, APIConnectionError, APIStatusError
+import httpx
 from tenacity import retry, stop_after_attempt, wait_exponential
 from google.oauth2.service_account import Credentials
-from ratelimit import limits, sleep_and_retry
 from pathlib import Path
-from langdetect import detect
+from langdetect import detect, DetectorFactory
 from deep_translator import GoogleTranslator
 import smtplib
 from email.message import EmailMessage
@@ -17,10 +17,24 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 import io
 from datetime import datetime
-from typing import List, Tuple
-from rapidfuzz import fuzz
+from typing import Iterator, List, Tuple
+from rapidfuzz import fuzz, process
 import importlib
 import math
+import random
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+import sqlite3
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from itertools import islice
+import numpy as np
 from email_validator import validate_email, EmailNotValidError
 import phonenumbers
 try:
@@ -30,6 +44,9 @@ try:
 except Exception:
     _FASTEMBED_TEXTEMBEDDING = None
 
+# langdetect is randomized by default; pin it so translation cache keys are stable
+DetectorFactory.seed = 0
+
 # ====== DIALOG SUPPORT (modal fallback if available) ======
 _DIALOG_DECORATOR = getattr(st, "dialog", None) or getattr(st, "experimental_dialog", None)
 if _DIALOG_DECORATOR:
@@ -113,557 +130,1626 @@ google map link: https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8 ."
 """
 
 # ========== HARDCODED RESPONSES ==========
-HARDCODED_RESPONSES = {
-    # Core Services
-    "services": "🛂 We provide full assistance with US and Canada Visa applications and processing.",
-    "what services do you offer": "🛂 We provide full assistance with US and Canada Visa applications and processing.",
-    
-    # Location & Contact
-    "location": "📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City\n\n🗺️ Find us here: https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8\n\n🎥 Location guide video: https://vt.tiktok.com/ZSyuUpdN6/",
-    "located": "📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City\n\n🗺️ Find us here: https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8\n\n🎥 Location guide video: https://vt.tiktok.com/ZSyuUpdN6/",
-    "where is your office": "📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City\n\n🗺️ Find us here: https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8\n\n🎥 Location guide video: https://vt.tiktok.com/ZSyuUpdN6/",
-    "map": "📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City\n\n🗺️ Find us here: https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8\n\n🎥 Location guide video: https://vt.tiktok.com/ZSyuUpdN6/",
-    
-    # Hours
-    "hours": "🕘 Monday to Saturday, 9:00 AM to 5:00 PM",
-    "business hours": "🕘 Monday to Saturday, 9:00 AM to 5:00 PM",
-    "what are your office hours": "🕘 Monday to Saturday, 9:00 AM to 5:00 PM",
-    "office hours": "🕘 Monday to Saturday, 9:00 AM to 5:00 PM",
-    
-    # Contact
-    "contact": "You can contact us directly:\n📞 +63 905-804-4426 or +63 969-251-0672\n\n📧 state101ortigasbranch@gmail.com",
-    "how can i contact": " You can contact us directly:\n📞 +63 905-804-4426 or +63 969-251-0672\n\n📧 state101ortigasbranch@gmail.com",
-    "how can i contact your team": " You can contact us directly:\n📞 +63 905-804-4426 or +63 969-251-0672\n\n📧 state101ortigasbranch@gmail.com",
-    
-    # Legitimacy
-    "legit": "✅ Yes, our company is 100% legitimate. We're officially registered and have a permit to operate issued by the Municipality of Pasig.",
-    "is your company legit": "✅ Yes, our company is 100% legitimate. We're officially registered and have a permit to operate issued by the Municipality of Pasig.",
-    "is state101 travel legitimate": "✅ Yes, our company is 100% legitimate. We're officially registered and have a permit to operate issued by the Municipality of Pasig.",
-    
-    # Visa Types
-    "visa type": "🛂 We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    "what types of visas": "🛂 We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    "what type of visa you offer": "🛂 We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    "what types of visas do you process": "🛂 We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    "do you have student visa": "🛂 We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    
-    # Requirements
-    "requirements": """🛂 **Initial Requirements**:
-\n\n• Valid passport (Photocopy)
-\n\n• 2x2 photo (white background)
-\n\n• Training Certificate (if available)
-\n\n• Diploma (Photocopy if available)
-\n\n• Updated Resume
-\n\n• Other supporting documents may be discussed during your assessment.""",
-    "what are the requirements": """🛂 **Initial Requirements**:
-\n\n• Valid passport (Photocopy)
-\n\n• 2x2 photo (white background)
-\n\n• Training Certificate (if available)
-\n\n• Diploma (Photocopy if available)
-\n\n• Updated Resume
-\n\n• Other supporting documents may be discussed during your assessment.""",
-    "documents required": """🛂 **Initial Requirements**:
-\n\n• Valid passport (Photocopy)
-\n\n• 2x2 photo (white background)
-\n\n• Training Certificate (if available)
-\n\n• Diploma (Photocopy if available)
-\n\n• Updated Resume
-\n\n• Other supporting documents may be discussed during your assessment.""",
-    "what documents are required": """🛂 **Initial Requirements**:
-\n\n• Valid passport (Photocopy)
-\n\n• 2x2 photo (white background)
-\n\n• Training Certificate (if available)
-\n\n• Diploma (Photocopy if available)
-\n\n• Updated Resume
-\n\n• Other supporting documents may be discussed during your assessment.""",
-    
-    # Visa Approval Guarantee
-    "guarantee": "✅ Yes, we significantly increase your chances of visa approval. Whether you are applying for a US Non-Immigrant Visa or Express Entry to Canada, our expert team provides complete, end-to-end guidance—from your very first step until the final submission—to ensure your application is strong, accurate, and presented with confidence.",
-    "is there a guarantee": "✅ Yes, we significantly increase your chances of visa approval. Whether you are applying for a US Non-Immigrant Visa or Express Entry to Canada, our expert team provides complete, end-to-end guidance—from your very first step until the final submission—to ensure your application is strong, accurate, and presented with confidence.",
-    
-    # Programs
-    "caregiver program": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "work abroad program": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # Qualifications
-    "qualifications": "✅ Open to applicants with or without prior training or experience. Applicants must be willing to undergo training and develop the necessary skills for the program.",
-    "what are the qualifications": "✅ Open to applicants with or without prior training or experience. Applicants must be willing to undergo training and develop the necessary skills for the program.",
-    
-    # Age
-    "age limit": "👥 No age limit, provided the applicant is physically capable of performing the required tasks.",
-    "age": "👥 No age limit, provided the applicant is physically capable of performing the required tasks.",
-    
-    # Gender
-    "gender": "⚧ Open to all genders.",
-    "is there genders required": "⚧ Open to all genders.",
-    "gender requirement": "⚧ Open to all genders.",
-    
-    # Graduates
-    "graduates": "🎓 Accepts both graduates and undergraduates.",
-    "does it accept graduates only": "🎓 Accepts both graduates and undergraduates.",
-    "do you accept undergraduates": "🎓 Accepts both graduates and undergraduates.",
-    
-    # Appointment Booking
-    "appointment": """📅 **To book an appointment**, complete our application form with:
-\n\n• Full Name
-\n\n• Email
-\n\n• Phone
-\n\n• Age
-\n\n• Address
-\n\n• Visa Type (Canadian/American)
-\n\n• Available Time
-
-\n\nVisit our [Application Form](https://state101-travel-website.vercel.app/services/) for an initial assessment.
-
-Your information is secure and will only be used for visa assessment.
-Your information is secure and will only be used for visa assessment."
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM
-
-\n\n✨ We recommend booking an appointment to ensure we can accommodate you promptly!""",
-    
-    "how can i book": """📅 **To book an appointment**, complete our application form with:
-\n\n• Full Name
-\n\n• Email
-\n\n• Phone
-\n\n• Age
-\n\n• Address
-\n\n• Visa Type (Canadian/American)
-\n\n• Available Time
-
-\n\nVisit our [Application Form](https://state101-travel-website.vercel.app/services/) for an initial assessment.
-\n\nYour information is secure and will only be used for visa assessment.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM
-
-✨ We recommend booking an appointment to ensure we can accommodate you promptly!""",
-    
-    "how can i book an appointment": """📅 **To book an appointment**, complete our application form with:
-\n\n• Full Name
-\n\n• Email
-\n\n• Phone
-\n\n• Age
-\n\n• Address
-\n\n• Visa Type (Canadian/American)
-\n\n• Available Time
-\n\nVisit our [Application Form](https://state101-travel-website.vercel.app/services/) for an initial assessment.
-\n\nYour information is secure and will only be used for visa assessment.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM
-
-✨ We recommend booking an appointment to ensure we can accommodate you promptly!""",
-    
-    "walk in": "✅ Yes, we accept walk-in clients with or without an appointment, but we highly recommend booking an appointment to ensure we can accommodate you promptly.",
-    "can i walk in": "✅ Yes, we accept walk-in clients with or without an appointment, but we highly recommend booking an appointment to ensure we can accommodate you promptly.",
-    
-    # Application Start
-    "how can i start my application": """📝 **To get started**, complete our application form with:
-\n\n• Full Name
-\n\n• Email
-\n\n• Phone
-\n\n• Age
-\n\n• Address
-\n\n• Visa Type (Canadian/American)
-\n\n• Available Time
-Visit our [Application Form](https://state101-travel-website.vercel.app/services/) for an initial assessment.
-\n\nYour information is secure and will only be used for visa assessment.
-
-📍 **Our Location:**
-2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-🗺️ **Google Maps:** https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-
-🎥 **Location Guide Video:** https://vt.tiktok.com/ZSyuUpdN6/
-
-📞 **Contact Us:**
-+63 905-804-4426 or +63 969-251-0672
-
-📧 **Email:**
-state101ortigasbranch@gmail.com
-
-⏰ **Office Hours:**
-Monday to Saturday, 9AM-5PM""",
-    
-    "how can i apply": """📝 **To get started**, complete our application form with:
-\n\n• Full Name
-\n\n• Email
-\n\n• Phone
-\n\n• Age
-\n\n• Address
-\n\n• Visa Type (Canadian/American)
-\n\n• Available Time
-Visit our [Application Form](https://state101-travel-website.vercel.app/services/) for an initial assessment.
-\n\nYour information is secure and will only be used for visa assessment.
+# Canonical answers, their aliases and the intent synonyms live in
+# data/knowledge_pack.json (one entry per unique answer). Edit that file, not Python;
+# the compiled form is cached under .cache/knowledge_pack and rebuilt when it changes.
+KNOWLEDGE_PACK_PATH = Path(__file__).resolve().parent / "data" / "knowledge_pack.json"
+KNOWLEDGE_PACK_CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "knowledge_pack"
 
-📍 **Our Location:**
-2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
 
-🗺️ **Google Maps:** https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
+def normalize_text(text: str) -> str:
+    return re.sub(r'[^\w\s]', '', text.lower()).strip()
 
-🎥 **Location Guide Video:** https://vt.tiktok.com/ZSyuUpdN6/
 
-📞 **Contact Us:**
-+63 905-804-4426 or +63 969-251-0672
+class KnowledgePack:
+    """Compiled data/knowledge_pack.json.
 
-📧 **Email:**
-state101ortigasbranch@gmail.com
+    bodies holds every canonical answer once; aliases and normalized map alias
+    text (raw / normalized) to a body id; intents map an intent name to its body
+    id and synonyms. index_entries are the deduplicated (key, text) pairs the
+    semantic and embedding routers index, with normalized_entries and, per
+    embedding model, their vectors stored in the same cached artifact.
+    """
 
-⏰ **Office Hours:**
-Monday to Saturday, 9AM-5PM""",
-    
-    # After Submission
-    "what happens after": "📞 Expect a call within 24 hours as soon as we can handle your query.",
-    "what happens after i submit": "📞 Expect a call within 24 hours as soon as we can handle your query.",
-    
-    # Application Outside Metro Manila
-    "apply outside metro manila": "📍 Yes, we assist clients from all over the Philippines. Our business hours are Mon-Sat 9am to 5pm.",
-    "can i apply if im outside": "📍 Yes, we assist clients from all over the Philippines. Our business hours are Mon-Sat 9am to 5pm.",
-    "nationwide": "📍 Yes, we assist clients from all over the Philippines. Our business hours are Mon-Sat 9am to 5pm.",
-    
-    # Application Status
-    "application status": "📞 For the status of your application, feel free to contact us on our official numbers: +63 905-804-4426 or +63 969-251-0672.",
-    "how do i know the status": "📞 For the status of your application, feel free to contact us on our official numbers: +63 905-804-4426 or +63 969-251-0672.",
-    "status of my application": "📞 For the status of your application, feel free to contact us on our official numbers: +63 905-804-4426 or +63 969-251-0672.",
-    
-    # Job Offers & Placements
-    "job offers abroad": "🛂 As of now we only offer non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada. For detailed advice on the current visas we offer please contact us directly at +63 905-804-4426 or +63 969-251-0672.",
-    "available job offers": "🛂 As of now we only offer non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada. For detailed advice on the current visas we offer please contact us directly at +63 905-804-4426 or +63 969-251-0672.",
-    "job placements": "🛂 As of now we only offer non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada. For detailed advice on the current visas we offer please contact us directly at +63 905-804-4426 or +63 969-251-0672.",
-    
-    # Partner Agency
-    "partner agency": "🏢 No, we are an independent and private company located at our main office in Pasig City, accredited by the Municipality of Pasig.",
-    "do you have a partner agency": "🏢 No, we are an independent and private company located at our main office in Pasig City, accredited by the Municipality of Pasig.",
-    
-    # Families & Couples
-    "families or couples": "👨‍👩‍👧 Yes, families and couples can apply together. We highly suggest you visit the application form to begin booking your appointment with us. If you have further questions, feel free to contact us at +63 905-804-4426 or +63 969-251-0672.",
-    "can families apply": "👨‍👩‍👧 Yes, families and couples can apply together. We highly suggest you visit the application form to begin booking your appointment with us. If you have further questions, feel free to contact us at +63 905-804-4426 or +63 969-251-0672.",
-    
-    # Orientation
-    "orientation": "🧭 Yes, we are here to orient you with your needs to apply for a Visa to ensure you are fully prepared and understand the process.",
-    "is the orientation mandatory": "🧭 Yes, we are here to orient you with your needs to apply for a Visa to ensure you are fully prepared and understand the process.",
-    "orientation mandatory": "🧭 Yes, we are here to orient you with your needs to apply for a Visa to ensure you are fully prepared and understand the process.",
-    
-    "orientation online": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
+    # Bump whenever compile_source() output changes: cached artifacts of older
+    # compilers are then rebuilt even though data/knowledge_pack.json is unchanged.
+    FORMAT_VERSION = 2
+
+    def __init__(self, meta: dict, cache_path: Path | None = None):
+        self.source_hash: str = meta["source_hash"]
+        self.bodies: List[str] = meta["bodies"]
+        self.aliases: dict = meta["aliases"]
+        self.normalized: dict = meta["normalized"]
+        self.intents: dict = meta["intents"]
+        self.index_entries: List[Tuple[str, str]] = [tuple(e) for e in meta["index_entries"]]
+        self.normalized_entries: List[str] = meta["normalized_entries"]
+        self.cache_path = cache_path
+        self._meta = meta
+        self._embeddings: dict = {}  # artifact key (per model) -> index_entries matrix
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def compile_source(source: dict, source_hash: str) -> dict:
+        """Build the lookup tables; raises ValueError for duplicate aliases or dangling intent targets."""
+        bodies: List[str] = []
+        aliases: dict = {}
+        for entry in source["responses"]:
+            body_id = len(bodies)
+            bodies.append(entry["answer"])
+            for alias in entry["aliases"]:
+                if alias in aliases:
+                    raise ValueError(f"alias {alias!r} is listed under more than one response")
+                aliases[alias] = body_id
+        normalized: dict = {}
+        for alias, body_id in aliases.items():
+            normalized.setdefault(normalize_text(alias), body_id)
+        intents: dict = {}
+        for name, spec in source.get("intents", {}).items():
+            target = spec.get("response")
+            if target is not None and target not in aliases:
+                raise ValueError(f"intent {name!r} points at unknown response {target!r}")
+            intents[name] = {"response": aliases.get(target), "synonyms": list(spec.get("synonyms", []))}
+        entries = [(name, syn) for name, spec in intents.items() for syn in spec["synonyms"]]
+        entries += [(alias, alias) for alias in aliases]
+        seen = set()
+        index_entries: List[Tuple[str, str]] = []
+        for key, text in entries:
+            t = text.strip().lower()
+            if t and t not in seen:
+                seen.add(t)
+                index_entries.append((key, text))
+        return {
+            "format": KnowledgePack.FORMAT_VERSION,
+            "source_hash": source_hash,
+            "bodies": bodies,
+            "aliases": aliases,
+            "normalized": normalized,
+            "intents": intents,
+            "index_entries": index_entries,
+            "normalized_entries": [normalize_text(text) for _, text in index_entries],
+        }
 
-We recommend an appointment before walking in. To schedule an appointment, please fill out our application form.
+    @classmethod
+    def load(cls, path: Path = KNOWLEDGE_PACK_PATH, cache_dir: Path = KNOWLEDGE_PACK_CACHE_DIR,
+             force: bool = False) -> "KnowledgePack":
+        raw = Path(path).read_bytes()
+        source_hash = hashlib.sha256(raw).hexdigest()
+        cache_path = Path(cache_dir) / "pack.npz"
+        if not force:
+            try:
+                with np.load(cache_path) as z:
+                    meta = json.loads(z["meta"].tobytes().decode("utf-8"))
+                if meta.get("source_hash") == source_hash and meta.get("format") == cls.FORMAT_VERSION:
+                    return cls(meta, cache_path)
+            except Exception:
+                pass
+        pack = cls(cls.compile_source(json.loads(raw.decode("utf-8")), source_hash), cache_path)
+        pack._write()
+        return pack
 
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "can i join the orientation online": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
+    @staticmethod
+    def _embedding_key(model_name: str) -> str:
+        return "emb_" + hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:16]
 
-We recommend an appointment before walking in. To schedule an appointment, please fill out our application form.
+    def _artifact_arrays(self) -> dict:
+        """Embedding arrays already in the artifact, if it matches this pack."""
+        try:
+            with np.load(self.cache_path) as z:
+                meta = json.loads(z["meta"].tobytes().decode("utf-8"))
+                if meta.get("source_hash") != self.source_hash or meta.get("format") != self.FORMAT_VERSION:
+                    return {}
+                return {key: np.ascontiguousarray(z[key], dtype=np.float32) for key in z.files if key.startswith("emb_")}
+        except Exception:
+            return {}
 
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # What to Bring
-    "what to bring": "🧾 Bring the Initial Requirements (Valid passport, 2x2 photo, Training Certificate if available, Diploma if available, Updated Resume). If you have further questions, feel free to contact us for confirmation before your visit.",
-    "what should i bring": "🧾 Bring the Initial Requirements (Valid passport, 2x2 photo, Training Certificate if available, Diploma if available, Updated Resume). If you have further questions, feel free to contact us for confirmation before your visit.",
-    
-    # Reschedule
-    "reschedule": "📞 You can contact us directly at +63 905-804-4426 or +63 969-251-0672 to reschedule your orientation.",
-    "how can i reschedule": "📞 You can contact us directly at +63 905-804-4426 or +63 969-251-0672 to reschedule your orientation.",
-    
-    # Other Branches
-    "other branches": "🏢 No, we are only located at our Pasig City office. Feel free to contact us for more information regarding the orientation.",
-    "do you have orientations in other branches": "🏢 No, we are only located at our Pasig City office. Feel free to contact us for more information regarding the orientation.",
-    
-    # Fees & Pricing
-    "processing fee": """💰 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "how much": """💰 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "price": """💰 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "cost": """💰 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # Payment Methods
-    "payment methods": """💳 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "what payment methods": """💳 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # Installment Plans
-    "installment plans": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "do you offer installment": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # Hidden Charges
-    "hidden charges": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "are there any hidden charges": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # Free Consultation/Training
-    "consultation free": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "is the consultation really free": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "are trainings free": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    "is there a fee for training": """📝 All the details about our program will be discussed during the initial briefing and assessment at our office.
-
-\n\n📍 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n🗺️ https://maps.app.goo.gl/o2rvHLBcUZhpDJfp8
-\n\n🎥 https://vt.tiktok.com/ZSyuUpdN6/
-\n\n📞 +63 905-804-4426 or +63 969-251-0672
-\n\n📧 state101ortigasbranch@gmail.com
-\n\n⏰ Mon-Sat 9AM-5PM""",
-    
-    # Submit Documents/Requirements
-    "submit requirements": "📤 Submit your requirements through the Initial Assessment tab with your personal and contact details.",
-    "how do i submit": "📤 Submit your requirements through the Initial Assessment tab with your personal and contact details.",
-    "submit documents": "📤 Submit your requirements through the Initial Assessment tab with your personal and contact details.",
-    
-    # Verification & Safety
-    "verify consultant": """🔐 To ensure you're dealing with an official member of State101, please note our official details:
-• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-• Business Hours: Open Mon-Sat 9AM-5PM
-• We are officially registered with the Municipality of Pasig.
-
-We recommend verifying through these official channels.""",
-    
-    "how can i verify": """🔐 To ensure you're dealing with an official member of State101, please note our official details:
-• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-• Business Hours: Open Mon-Sat 9AM-5PM
-• We are officially registered with the Municipality of Pasig.
+    def _write(self):
+        """Atomically rewrite the artifact: tables plus every known embedding matrix."""
+        if self.cache_path is None:
+            return
+        try:
+            arrays = {"meta": np.frombuffer(json.dumps(self._meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)}
+            arrays.update(self._embeddings)
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp")
+            with open(tmp, "wb") as fh:
+                np.savez(fh, **arrays)
+            os.replace(tmp, self.cache_path)
+        except Exception:
+            pass  # read-only disk: the in-memory pack still works
+
+    def embeddings(self, model_name: str) -> np.ndarray | None:
+        """Precomputed index_entries embeddings for model_name, if the artifact has them."""
+        key = self._embedding_key(model_name)
+        with self._lock:
+            if key not in self._embeddings and self.cache_path is not None:
+                self._embeddings.update(self._artifact_arrays())
+            matrix = self._embeddings.get(key)
+        if matrix is None or matrix.shape[0] != len(self.index_entries):
+            return None
+        return matrix
 
-We recommend verifying through these official channels.""",
-    
-    "official staff member": """🔐 To ensure you're dealing with an official member of State101, please note our official details:
-• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-• Business Hours: Open Mon-Sat 9AM-5PM
-• We are officially registered with the Municipality of Pasig.
+    def store_embeddings(self, model_name: str, matrix: np.ndarray):
+        with self._lock:
+            if self.cache_path is not None:
+                # Keep vectors other models already stored in the artifact
+                for key, arr in self._artifact_arrays().items():
+                    self._embeddings.setdefault(key, arr)
+            self._embeddings[self._embedding_key(model_name)] = np.asarray(matrix, dtype=np.float32)
+            self._write()
 
-We recommend verifying through these official channels.""",
-    
-    "how can i make sure im dealing": """🔐 To ensure you're dealing with an official member of State101, please note our official details:
-• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-• Business Hours: Open Mon-Sat 9AM-5PM
-• We are officially registered with the Municipality of Pasig.
+    def keep_embeddings(self, model_name: str, matrix: np.ndarray):
+        """Hold only model_name's vectors, as matrix (a memory-map in int8 mode), dropping float copies.
 
-We recommend verifying through these official channels.""",
-    
-    # Social Media
-    "social media": "🌐 Yes, you can find our social media links available at the bottom of our Website. Please feel free to check us out and follow us for updates and guides.",
-    "do you have facebook": "🌐 Yes, you can find our social media links available at the bottom of our Website. Please feel free to check us out and follow us for updates and guides.",
-    "do you have social media": "🌐 Yes, you can find our social media links available at the bottom of our Website. Please feel free to check us out and follow us for updates and guides.",
-    
-    # Scammers
-    "scammers": """⚠️ To ensure you're dealing with an official member of State101, please note our official details:
-\n\n• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-\n\n• Business Hours: Open Mon-Sat 9AM-5PM
-\n\n• We are officially registered with the Municipality of Pasig.
-
-Please only use our official contacts and report any suspicious accounts to us.""",
-    
-    "encounter scammers": """⚠️ To ensure you're dealing with an official member of State101, please note our official details:
-\n\n• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-\n\n• Business Hours: Open Mon-Sat 9AM-5PM
-\n\n• We are officially registered with the Municipality of Pasig.
+        Other models' vectors stay in the artifact; store_embeddings() merges them back.
+        """
+        with self._lock:
+            self._embeddings = {self._embedding_key(model_name): matrix}
+
+    def answer(self, key: str) -> str | None:
+        """Body for an alias or an intent name; aliases win."""
+        body_id = self.aliases.get(key)
+        if body_id is None and key in self.intents:
+            body_id = self.intents[key]["response"]
+        return self.bodies[body_id] if body_id is not None else None
+
+    def exact(self, normalized_text: str) -> str | None:
+        body_id = self.normalized.get(normalized_text)
+        return self.bodies[body_id] if body_id is not None else None
+
+    def responses(self) -> dict:
+        """alias -> answer; values are shared references into bodies, not copies."""
+        return {alias: self.bodies[body_id] for alias, body_id in self.aliases.items()}
+
+
+KNOWLEDGE_PACK = KnowledgePack.load()
+# Alias view used by the FACTS snapshot, training data and the Requirements tab
+HARDCODED_RESPONSES = KNOWLEDGE_PACK.responses()
+
+# ========== ROUTING HELPERS ==========
+# Routing cascade, cheapest first. Local stages answer from HARDCODED_RESPONSES
+# ("rag" only retrieves knowledge chunks for the fallback); "relevance" and
+# "facts" may call the LLM, so they run last.
+# Override the order (or drop stages) with ROUTING_STAGES in secrets.toml.
+DEFAULT_ROUTING_STAGES = ["exact", "intent", "lexicon", "domain", "semantic", "embedding", "fuzzy", "rag", "relevance", "facts"]
+# Pure table lookups; they run on the raw prompt before any translation is attempted
+LEXICAL_STAGES = ("exact", "intent", "lexicon")
+# Stages that may call Groq; only reached when every local stage missed
+REMOTE_STAGES = ("relevance", "facts")
+
+# Knowledge files are chunked at sentence ends and before list items / headings
+SENTENCE_BOUNDARY = re.compile(r"(?<=[^\s\d][.!?])\s+")
+LIST_ITEM = re.compile(r"^(?:[-*•]|\d+[.)])\s")
+
+# Appended to SYSTEM_PROMPT for the facts-backed fallback
+FACTS_FALLBACK_RULES = """
+10. Facts-backed fallback (this reply):
+    - Answer ONLY from the FACTS object and the numbered CONTEXT excerpts in the user message.
+    - Prefer FACTS for address, phones, email, hours and prices; CONTEXT is for long-form FAQs and guides.
+    - If the answer is not explicit, give the closest relevant fact, or the official contact block plus a hint to submit the Application Form.
+    - Never invent branches, prices, links or contact details. Keep the reply short.
+"""
 
-Please only use our official contacts and report any suspicious accounts to us.""",
-    
-    "what should i do if i encounter scammers": """⚠️ To ensure you're dealing with an official member of State101, please note our official details:
-\n\n• Location: 2F Unit 223, One Oasis Hub B, Ortigas Ext, Pasig City
-\n\n• Contact Numbers: +63 905-804-4426 or +63 969-251-0672
-\n\n• Business Hours: Open Mon-Sat 9AM-5PM
-\n\n• We are officially registered with the Municipality of Pasig.
+# Common English words used (together with the domain vocabulary) to skip
+# langdetect/GoogleTranslator for prompts that are plainly English.
+ENGLISH_FASTPATH_WORDS = {
+    "a", "about", "after", "again", "all", "also", "am", "an", "and", "any", "are", "as", "at",
+    "be", "because", "been", "before", "being", "best", "but", "by", "can", "could", "day", "did",
+    "do", "does", "doing", "done", "for", "from", "get", "give", "go", "going", "good", "got",
+    "had", "has", "have", "having", "he", "help", "her", "here", "him", "his", "how", "i", "if",
+    "im", "in", "into", "is", "it", "its", "just", "know", "like", "long", "make", "many", "may",
+    "me", "more", "much", "must", "my", "need", "new", "no", "not", "now", "of", "ok", "okay",
+    "on", "one", "only", "or", "other", "our", "out", "please", "really", "she", "should", "so",
+    "some", "still", "take", "tell", "than", "thank", "that", "the", "their", "them", "then",
+    "there", "these", "they", "this", "those", "to", "today", "tomorrow", "too", "up", "us",
+    "very", "want", "was", "way", "we", "week", "were", "what", "when", "where", "which", "who",
+    "why", "will", "with", "would", "yes", "you", "your", "yours",
+}
 
-Please only use our official contacts and report any suspicious accounts to us.""",
-    
-    # Other Countries
-    "other countries": "🌍 We currently don't offer visa assistance to other countries. We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    "do you also offer visas to other countries": "🌍 We currently don't offer visa assistance to other countries. We offer Non-Immigrant Visa for US and Express Entry and other immigration pathways for Canada.",
-    
-    # Greetings
-    "hi": "Hi there! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "hello": "Hello! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "hey": "Hey! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "good morning": "Good morning! ☀️ How can I assist you today?",
-    "good afternoon": "Good afternoon! 🌤️ How can I assist you today?",
-    "good evening": "Good evening! 🌙 How can I assist you today?",
-    "greetings": "Hello! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "hola": "¡Hola! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "whats up": "Hey! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "what's up": "Hey! 👋 What can I help you with?\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "howdy": "Howdy! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "sup": "Hey! 👋 What can I help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    
-    # Goodbyes & Farewells
-    "bye": "Goodbye! 👋 Thank you for visiting State101 Travel. Feel free to come back anytime if you have more visa questions. We're here to help!",
-    "goodbye": "Goodbye! 👋 Thank you for visiting State101 Travel. Feel free to come back anytime if you have more visa questions. We're here to help!",
-    "see you": "See you later! 👋 Thanks for chatting with us. Don't hesitate to reach out if you need any visa assistance. We're here for you!",
-    "see you later": "See you later! 👋 Thanks for chatting with us. Don't hesitate to reach out if you need any visa assistance. We're here for you!",
-    "farewell": "Farewell! 👋 Thank you for visiting State101 Travel. We look forward to helping you with your visa application!",
-    "take care": "Take care! 👋 Thanks for visiting State101 Travel. Feel free to reach out anytime. We're here to help!",
-    "catch you": "Catch you later! 👋 Thanks for chatting with State101 Travel. Come back soon if you have more questions!",
-    "cya": "See ya! 👋 Thanks for visiting. Feel free to come back anytime with your visa questions!",
-    "adios": "¡Adiós! 👋 Thank you for visiting State101 Travel. Come back soon if you need help with your visa!",
-    "later": "Later! 👋 Thanks for chatting with us. Feel free to reach out anytime for visa assistance!",
-    
-    # Thanks & Appreciation
-    "thanks": "You're welcome! 😊 Is there anything else I can help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "thank you": "You're welcome! 😊 Is there anything else I can help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
-    "thx": "You're welcome! 😊 Is there anything else I can help you with?\n\nYou can ask about:\n\n• Visa types & requirements\n\n• Our location & hours\n\n• How to book an appointment\n\n• Qualifications & eligibility",
+# Tagalog/Taglish phrases mapped to HARDCODED_RESPONSES keys or intents, so
+# common local-language questions are answered without a translation call.
+TAGALOG_INTENT_LEXICON = {
+    "location": [
+        "saan kayo", "saan po kayo", "nasaan kayo", "nasaan po kayo", "saan ang office",
+        "saan ang opisina", "saan banda", "saan located", "asan kayo", "san kayo", "paano pumunta",
+    ],
+    "hours": [
+        "anong oras", "ano oras", "oras ng opisina", "bukas ba kayo", "open ba kayo", "bukas po ba",
+        "sarado ba kayo", "anong araw bukas",
+    ],
+    "contact": [
+        "numero nyo", "numero ninyo", "contact number nyo", "paano kayo makontak", "pano kayo makontak",
+        "email nyo", "pwede tumawag",
+    ],
+    "how much": ["magkano", "magkano po", "magkano ba", "magkano bayad", "may bayad ba", "magkano ang bayad"],
+    "requirements": [
+        "ano ang requirements", "anong requirements", "ano mga requirements", "mga kailangan",
+        "ano ang kailangan", "anong kailangan", "kailangan dokumento", "mga dokumento",
+    ],
+    "how can i apply": ["paano mag apply", "pano mag apply", "paano magapply", "gusto ko mag apply", "paano magsimula"],
+    "appointment": ["paano mag book", "pano mag book", "magpa appointment", "mag schedule", "magpa schedule"],
+    "walk in": ["pwede walk in", "pwede ba walk in", "pwede mag walk in", "tumatanggap ba kayo ng walk in"],
+    "legit": ["legit ba kayo", "legit po ba", "totoo ba kayo", "hindi ba scam", "scam ba kayo"],
+    "age limit": ["may age limit ba", "hanggang ilang taon", "ilang taon ang limit", "may edad limit", "matanda na ako"],
+    "gender": ["babae o lalaki", "pwede ba babae", "pwede ba lalaki"],
+    "graduates": ["hindi ako graduate", "di ako graduate", "undergrad ako", "kahit hindi graduate"],
+    "good morning": ["magandang umaga"],
+    "good afternoon": ["magandang hapon"],
+    "good evening": ["magandang gabi"],
+    "hello": ["kumusta", "kamusta", "musta"],
+    "thanks": ["salamat", "salamat po", "maraming salamat"],
+    "goodbye": ["paalam", "paalam na po", "ingat po kayo"],
 }
 
-class VisaAssistant:
+# Labeled examples for the local relevance classifier. The on-topic side is
+# extended at training time with every intent synonym and HARDCODED_RESPONSES key.
+RELEVANCE_ONTOPIC_EXAMPLES = [
+    "how long does the visa processing take", "can you help me with my us visa",
+    "i want to apply for a canadian visa", "do i need a passport to apply",
+    "what is express entry", "how do i prepare for the embassy interview",
+    "can i bring my family to canada", "is there an age limit for applicants",
+    "my visa was denied before can i still apply", "do you assist with tourist visas",
+    "what documents should i bring to the assessment", "are you open on saturday",
+    "where can i find your office in pasig", "how do i contact state101",
+    "is the initial assessment free", "can i apply even if i am undergraduate",
+    "i am a caregiver can i work in canada", "what are the steps to apply",
+    "how much is the processing fee", "can i pay in installments",
+    "how do i know if my application is approved", "can i reschedule my appointment",
+    "do you process b1 b2 visas", "what happens during the orientation",
+    "is state101 accredited", "how can i submit my requirements online",
+]
+RELEVANCE_OFFTOPIC_EXAMPLES = [
+    "give me a recipe for chicken adobo", "how do i cook sinigang", "best pizza place near me",
+    "what is the weather tomorrow", "will it rain in manila today", "who won the nba game last night",
+    "what is the score of the football match", "recommend a good movie to watch", "play a song for me",
+    "write a python function to sort a list", "fix this javascript error", "how do i learn programming",
+    "solve this equation 2x plus 3 equals 7", "what is the square root of 144", "help me with my math homework",
+    "write an essay about climate change", "write a story about a dragon", "tell me a joke",
+    "what is the price of bitcoin today", "should i buy tesla stock", "how do crypto wallets work",
+    "who is the president of france", "what is the capital of australia", "how far is the moon",
+    "what time does jollibee close", "is sm megamall open today", "how do i get to the airport",
+    "recommend a hotel in boracay", "what is the best phone to buy", "how do i lose weight fast",
+    "what are the symptoms of flu", "translate hello to japanese", "how old is the universe",
+    "can you play chess with me", "what games are popular right now", "how do i fix my wifi",
+    "who is the best basketball player", "what should i name my dog", "how to make coffee",
+    "book me a flight to tokyo", "how do i open a bank account", "what is machine learning",
+]
+# Words that change what a fallback answer is about; the semantic answer cache only
+# reuses an answer when these match exactly (numbers are compared as well).
+ANSWER_CACHE_ENTITY_TERMS = {
+    "us": "us", "usa": "us", "america": "us", "american": "us", "united states": "us",
+    "canada": "canada", "canadian": "canada",
+    "tourist": "tourist", "visitor": "tourist", "visit": "tourist", "b1": "business", "b2": "tourist",
+    "business": "business", "student": "student", "study": "student", "f1": "student",
+    "work": "work", "worker": "work", "working": "work", "employment": "work", "job": "work",
+    "caregiver": "caregiver", "nanny": "caregiver", "transit": "transit",
+    "immigrant": "immigrant", "immigration": "immigrant", "permanent": "immigrant", "pr": "immigrant",
+    "fiance": "fiance", "k1": "fiance", "spouse": "spouse", "spousal": "spouse", "family": "family",
+    "renewal": "renewal", "renew": "renewal", "extension": "extension", "extend": "extension",
+    "child": "child", "children": "child", "minor": "child", "senior": "senior",
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6",
+    "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+}
+# (question, question, same answer?) pairs for `python app.py calibrate-answer-cache`
+ANSWER_CACHE_CALIBRATION_PAIRS = [
+    ("how long is processing", "processing time how long", True),
+    ("how long does the visa processing take", "what is the processing time for a visa", True),
+    ("what should i bring to my interview", "what documents do i bring to the interview", True),
+    ("can i apply if i was refused before", "i was denied a visa before can i still apply", True),
+    ("do you help with visa interview preparation", "can you prepare me for my embassy interview", True),
+    ("is there an age limit for applicants", "am i too old to apply for a visa", True),
+    ("can my family come with me", "can i bring my family along", True),
+    ("how early should i apply before my trip", "when should i start my application before travelling", True),
+    ("what happens after i submit my application", "what is the next step after submitting", True),
+    ("do i need a bank certificate", "is a bank certificate required", True),
+    ("canada tourist visa requirements", "us tourist visa requirements", False),
+    ("us student visa requirements", "us work visa requirements", False),
+    ("fee for 1 applicant", "fee for 3 applicants", False),
+    ("how long is canada visa processing", "how long is us visa processing", False),
+    ("can i work in canada on a tourist visa", "can i study in canada on a tourist visa", False),
+    ("requirements for a child applicant", "requirements for a senior applicant", False),
+    ("how long is processing", "how much is the processing fee", False),
+    ("what should i bring to my interview", "what should i wear to my interview", False),
+    ("can i apply if i was refused before", "can i apply if i overstayed before", False),
+    ("do you help with visa renewal", "do you help with visa extension", False),
+]
+
+
+class RelevanceClassifier:
+    """Logistic regression over normalized query embeddings (on-topic vs off-topic).
+
+    Trained offline with `python app.py train-relevance`, or fitted in memory
+    at startup when no matching saved model exists.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float, model_name: str, examples_hash: str):
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.model_name = model_name
+        self.examples_hash = examples_hash
+
+    @classmethod
+    def fit(cls, X: np.ndarray, y: np.ndarray, model_name: str, examples_hash: str,
+            epochs: int = 600, lr: float = 2.0, l2: float = 1e-3) -> "RelevanceClassifier":
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        # Balance the classes so the larger on-topic set doesn't dominate
+        pos = max(1.0, y.sum())
+        neg = max(1.0, len(y) - y.sum())
+        sample_w = np.where(y == 1, len(y) / (2 * pos), len(y) / (2 * neg))
+        w = np.zeros(X.shape[1])
+        b = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+            err = (p - y) * sample_w
+            w -= lr * (X.T @ err / len(y) + l2 * w)
+            b -= lr * err.mean()
+        return cls(w, b, model_name, examples_hash)
+
+    def predict_proba(self, vec: np.ndarray) -> float:
+        """Probability that the query is about State101 / US-Canada visas."""
+        z = float(np.dot(self.weights, vec)) + self.bias
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as fh:
+            np.savez(
+                fh, weights=self.weights, bias=np.float32(self.bias),
+                model_name=np.str_(self.model_name), examples_hash=np.str_(self.examples_hash),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "RelevanceClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["weights"], float(data["bias"]), str(data["model_name"]), str(data["examples_hash"]))
+
+
+def relevance_training_set(pack: KnowledgePack) -> Tuple[List[str], List[int], str]:
+    """Labeled (texts, labels, examples_hash) for the relevance classifier, built from the pack alone."""
+    positives = list(RELEVANCE_ONTOPIC_EXAMPLES)
+    positives += [s for spec in pack.intents.values() for s in spec["synonyms"]]
+    positives += list(pack.responses().keys())
+    negatives = list(RELEVANCE_OFFTOPIC_EXAMPLES)
+    texts = positives + negatives
+    labels = [1] * len(positives) + [0] * len(negatives)
+    examples_hash = hashlib.sha256(json.dumps([texts, labels]).encode("utf-8")).hexdigest()[:16]
+    return texts, labels, examples_hash
+
+
+class PhraseMatcher:
+    """Whole-token multi-phrase matcher compiled once from (label, phrase) pairs.
+
+    Phrases are indexed by their token tuple, so a lookup walks each start
+    position of the text once (bounded by the longest phrase) regardless of
+    how many phrases are registered. When several phrases occur, the one
+    registered first wins, matching a sequential scan of the original list.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str]], normalize):
+        self._table: dict = {}
+        self._max_len = 0
+        for priority, (label, phrase) in enumerate(entries):
+            tokens = tuple(normalize(phrase).split())
+            if not tokens or tokens in self._table:
+                continue
+            self._table[tokens] = (priority, label, phrase)
+            self._max_len = max(self._max_len, len(tokens))
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def match(self, normalized_text: str) -> Tuple[str, str] | None:
+        """Return (label, phrase) of the highest-priority phrase in the text."""
+        tokens = normalized_text.split()
+        best = None
+        for i in range(len(tokens)):
+            for j in range(i + 1, min(len(tokens), i + self._max_len) + 1):
+                hit = self._table.get(tuple(tokens[i:j]))
+                if hit and (best is None or hit[0] < best[0]):
+                    best = hit
+                    if best[0] == 0:
+                        return best[1], best[2]
+        return (best[1], best[2]) if best else None
+
+
+class SQLiteStore:
+    """Small SQLite key/value table (JSON values) with TTL and a row cap.
+
+    Opens a short-lived connection per call, so one file can be shared by
+    threads and by several Streamlit worker processes.
+    """
+
+    def __init__(self, path: str, table: str, ttl_seconds: float | None = None, max_rows: int | None = None):
+        self.path = str(path)
+        self.table = re.sub(r"\W+", "_", table)
+        self.ttl_seconds = float(ttl_seconds) if ttl_seconds else None
+        self.max_rows = int(max_rows) if max_rows else None
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_updated ON {self.table} (updated_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _fresh_after(self) -> float:
+        return time.time() - self.ttl_seconds if self.ttl_seconds else float("-inf")
+
+    def get(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND updated_at >= ?",
+                (key, self._fresh_after()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value):
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            if self.max_rows:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+
+    def get_many(self, keys: List[str]) -> dict:
+        """Fresh values for the given keys; missing keys are left out."""
+        found: dict = {}
+        with self._connect() as conn:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE updated_at >= ? "
+                    f"AND key IN ({','.join('?' * len(batch))})",
+                    (self._fresh_after(), *batch),
+                ).fetchall()
+                found.update((k, json.loads(v)) for k, v in rows)
+        return found
+
+    def set_many(self, items: List[Tuple[str, object]]):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, updated_at) VALUES (?, ?, ?)",
+                [(k, json.dumps(v), now) for k, v in items],
+            )
+
+    def retain(self, keys) -> int:
+        """Delete every row whose key is not in keys; returns rows removed."""
+        keep = set(keys)
+        with self._connect() as conn:
+            stale = [(k,) for (k,) in conn.execute(f"SELECT key FROM {self.table}") if k not in keep]
+            conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", stale)
+        return len(stale)
+
+    def recent(self, limit: int) -> List[Tuple[str, object]]:
+        """Most recently written unexpired rows, newest first (for warm-loading)."""
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE updated_at < ?", (self._fresh_after(),))
+            rows = conn.execute(
+                f"SELECT key, value FROM {self.table} ORDER BY updated_at DESC LIMIT ?", (int(limit),)
+            ).fetchall()
+        return [(k, json.loads(v)) for k, v in rows]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return int(conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0])
+
+
+class LRUCache:
+    """Thread-safe LRU cache with optional TTL and hit/miss/eviction counters.
+
+    A single instance is shared by every session through the RoutingEngine.
+    With a SQLiteStore backing, writes go through to disk and memory misses
+    fall back to the store, so entries survive restarts.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float | None = None, backing: SQLiteStore | None = None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl_seconds = float(ttl_seconds) if ttl_seconds else None
+        self.backing = backing
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.backing_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is not self._MISSING:
+                value, stored_at = item
+                if self.ttl_seconds is None or time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+        if self.backing is not None:
+            try:
+                value = self.backing.get(key)
+            except Exception:
+                value = None
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.backing_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backing is not None:
+            try:
+                self.backing.set(key, value)
+            except Exception:
+                pass
+
+    def warm(self, limit: int | None = None) -> int:
+        """Preload the most recent backing rows into memory; returns rows loaded."""
+        if self.backing is None:
+            return 0
+        try:
+            rows = self.backing.recent(limit or self.maxsize)
+        except Exception:
+            return 0
+        for key, value in reversed(rows):
+            self._store(key, value)
+        return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self.backing is not None:
+            try:
+                self.backing.clear()
+            except Exception:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "backing_hits": self.backing_hits,
+                "persistent": self.backing is not None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class EmbeddingCache:
+    """Content-addressed on-disk store of L2-normalized embeddings for one model.
+
+    Rows live in append-only shards under <dir>/<model>/. Each shard is a
+    single .npy record array of (sha256(text), vector) pairs, written under a
+    temp name and renamed into place, so a key is never paired with another
+    writer's vector; shards are memory-mapped on load. embed() only calls the
+    model for texts that are not cached yet and writes just those rows as a
+    new shard. Past MAX_SHARDS the smaller half is merged, so large shards are
+    not rewritten by every append; retain() drops rows nothing references.
+    """
+
+    MAX_SHARDS = 16
+
+    def __init__(self, cache_dir: str, model_name: str):
+        slug = re.sub(r"[^\w.-]+", "_", model_name)
+        base = Path(cache_dir)
+        self.model_name = model_name
+        self.shard_dir = base / slug
+        self._legacy = (base / f"{slug}.npy", base / f"{slug}.json")
+        self._lock = threading.Lock()
+        self._shards: dict = {}  # shard id -> (path or None when not persisted, record array)
+        self._next_shard = 0
+        self._rows: dict = {}  # key (hex bytes) -> (shard id, row)
+        self.dim: int | None = None
+        self._load()
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _dtype(dim: int) -> np.dtype:
+        return np.dtype([("key", "S64"), ("vec", "<f4", (dim,))])
+
+    def _load(self):
+        for legacy in self._legacy:
+            try:
+                legacy.unlink(missing_ok=True)  # single-matrix layout of earlier versions
+            except OSError:
+                pass
+        try:
+            paths = sorted(self.shard_dir.glob("*.npy"))
+        except OSError:
+            return
+        shards = []
+        for path in paths:
+            try:
+                records = np.load(path, mmap_mode="r")
+                if records.dtype.names == ("key", "vec") and records["vec"].dtype == np.float32:
+                    shards.append((path, records))
+            except Exception:
+                continue  # unreadable or foreign file: ignored
+        if not shards:
+            return
+        # Names sort by creation time; rows embedded at an older dimension are stale
+        self.dim = int(shards[-1][1].dtype["vec"].shape[0])
+        for path, records in shards:
+            if records.dtype["vec"].shape[0] == self.dim:
+                self._add_shard(path, records)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _add_shard(self, path: Path | None, records: np.ndarray) -> int:
+        sid = self._next_shard
+        self._next_shard += 1
+        self._shards[sid] = (path, records)
+        for row, key in enumerate(records["key"]):
+            self._rows[bytes(key)] = (sid, row)
+        return sid
+
+    def embed(self, texts: List[str], embed_fn) -> np.ndarray:
+        """Return the normalized embedding matrix for texts, computing only misses."""
+        keys = [self.text_key(t).encode("ascii") for t in texts]
+        with self._lock:
+            missing: dict = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+            if missing:
+                vecs = self._normalized(embed_fn(list(missing.values())))
+                if self.dim is not None and self.dim != vecs.shape[1] and len(missing) < len(set(keys)):
+                    # The cached rows have another dimension and will be dropped: embed the whole batch
+                    missing = dict(zip(keys, texts))
+                    vecs = self._normalized(embed_fn(list(missing.values())))
+                self._append(list(missing.keys()), vecs)
+            locs = np.array([self._rows[k] for k in keys], dtype=np.int64).reshape(-1, 2)
+            out = np.empty((len(keys), self.dim or 0), dtype=np.float32)
+            for sid in np.unique(locs[:, 0]):
+                sel = np.flatnonzero(locs[:, 0] == sid)
+                out[sel] = self._shards[int(sid)][1]["vec"][locs[sel, 1]]
+            return out
+
+    @staticmethod
+    def _normalized(vectors) -> np.ndarray:
+        vecs = np.vstack(list(vectors))
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vecs / norms).astype(np.float32)
+
+    def _write_shard(self, records: np.ndarray) -> Tuple[Path | None, np.ndarray]:
+        """Persist records as a new shard; on a read-only or full disk keep them in memory."""
+        # Names are unique per process and call: the cache directory is shared by workers
+        name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}.npy"
+        path = self.shard_dir / name
+        tmp = path.with_name(f"{name}.tmp")
+        try:
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "wb") as fh:
+                np.save(fh, records)
+            os.replace(tmp, path)
+            return path, np.load(path, mmap_mode="r")
+        except Exception:
+            try:
+                tmp.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return None, records
+
+    def _drop_files(self, paths):
+        for path in paths:
+            if path is None:
+                continue
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                pass  # still mapped (Windows): merged again after the next load
+
+    def _append(self, keys: List[bytes], vecs: np.ndarray):
+        if self.dim is not None and self.dim != vecs.shape[1]:
+            # New dimension (model changed under the same name): every cached row is stale
+            self._drop_files(path for path, _ in self._shards.values())
+            self._shards, self._rows = {}, {}
+        self.dim = int(vecs.shape[1])
+        records = np.empty(len(keys), dtype=self._dtype(self.dim))
+        records["key"] = keys
+        records["vec"] = vecs
+        self._add_shard(*self._write_shard(records))
+        if len(self._shards) > self.MAX_SHARDS:
+            smallest = sorted(self._shards, key=lambda sid: len(self._shards[sid][1]))
+            self._merge(smallest[: self.MAX_SHARDS // 2 + 1])
+
+    def _merge(self, shard_ids: List[int], keep=None):
+        """Rewrite the live rows of shard_ids (only those in keep, when given) as one shard."""
+        parts = []
+        for sid in shard_ids:
+            path, records = self._shards.pop(sid)
+            live = []
+            for row, raw in enumerate(records["key"]):
+                key = bytes(raw)
+                if self._rows.get(key) != (sid, row):
+                    continue  # superseded by a later shard
+                del self._rows[key]
+                if keep is None or key in keep:
+                    live.append(row)
+            parts.append((path, np.asarray(records[live])))
+        merged = np.concatenate([records for _, records in parts])
+        path = None
+        if len(merged):
+            path, merged = self._write_shard(merged)
+            self._add_shard(path, merged)
+        if path is not None or not len(merged):
+            self._drop_files(old for old, _ in parts)
+
+    def retain(self, keys) -> int:
+        """Drop every row whose text key is not in keys; returns how many rows were dropped."""
+        keep = {k.encode("ascii") if isinstance(k, str) else k for k in keys}
+        with self._lock:
+            stale = sum(1 for key in self._rows if key not in keep)
+            if stale:
+                self._merge(list(self._shards), keep)
+            return stale
+
+
+class SemanticAnswerCache:
+    """LLM fallback answers keyed by the (normalized) query embedding.
+
+    lookup() serves the answer of the most similar cached query when its
+    cosine reaches `threshold`, it was generated under the same facts version
+    and its signature (entities in the question, retrieved chunks) matches
+    exactly, so paraphrases of one question cost a single Groq call. Rows
+    live in one preallocated float32 matrix (a lookup is one matrix-vector
+    product); when it is full the least recently used row is overwritten.
+    """
+
+    def __init__(self, capacity: int = 512, threshold: float = 0.92, ttl_seconds: float | None = None):
+        self.capacity = max(1, int(capacity))
+        self.threshold = float(threshold)
+        self.ttl_seconds = float(ttl_seconds) if ttl_seconds else None
+        self.matrix: np.ndarray | None = None  # allocated on first add, once the dimension is known
+        self.answers: List[str | None] = [None] * self.capacity
+        self.versions = np.full(self.capacity, "", dtype=object)
+        self.signatures = np.full(self.capacity, "", dtype=object)
+        self.valid = np.zeros(self.capacity, dtype=bool)
+        self.stored_at = np.zeros(self.capacity, dtype=np.float64)
+        self.last_used = np.zeros(self.capacity, dtype=np.float64)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _live(self, version: str, now: float, signature: str | None = None) -> np.ndarray:
+        live = self.valid & (self.versions == version)
+        if signature is not None:
+            live &= self.signatures == signature
+        if self.ttl_seconds is not None:
+            live &= now - self.stored_at <= self.ttl_seconds
+        return live
+
+    def lookup(self, vector: np.ndarray, version: str, signature: str = "") -> Tuple[str, float] | None:
+        """(answer, cosine) of the closest live entry with this signature at or above the threshold."""
+        now = time.monotonic()
+        with self._lock:
+            live = self._live(version, now, signature) if self.matrix is not None else None
+            if live is None or not live.any() or vector.shape[-1] != self.matrix.shape[1]:
+                self.misses += 1
+                return None
+            scores = np.where(live, self.matrix @ vector, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.last_used[best] = now
+            self.hits += 1
+            return self.answers[best], float(scores[best])
+
+    def add(self, vector: np.ndarray, version: str, answer: str, signature: str = ""):
+        now = time.monotonic()
+        with self._lock:
+            if self.matrix is None or self.matrix.shape[1] != vector.shape[-1]:
+                self.matrix = np.zeros((self.capacity, vector.shape[-1]), dtype=np.float32)
+                self.valid[:] = False
+            live = self._live(version, now)
+            same_signature = live & (self.signatures == signature)
+            if same_signature.any():
+                scores = np.where(same_signature, self.matrix @ vector, -np.inf)
+                same = int(np.argmax(scores))
+                slot = same if scores[same] >= 0.999 else None
+            else:
+                slot = None
+            if slot is None:
+                free = np.flatnonzero(~live)
+                if free.size:
+                    slot = int(free[0])
+                else:
+                    slot = int(np.argmin(self.last_used))
+                    self.evictions += 1
+            self.matrix[slot] = vector
+            self.answers[slot] = answer
+            self.versions[slot] = version
+            self.signatures[slot] = signature
+            self.valid[slot] = True
+            self.stored_at[slot] = now
+            self.last_used[slot] = now
+
+    def purge(self) -> int:
+        """Drop every entry; returns how many were live."""
+        with self._lock:
+            removed = int(self.valid.sum())
+            self.valid[:] = False
+            self.answers = [None] * self.capacity
+            return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self.valid.sum())
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": int(self.valid.sum()),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class RateLimiter:
+    """Non-blocking token buckets for remote calls (Groq, translator).
+
+    Each service has a global bucket and one bucket per session, refilled
+    continuously at `per_min / 60` tokens per second with a burst of one
+    minute's allowance. acquire() takes a token from every bucket or from
+    none and never sleeps. With db_path the buckets live in a SQLite table so
+    the limits hold across Streamlit worker processes.
+    """
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, limits: dict, db_path: str = ""):
+        # {service: (global_per_min, session_per_min)}; 0 disables that bucket
+        self.limits = limits
+        self.db_path = str(db_path or "")
+        self._buckets: dict = {}
+        self._lock = threading.Lock()
+        self.allowed: dict = {}
+        self.rejected: dict = {}
+        if self.db_path:
+            try:
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                with sqlite3.connect(self.db_path, timeout=5.0) as conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS rate_buckets "
+                        "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+                    )
+            except Exception:
+                self.db_path = ""
+
+    @staticmethod
+    def _take(state: dict, wanted: List[Tuple[str, float]], now: float) -> bool:
+        refilled = {}
+        for key, per_min in wanted:
+            tokens, updated_at = state.get(key, (per_min, now))
+            refilled[key] = min(per_min, tokens + max(0.0, now - updated_at) * per_min / 60.0)
+        ok = all(tokens >= 1.0 for tokens in refilled.values())
+        for key, tokens in refilled.items():
+            state[key] = (tokens - 1.0 if ok else tokens, now)
+        return ok
+
+    def _take_sqlite(self, wanted: List[Tuple[str, float]], now: float) -> bool:
+        conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            keys = [key for key, _ in wanted]
+            rows = conn.execute(
+                f"SELECT key, tokens, updated_at FROM rate_buckets WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+            state = {key: (tokens, updated_at) for key, tokens, updated_at in rows}
+            ok = self._take(state, wanted, now)
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                [(key, tokens, updated_at) for key, (tokens, updated_at) in state.items()],
+            )
+            # Buckets idle for an hour are full again; drop them
+            conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - 3600.0,))
+            conn.execute("COMMIT")
+            return ok
+        finally:
+            conn.close()
+
+    def acquire(self, service: str, session_id: str | None = None) -> bool:
+        global_per_min, session_per_min = self.limits.get(service, (0, 0))
+        wanted = []
+        if global_per_min > 0:
+            wanted.append((f"{service}:*", float(global_per_min)))
+        if session_id and session_per_min > 0:
+            wanted.append((f"{service}:{session_id}", float(session_per_min)))
+        ok = True
+        if wanted:
+            now = time.time()
+            try:
+                if not self.db_path:
+                    raise LookupError
+                ok = self._take_sqlite(wanted, now)
+            except Exception:
+                # No shared backend (or it is locked/unavailable): limit this process only
+                with self._lock:
+                    ok = self._take(self._buckets, wanted, now)
+                    if len(self._buckets) > self.MAX_BUCKETS:
+                        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < 60.0}
+        with self._lock:
+            counter = self.allowed if ok else self.rejected
+            counter[service] = counter.get(service, 0) + 1
+        return ok
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "sqlite" if self.db_path else "memory",
+                "allowed": dict(self.allowed),
+                "rejected": dict(self.rejected),
+            }
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one remote dependency.
+
+    Outcomes of the last `window` calls are kept; a call slower than
+    `slow_call_ms` counts as a failure. Once at least `min_calls` are in the
+    window and the failure rate reaches `failure_rate`, the breaker opens and
+    allow() refuses instantly for `open_seconds`. It then lets one probe
+    through (half-open): success closes it, failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        slow_call_ms: float = 10000.0,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.failure_rate = float(failure_rate)
+        self.slow_call_ms = float(slow_call_ms)
+        self.min_calls = max(1, int(min_calls))
+        self.open_seconds = float(open_seconds)
+        self.outcomes: deque = deque(maxlen=max(self.min_calls, int(window)))
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.open_seconds:
+                self.state = "half_open"
+                self.probe_started = now
+                return True
+            if self.state == "half_open" and now - self.probe_started >= self.open_seconds:
+                # The previous probe never reported back; let another one through
+                self.probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """Hand back a half-open probe that allow() granted but the caller never made."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.open_seconds  # next allow() probes again
+
+    def record(self, success: bool, elapsed_ms: float = 0.0):
+        failed = not success or elapsed_ms > self.slow_call_ms
+        with self._lock:
+            if self.state == "half_open":
+                if failed:
+                    self._open()
+                else:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                return
+            self.outcomes.append(failed)
+            if (
+                self.state == "closed"
+                and len(self.outcomes) >= self.min_calls
+                and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self.opens += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            retry_in = self.open_seconds - (time.monotonic() - self.opened_at) if self.state == "open" else 0.0
+            return {
+                "state": self.state,
+                "window_failures": sum(self.outcomes),
+                "window_calls": len(self.outcomes),
+                "opens": self.opens,
+                "rejected": self.rejected,
+                "retry_in_s": round(max(0.0, retry_in), 1),
+            }
+
+
+class SessionQuota:
+    """Identifies a session to the RateLimiter and records whether a remote call was refused.
+
+    `limited` is set when a call was refused (rate limit, open breaker) and
+    `degraded` when it was refused or failed; degraded replies are not cached.
+    """
+
+    def __init__(self, session_id: str | None = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.limited = False
+        self.degraded = False
+
+
+class GroqPool:
+    """One Groq client per process over a keep-alive httpx connection pool.
+
+    Every call gets explicit connect/read timeouts. Transient failures
+    (connection errors, timeouts, 429 and 5xx) are retried with full-jitter
+    exponential backoff, but only while the process-wide retry budget lasts:
+    each call earns `retry_ratio` of a retry, so during an outage retries
+    stay a small fraction of traffic instead of multiplying it.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 20.0,
+        max_retries: int = 2,
+        retry_ratio: float = 0.1,
+        retry_budget_max: float = 10.0,
+    ):
+        self.max_connections = int(max_connections)
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.max_retries = int(max_retries)
+        self.retry_ratio = float(retry_ratio)
+        self.retry_budget_max = float(retry_budget_max)
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=int(max_keepalive),
+                keepalive_expiry=float(keepalive_expiry),
+            ),
+            timeout=self.timeout(),
+        )
+        # Retries are handled here, against the shared budget, not by the SDK
+        self.client = Groq(api_key=api_key, http_client=self.http_client, timeout=self.timeout(), max_retries=0)
+        self._lock = threading.Lock()
+        self._retry_tokens = self.retry_budget_max
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.total_ms = 0.0
+
+    def timeout(self, read: float | None = None) -> httpx.Timeout:
+        return httpx.Timeout(read or self.read_timeout, connect=self.connect_timeout)
+
+    @staticmethod
+    def _retryable(exc: Exception) -> bool:
+        if isinstance(exc, APIConnectionError):  # includes APITimeoutError
+            return True
+        return isinstance(exc, APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+    def _take_retry(self) -> bool:
+        with self._lock:
+            if self._retry_tokens >= 1.0:
+                self._retry_tokens -= 1.0
+                self.retries += 1
+                return True
+            self.budget_exhausted += 1
+            return False
+
+    def complete(self, read_timeout: float | None = None, **kwargs):
+        """chat.completions.create(**kwargs) with per-call timeouts and budgeted retries.
+
+        With stream=True the result is a PooledStream: the call counts as in
+        flight until the stream is exhausted, fails or is closed.
+        """
+        with self._lock:
+            self.calls += 1
+            self._retry_tokens = min(self.retry_budget_max, self._retry_tokens + self.retry_ratio)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        handed_off = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = self.client.chat.completions.create(timeout=self.timeout(read_timeout), **kwargs)
+                    if kwargs.get("stream"):
+                        handed_off = True
+                        return PooledStream(self, result, started)
+                    return result
+                except Exception as exc:
+                    if attempt >= self.max_retries or not self._retryable(exc) or not self._take_retry():
+                        self._failed()
+                        raise
+                time.sleep(random.uniform(0.0, min(2.0, 0.25 * 2 ** attempt)))
+        finally:
+            if not handed_off:
+                self._finished(started)
+
+    def _failed(self):
+        with self._lock:
+            self.errors += 1
+
+    def _finished(self, started: float):
+        with self._lock:
+            self.in_flight -= 1
+            self.total_ms += (time.perf_counter() - started) * 1000.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "retry_budget": round(self._retry_tokens, 2),
+                "retry_budget_exhausted": self.budget_exhausted,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "max_connections": self.max_connections,
+                "utilisation": round(self.in_flight / self.max_connections, 3),
+                "avg_call_ms": round(self.total_ms / self.calls, 1) if self.calls else None,
+            }
+
+
+class PooledStream:
+    """A Groq response stream that holds its GroqPool slot until it is consumed.
+
+    Exhausting, failing or closing the stream (or dropping it) releases the
+    slot once, so in-flight counts and call durations cover the whole stream.
+    """
+
+    def __init__(self, pool: GroqPool, stream, started: float):
+        self._pool = pool
+        self._stream = stream
+        self._started = started
+        self._open = True
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        except Exception:
+            self._pool._failed()
+            raise
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._open:
+            return
+        self._open = False
+        try:
+            self._stream.close()
+        except Exception:
+            pass
+        self._pool._finished(self._started)
+
+    def __del__(self):
+        self.close()
+
+
+class StreamingAnswer:
+    """An LLM reply that arrives as text deltas (Groq stream=True).
+
+    Iterating yields the deltas (main() hands it to st.write_stream) while the
+    full text accumulates in .text; callbacks registered with on_complete get
+    the final text once the stream is exhausted. If the stream yields nothing
+    or breaks off, `fallback` is emitted instead / appended and .failed is set.
+    """
+
+    def __init__(self, deltas: Iterator[str], fallback: str = "", on_error=None):
+        self._deltas = deltas
+        self.fallback = fallback
+        self.on_error = on_error
+        self.parts: List[str] = []
+        self.done = False
+        self.failed = False
+        self.first_token_ms: float | None = None
+        self.total_ms: float | None = None
+        self._started = time.perf_counter()
+        self._callbacks: list = []
+
+    def on_complete(self, callback):
+        self._callbacks.append(callback)
+
+    def __iter__(self) -> Iterator[str]:
+        if self.done:
+            yield self.text
+            return
+        try:
+            for delta in self._deltas:
+                if not delta:
+                    continue
+                if self.first_token_ms is None:
+                    self.first_token_ms = (time.perf_counter() - self._started) * 1000.0
+                self.parts.append(delta)
+                yield delta
+        except Exception:
+            self.failed = True
+            if self.on_error is not None:
+                self.on_error()
+        if not self.text:
+            self.failed = True
+            self.parts = [self.fallback]
+            yield self.fallback
+        elif self.failed and self.fallback:
+            self.parts.append(f"\n\n{self.fallback}")
+            yield self.parts[-1]
+        self.done = True
+        self.total_ms = (time.perf_counter() - self._started) * 1000.0
+        for callback in self._callbacks:
+            try:
+                callback(self.text)
+            except Exception:
+                pass
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts).strip()
+
+    def consume(self) -> str:
+        """Drain the stream without rendering it (offline callers) and return the text."""
+        for _ in self:
+            pass
+        return self.text
+
+
+class QuantizedIndex:
+    """Per-row scaled int8 copy of an L2-normalized float32 matrix.
+
+    Queries scan the int8 codes (a quarter of the float32 size) for an
+    approximate score, then rescore the best `candidates` rows exactly against
+    the float32 matrix. That matrix is usually a memory-map, so only the
+    rescored rows are paged in.
+    """
+
+    BLOCK_ROWS = 8192
+
+    def __init__(self, exact: np.ndarray, candidates: int = 32):
+        self.exact = exact
+        self.candidates = max(1, int(candidates))
+        n = exact.shape[0] if exact.ndim == 2 else 0
+        self.codes = np.zeros((n, exact.shape[1] if n else 0), dtype=np.int8)
+        self.scales = np.ones(n, dtype=np.float32)
+        for start in range(0, n, self.BLOCK_ROWS):
+            block = np.asarray(exact[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            peak = np.abs(block).max(axis=1)
+            peak[peak == 0] = 1.0
+            scale = peak / 127.0
+            self.scales[start:start + len(block)] = scale
+            self.codes[start:start + len(block)] = np.round(block / scale[:, None]).astype(np.int8)
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.scales.nbytes)
+
+    def approx_scores(self, q_vec: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.BLOCK_ROWS):
+            block = self.codes[start:start + self.BLOCK_ROWS]
+            scores[start:start + len(block)] = (block.astype(np.float32) @ q_vec) * self.scales[start:start + len(block)]
+        return scores
+
+    def search(self, q_vec: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """(row, exact cosine) of the k best rows, best first."""
+        n = len(self)
+        k = min(k, n)
+        if k <= 0:
+            return []
+        pool = min(n, max(k, self.candidates))
+        approx = self.approx_scores(q_vec)
+        rows = np.argpartition(-approx, pool - 1)[:pool] if pool < n else np.arange(n)
+        rows.sort()  # sequential reads from the memory-mapped float rows
+        exact = np.asarray(self.exact[rows], dtype=np.float32) @ q_vec
+        order = np.argsort(-exact, kind="stable")[:k]
+        return [(int(rows[i]), float(exact[i])) for i in order]
+
+
+class KnowledgeIndex:
+    """Immutable RAG snapshot: chunks, their embedding matrix and per-file rows.
+
+    Rebuilds create a new instance and RoutingEngine swaps the reference in one
+    assignment, so retrievals already running keep the snapshot they started with.
+    """
+
+    def __init__(self, chunks: List[Tuple[str, str]] | None = None, vectors: np.ndarray | None = None,
+                 files: dict | None = None, quantized: QuantizedIndex | None = None, digests: dict | None = None):
+        self.chunks: List[Tuple[str, str]] = chunks or []
+        self.vectors: np.ndarray = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self.quantized = quantized
+        # source -> (first_row, end_row) into chunks/vectors
+        self.files: dict = files or {}
+        # source -> sha256 of the file content these rows were built from
+        self.digests: dict = digests or {}
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+
+class VectorStoreIndex:
+    """Read-only binary view of the llama-index style store persisted in storage/.
+
+    compile() parses default__vector_store.json, docstore.json and
+    index_store.json once and writes vectors.npy (L2-normalized float32),
+    texts.bin + offsets.npy (UTF-8 node texts) and meta.json (node ids and
+    docstore metadata). open() memory-maps those files, so no JSON floats are
+    parsed at startup and texts are decoded only for the rows a query returns.
+    """
+
+    SOURCE_FILES = ("default__vector_store.json", "docstore.json", "index_store.json")
+
+    def __init__(self, out_dir: Path, meta: dict):
+        self.meta = meta
+        self.nodes: List[dict] = meta["nodes"]
+        self.vectors: np.ndarray = np.load(out_dir / "vectors.npy", mmap_mode="r")
+        self.offsets: np.ndarray = np.load(out_dir / "offsets.npy")
+        self._blob = np.memmap(out_dir / "texts.bin", dtype=np.uint8, mode="r") if self.offsets[-1] else None
+        self.quantized: QuantizedIndex | None = None
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def text(self, i: int) -> str:
+        if self._blob is None:
+            return ""
+        return bytes(self._blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def source(self, i: int) -> str:
+        node = self.nodes[i]
+        md = node.get("metadata") or {}
+        return md.get("file_name") or md.get("file_path") or node.get("ref_doc_id") or node["id"]
+
+    @classmethod
+    def fingerprint(cls, storage_dir: Path) -> str:
+        parts = []
+        for name in cls.SOURCE_FILES:
+            st_ = (storage_dir / name).stat()
+            parts.append(f"{name}:{st_.st_size}:{st_.st_mtime_ns}")
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def compile(cls, storage_dir, out_dir) -> dict:
+        """Convert the JSON store into the binary layout; raises ValueError on inconsistent node ids."""
+        storage_dir, out_dir = Path(storage_dir), Path(out_dir)
+        fingerprint = cls.fingerprint(storage_dir)
+        vector_store = json.loads((storage_dir / "default__vector_store.json").read_text(encoding="utf-8"))
+        docstore = json.loads((storage_dir / "docstore.json").read_text(encoding="utf-8"))
+        index_store = json.loads((storage_dir / "index_store.json").read_text(encoding="utf-8"))
+
+        # nodes_dict maps vector id -> docstore node id for every node the index owns
+        node_map: dict = {}
+        for entry in index_store.get("index_store/data", {}).values():
+            data = entry.get("__data__", {})
+            if isinstance(data, str):
+                data = json.loads(data)
+            node_map.update(data.get("nodes_dict", {}))
+        embeddings = vector_store.get("embedding_dict", {})
+        doc_data = docstore.get("docstore/data", {})
+        doc_meta = docstore.get("docstore/metadata", {})
+        missing_vectors = [vid for vid in node_map if vid not in embeddings]
+        missing_nodes = [nid for nid in node_map.values() if nid not in doc_data]
+        if missing_vectors or missing_nodes:
+            raise ValueError(
+                f"index_store.json lists {len(missing_vectors)} node(s) without embeddings "
+                f"and {len(missing_nodes)} without docstore text, e.g. {(missing_vectors + missing_nodes)[:3]}"
+            )
+        unindexed = set(embeddings) - set(node_map)
+        if unindexed:
+            raise ValueError(f"default__vector_store.json has {len(unindexed)} vector(s) not in index_store.json")
+        if not node_map:
+            raise ValueError("empty store: index_store.json lists no nodes")
+
+        nodes: List[dict] = []
+        blobs: List[bytes] = []
+        vecs: List[List[float]] = []
+        for vid, nid in node_map.items():
+            data = doc_data[nid].get("__data__", {})
+            blobs.append((data.get("text") or "").encode("utf-8"))
+            vecs.append(embeddings[vid])
+            nodes.append({
+                "id": nid,
+                "ref_doc_id": doc_meta.get(nid, {}).get("ref_doc_id"),
+                "doc_hash": doc_meta.get(nid, {}).get("doc_hash"),
+                "metadata": data.get("metadata", {}),
+            })
+        matrix = np.asarray(vecs, dtype=np.float32).reshape(len(vecs), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = np.ascontiguousarray(matrix / norms, dtype=np.float32)
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in blobs])
+        meta = {"fingerprint": fingerprint, "dim": int(matrix.shape[1]), "nodes": nodes}
+
+        # meta.json goes last: open() only trusts a directory whose meta matches the sources
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for name, write in (
+            ("vectors.npy", lambda fh: np.save(fh, matrix)),
+            ("offsets.npy", lambda fh: np.save(fh, offsets)),
+            ("texts.bin", lambda fh: fh.write(b"".join(blobs))),
+            ("meta.json", lambda fh: fh.write(json.dumps(meta, ensure_ascii=False).encode("utf-8"))),
+        ):
+            # Per-process temp names: several workers may compile the same store at once
+            tmp = out_dir / f"{name}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "wb") as fh:
+                    write(fh)
+                os.replace(tmp, out_dir / name)
+            finally:
+                tmp.unlink(missing_ok=True)
+        return meta
+
+    @classmethod
+    def open(cls, storage_dir, out_dir) -> "VectorStoreIndex | None":
+        """Memory-map the compiled store, recompiling first if storage/ changed; None if there is no store."""
+        storage_dir, out_dir = Path(storage_dir), Path(out_dir)
+        if not all((storage_dir / name).exists() for name in cls.SOURCE_FILES):
+            return None
+        try:
+            meta = json.loads((out_dir / "meta.json").read_text(encoding="utf-8"))
+            if meta.get("fingerprint") != cls.fingerprint(storage_dir):
+                meta = None
+        except Exception:
+            meta = None
+        if meta is None:
+            meta = cls.compile(storage_dir, out_dir)
+        return cls(out_dir, meta)
+
+
+class RoutingEngine:
+    """Read-only routing state shared by every session.
+
+    Holds the Groq client, the fastembed model and the intent/RAG indices.
+    Built once per process via get_routing_engine(); per-session state lives
+    in VisaAssistant.
+    """
+
     def __init__(self):
-        self.client = Groq(api_key=st.secrets["GROQ_API_KEY"])
-        self.daily_count = 0
-        self.last_call = 0
+        # One pooled keep-alive Groq client for the whole process
+        self.groq = GroqPool(
+            st.secrets["GROQ_API_KEY"],
+            max_connections=int(st.secrets.get("GROQ_MAX_CONNECTIONS", 20)),
+            max_keepalive=int(st.secrets.get("GROQ_MAX_KEEPALIVE", 10)),
+            keepalive_expiry=float(st.secrets.get("GROQ_KEEPALIVE_EXPIRY_S", 60)),
+            connect_timeout=float(st.secrets.get("GROQ_CONNECT_TIMEOUT_S", 3)),
+            read_timeout=float(st.secrets.get("GROQ_READ_TIMEOUT_S", 20)),
+            max_retries=int(st.secrets.get("GROQ_MAX_RETRIES", 2)),
+            retry_ratio=float(st.secrets.get("GROQ_RETRY_RATIO", 0.1)),
+            retry_budget_max=float(st.secrets.get("GROQ_RETRY_BUDGET", 10)),
+        )
+        self.client = self.groq.client
+        self.relevance_timeout = float(st.secrets.get("GROQ_RELEVANCE_TIMEOUT_S", 5))
+        # Minimum perceived reply time; faster answers are padded in the browser
+        # by a typing animation (never by sleeping the script thread)
         self.thinking_delay = float(st.secrets.get("THINKING_DELAY_MS", 900)) / 1000.0
         self.strict_mode = bool(st.secrets.get("STRICT_MODE", True))
-        self.smart_facts_mode = bool(st.secrets.get("SMART_FACTS_MODE", True))
+        self.smart_facts_mode = bool(st.secrets.get("SMART_FACTS_MODE", False))
         self.semantic_enabled = bool(st.secrets.get("SEMANTIC_ROUTER", True))
         self.semantic_threshold = float(st.secrets.get("SEMANTIC_THRESHOLD", 86))
         self.semantic_entries: List[Tuple[str, str]] = []
+        self.semantic_choices: List[str] = []
 
         self.embedding_enabled = bool(st.secrets.get("EMBEDDING_ROUTER", True))
         self.embedding_threshold = float(st.secrets.get("EMBEDDING_THRESHOLD", 0.58))
         self._embedder = None
         self.embedding_entries: List[Tuple[str, str]] = []
-        self.embedding_vectors: List[List[float]] = []
+        self.embedding_matrix: np.ndarray = np.zeros((0, 0), dtype=np.float32)
+        # EMBEDDING_QUANTIZATION="int8": indices are scanned as int8 codes and the top
+        # QUANT_RESCORE_CANDIDATES rows rescored against float32 rows memory-mapped from disk
+        self.embedding_quantization = str(st.secrets.get("EMBEDDING_QUANTIZATION", "none")).lower()
+        self.quant_candidates = int(st.secrets.get("QUANT_RESCORE_CANDIDATES", 32))
+        self.embedding_quantized: QuantizedIndex | None = None
         
         self.rag_enabled = bool(st.secrets.get("RAG_ENABLED", False))
         self.rag_top_k = int(st.secrets.get("RAG_TOP_K", 4))
+        self.rag_min_score = float(st.secrets.get("RAG_MIN_SCORE", 0.35))
         self.rag_knowledge_dir = st.secrets.get("KNOWLEDGE_DIR", "knowledge")
-        self.rag_chunks: List[Tuple[str, str]] = []
-        self.rag_vectors: List[List[float]] = []
+        self.embedding_cache_enabled = bool(st.secrets.get("EMBEDDING_CACHE_ENABLED", True))
+        self.embedding_cache_dir = st.secrets.get("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+        self._embedding_caches: dict = {}
+        # Knowledge files are indexed incrementally: the manifest records each file's
+        # mtime/size/hash and chunk ids, chunk texts persist in SQLite, so only added,
+        # changed or deleted files are re-chunked and re-embedded.
+        self.rag_cache_dir = Path(st.secrets.get("RAG_CACHE_DIR", ".cache/knowledge"))
+        self.rag_background_build = bool(st.secrets.get("RAG_BACKGROUND_BUILD", True))
+        self.rag_refresh_interval = float(st.secrets.get("RAG_REFRESH_INTERVAL_S", 300))
+        self.rag_chunk_chars = max(200, int(st.secrets.get("RAG_CHUNK_CHARS", 900)))
+        self.rag_chunk_overlap = min(int(st.secrets.get("RAG_CHUNK_OVERLAP", 150)), self.rag_chunk_chars // 2)
+        self.rag_embed_batch = max(1, int(st.secrets.get("RAG_EMBED_BATCH", 64)))
+        self.rag_chunker_id = f"sentence-{self.rag_chunk_chars}-{self.rag_chunk_overlap}"
+        self.rag_index = KnowledgeIndex()
+        self.knowledge_version = ""
+        # Prebuilt llama-index store (storage/), compiled once into a memory-mapped binary index
+        self.storage_index_enabled = bool(st.secrets.get("STORAGE_INDEX_ENABLED", False))
+        self.storage_dir = st.secrets.get("STORAGE_DIR", "storage")
+        self.storage_cache_dir = st.secrets.get("STORAGE_CACHE_DIR", ".cache/storage")
+        self.storage_index: VectorStoreIndex | None = None
+        self.storage_index_error: str | None = None
+        self._rag_chunk_store: SQLiteStore | None = None
+        self._rag_build_lock = threading.Lock()
+        self._rag_last_scan = 0.0
+        self._rag_last_build: dict = {}
+        self.fallback_model = st.secrets.get("FALLBACK_MODEL", "llama-3.3-70b-versatile")
+        self.fallback_max_tokens = int(st.secrets.get("FALLBACK_MAX_TOKENS", 400))
+        # Stream fallback replies token by token (rendered with st.write_stream)
+        self.llm_streaming = bool(st.secrets.get("LLM_STREAMING", True))
         
         self.domain_gating_enabled = bool(st.secrets.get("DOMAIN_GATING_ENABLED", True))
         self.domain_min_len_for_offtopic = int(st.secrets.get("DOMAIN_MIN_LEN_FOR_OFFTOPIC", 6))
@@ -672,7 +1758,24 @@ class VisaAssistant:
         self.llm_relevance_enabled = bool(st.secrets.get("LLM_RELEVANCE_ENABLED", True))
         self.llm_relevance_model = st.secrets.get("LLM_RELEVANCE_MODEL", "llama-3.3-70b-versatile")
         self.llm_relevance_fail_open = bool(st.secrets.get("LLM_RELEVANCE_FAIL_OPEN", True))
-        self._relevance_cache = {}
+        # Local classifier decides relevance; the LLM only breaks ties inside the band
+        self.relevance_classifier_enabled = bool(st.secrets.get("RELEVANCE_CLASSIFIER_ENABLED", True))
+        self.relevance_model_path = st.secrets.get("RELEVANCE_MODEL_PATH", "models/relevance_classifier.npz")
+        self.relevance_band_low = float(st.secrets.get("RELEVANCE_BAND_LOW", 0.35))
+        self.relevance_band_high = float(st.secrets.get("RELEVANCE_BAND_HIGH", 0.65))
+        self.relevance_classifier: RelevanceClassifier | None = None
+
+        # Speculative mode overlaps translation, local routing and the LLM tie-breaker
+        self.speculative_routing = bool(st.secrets.get("SPECULATIVE_ROUTING", True))
+        self.speculative_timeout = float(st.secrets.get("SPECULATIVE_TIMEOUT_S", 8))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(st.secrets.get("REMOTE_WORKERS", 8)), thread_name_prefix="state101-remote"
+        )
+        configured_stages = st.secrets.get("ROUTING_STAGES", DEFAULT_ROUTING_STAGES)
+        self.routing_stages = [s for s in configured_stages if s in DEFAULT_ROUTING_STAGES]
+        if not self.smart_facts_mode:
+            # Retrieval only feeds the facts fallback: without it, neither stage can answer
+            self.routing_stages = [s for s in self.routing_stages if s not in ("rag", "facts")]
         self.third_party_guard_enabled = bool(st.secrets.get("THIRD_PARTY_LOCATION_GUARD_ENABLED", True))
         self.third_party_place_terms = [
             "airport", "naia", "terminal", "runway", "jollibee", "mcdo", "mcdonald", "kfc",
@@ -702,53 +1805,167 @@ class VisaAssistant:
             "math", "solve", "equation", "homework", "essay", "write a story"
         ]
 
-        self.intent_synonyms = {
-            "location": [
-                "where are you", "where are you located", "where is your office",
-                "office address", "address", "location", "map", "directions",
-                "find you", "tiktok", "tiktok location", "tiktok video", "google map"
-            ],
-            "hours": ["hours", "opening hours", "business hours", "schedule", "open time", "what time"],
-            "contact": ["contact", "phone", "phone number", "call you", "email", "email address"],
-            "website": ["website", "web site", "web page", "webpage", "website page"],
-            "services": ["services", "what services", "services do you offer"],
-            "legit": ["legit", "legitimacy", "is your company legit"],
-            "visa type": ["visa type", "what type of visa", "what types of visas"],
-            "qualifications": ["qualifications", "qualification", "what are the qualifications"],
-            "requirements": ["requirements", "documents", "needed documents", "prepare"],
-            "appointment": ["appointment", "book", "schedule appointment"],
-            "greeting": [
-                "hi", "hello", "hey", "good morning", "good afternoon", "good evening",
-                "greetings", "hola", "what's up", "whats up", "howdy", "sup"
-            ],
-            "goodbye": [
-                "bye", "goodbye", "see you", "farewell", "take care", "catch you",
-                "see you later", "later", "cya", "adios", "thanks", "thank you", "thx"
-            ],
-        }
+        self.pack = KNOWLEDGE_PACK
+        self.intent_synonyms = {name: spec["synonyms"] for name, spec in self.pack.intents.items()}
         
+        # Cached answers are keyed on the knowledge pack hash, so editing the
+        # responses or synonyms invalidates them without an explicit purge.
+        self.content_version = self.pack.source_hash[:16]
+        self.facts = self.pack_facts()
+        query_cache_size = int(st.secrets.get("QUERY_CACHE_SIZE", 2048))
+        query_cache_ttl = float(st.secrets.get("QUERY_CACHE_TTL_S", 3600))
+        self.query_embedding_cache = LRUCache(query_cache_size, query_cache_ttl)
+        self.answer_cache = LRUCache(query_cache_size, query_cache_ttl)
+        # LLM fallback answers, reused for paraphrases of an already answered question
+        self.semantic_answer_cache = (
+            SemanticAnswerCache(
+                int(st.secrets.get("SEMANTIC_ANSWER_CACHE_SIZE", 512)),
+                float(st.secrets.get("SEMANTIC_ANSWER_CACHE_THRESHOLD", 0.92)),
+                float(st.secrets.get("SEMANTIC_ANSWER_CACHE_TTL_S", 24 * 3600)),
+            )
+            if bool(st.secrets.get("SEMANTIC_ANSWER_CACHE_ENABLED", False)) else None
+        )
+
+        # Relevance verdicts are shared by all sessions; set RELEVANCE_CACHE_DB
+        # to also persist them in SQLite so they survive restarts.
+        relevance_ttl = float(st.secrets.get("RELEVANCE_CACHE_TTL_S", 7 * 24 * 3600))
+        relevance_size = int(st.secrets.get("RELEVANCE_CACHE_SIZE", 4096))
+        relevance_backing = None
+        relevance_db = st.secrets.get("RELEVANCE_CACHE_DB", "")
+        if relevance_db:
+            try:
+                relevance_backing = SQLiteStore(relevance_db, "relevance", relevance_ttl, relevance_size * 4)
+            except Exception:
+                relevance_backing = None
+        self.relevance_cache = LRUCache(relevance_size, relevance_ttl, backing=relevance_backing)
+        self.relevance_cache.warm()
+
+        # Translations persist in SQLite (shared across sessions and processes) so a
+        # phrase seen once is answered locally, even while the translator is down.
+        translation_ttl = float(st.secrets.get("TRANSLATION_CACHE_TTL_S", 30 * 24 * 3600))
+        translation_size = int(st.secrets.get("TRANSLATION_CACHE_SIZE", 4096))
+        translation_backing = None
+        translation_db = st.secrets.get("TRANSLATION_CACHE_DB", ".cache/translations.sqlite3")
+        if translation_db:
+            try:
+                translation_backing = SQLiteStore(
+                    translation_db, "translations", translation_ttl,
+                    int(st.secrets.get("TRANSLATION_CACHE_MAX_ROWS", 50000)),
+                )
+            except Exception:
+                translation_backing = None
+        self.translation_cache = LRUCache(translation_size, translation_ttl, backing=translation_backing)
+        self.translation_cache.warm()
+        self._counters: dict = {}
+        self._counters_lock = threading.Lock()
+
+        # Rate limits apply only to remote calls; over-limit calls degrade instead of waiting
+        self.rate_limiter = RateLimiter(
+            {
+                "groq": (
+                    int(st.secrets.get("RATE_LIMIT_GROQ_PER_MIN", 60)),
+                    int(st.secrets.get("RATE_LIMIT_GROQ_SESSION_PER_MIN", 10)),
+                ),
+                "translate": (
+                    int(st.secrets.get("RATE_LIMIT_TRANSLATE_PER_MIN", 120)),
+                    int(st.secrets.get("RATE_LIMIT_TRANSLATE_SESSION_PER_MIN", 20)),
+                ),
+            },
+            st.secrets.get("RATE_LIMIT_DB", ""),
+        )
+        # While a dependency's breaker is open its stages are skipped without waiting
+        breaker_settings = dict(
+            failure_rate=float(st.secrets.get("BREAKER_FAILURE_RATE", 0.5)),
+            window=int(st.secrets.get("BREAKER_WINDOW", 20)),
+            min_calls=int(st.secrets.get("BREAKER_MIN_CALLS", 5)),
+            open_seconds=float(st.secrets.get("BREAKER_OPEN_S", 30)),
+        )
+        self.breakers = {
+            "groq": CircuitBreaker(
+                "groq", slow_call_ms=float(st.secrets.get("GROQ_BREAKER_SLOW_MS", 10000)), **breaker_settings
+            ),
+            "translate": CircuitBreaker(
+                "translate", slow_call_ms=float(st.secrets.get("TRANSLATE_BREAKER_SLOW_MS", 3000)), **breaker_settings
+            ),
+        }
+
+        self._intent_matcher = PhraseMatcher(
+            [(intent, s) for intent, syns in self.intent_synonyms.items() for s in syns],
+            self._normalize,
+        )
+        self._lexicon_matcher = PhraseMatcher(
+            [(key, phrase) for key, phrases in TAGALOG_INTENT_LEXICON.items() for phrase in phrases],
+            self._normalize,
+        )
+        self.english_fastpath_ratio = float(st.secrets.get("ENGLISH_FASTPATH_RATIO", 0.6))
+        self._english_vocab = set(ENGLISH_FASTPATH_WORDS)
+        for phrase in (
+            [s for syns in self.intent_synonyms.values() for s in syns]
+            + list(HARDCODED_RESPONSES.keys()) + self.relevant_keywords + RELEVANCE_ONTOPIC_EXAMPLES
+        ):
+            self._english_vocab.update(self._normalize(phrase).split())
+
         if self.semantic_enabled:
             self._build_semantic_index()
-        if self.embedding_enabled:
-            self._build_embedding_index()
+
+        # fastembed loading and every embedding index are built by _warmup(). In the
+        # background, the exact/synonym/lexicon/rapidfuzz/keyword stages answer until
+        # models_ready is set; embed_route and the local relevance classifier switch
+        # on then. knowledge_ready follows once the first knowledge index build has
+        # finished (at once without RAG); only then is the engine reported ready and
+        # are routed answers cached.
+        self.models_ready = threading.Event()
+        self.knowledge_ready = threading.Event()
+        self.warmup_background = bool(st.secrets.get("MODEL_WARMUP_BACKGROUND", True))
+        self.warmup_error: str | None = None
+        self._warmup_started = time.monotonic()
+        self._warmup_seconds: float | None = None
+        if self.warmup_background:
+            threading.Thread(target=self._warmup, name="state101-warmup", daemon=True).start()
+        else:
+            self._warmup()
+
+    def _warmup(self):
+        try:
+            if self.embedding_enabled:
+                self._build_embedding_index()
+            if self.embedding_enabled and self.relevance_classifier_enabled:
+                self._load_relevance_classifier()
+            if self.rag_enabled and self.storage_index_enabled:
+                self._load_storage_index()
+        except Exception as e:
+            self.warmup_error = f"{type(e).__name__}: {e}"
+        finally:
+            self._warmup_seconds = round(time.monotonic() - self._warmup_started, 3)
+            self.models_ready.set()
         if self.rag_enabled:
-            self._build_rag_index()
+            # Already off the script thread when warming up in the background
+            self.refresh_knowledge(wait=self.warmup_background or not self.rag_background_build)
+        else:
+            self.knowledge_ready.set()
+
+    def fully_ready(self) -> bool:
+        """Models loaded and the first knowledge index built: every stage answers as configured."""
+        return self.models_ready.is_set() and self.knowledge_ready.is_set()
+
+    def health(self) -> dict:
+        """Readiness snapshot for health checks (?health=1) and the diagnostics panel."""
+        return {
+            "ready": self.fully_ready(),
+            "models_ready": self.models_ready.is_set(),
+            "knowledge_ready": self.knowledge_ready.is_set(),
+            "warmup_seconds": self._warmup_seconds,
+            "warmup_error": self.warmup_error,
+            "embedding_router": bool(self.embedding_enabled and self.embedding_matrix.size),
+            "relevance_classifier": self.relevance_classifier is not None,
+            "knowledge_chunks": len(self.rag_index),
+            "knowledge_rebuilding": self._rag_build_lock.locked(),
+        }
 
     def _build_semantic_index(self):
-        entries: List[Tuple[str, str]] = []
-        for intent, syns in self.intent_synonyms.items():
-            for s in syns:
-                entries.append((intent, s))
-        for key in HARDCODED_RESPONSES.keys():
-            entries.append((key, key))
-        seen = set()
-        deduped: List[Tuple[str, str]] = []
-        for intent, text in entries:
-            t = text.strip().lower()
-            if t and t not in seen:
-                seen.add(t)
-                deduped.append((intent, text))
-        self.semantic_entries = deduped
+        # Entries and their normalized text come precompiled with the knowledge pack
+        self.semantic_entries = self.pack.index_entries
+        self.semantic_choices = self.pack.normalized_entries
 
     def _import_fastembed(self):
         try:
@@ -763,37 +1980,94 @@ class VisaAssistant:
         except Exception:
             return None
 
-    def _l2_normalize(self, vec: List[float]) -> List[float]:
-        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
-        return [x / norm for x in vec]
+    def _l2_normalize(self, vecs) -> np.ndarray:
+        """L2-normalize a vector or the rows of a matrix into contiguous float32."""
+        arr = np.ascontiguousarray(vecs, dtype=np.float32)
+        norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return arr / norms
+
+    def _embed_corpus(self, embedder, texts: List[str]) -> np.ndarray:
+        """Embed index texts through the on-disk EmbeddingCache when enabled."""
+        if self.embedding_cache_enabled:
+            model_name = str(getattr(embedder, "model_name", None) or type(embedder).__name__)
+            cache = self._embedding_caches.get(model_name)
+            if cache is None:
+                cache = EmbeddingCache(self.embedding_cache_dir, model_name)
+                self._embedding_caches[model_name] = cache
+            return cache.embed(texts, embedder.embed)
+        return self._l2_normalize(np.vstack(list(embedder.embed(texts))))
+
+    def _get_embedder(self):
+        """The single fastembed model shared by the intent, relevance and RAG indices."""
+        if self._embedder is None:
+            TextEmbedding = self._import_fastembed()
+            if TextEmbedding is not None:
+                self._embedder = TextEmbedding()
+        return self._embedder
 
     def _build_embedding_index(self):
-        TextEmbedding = self._import_fastembed()
-        if TextEmbedding is None:
-            self.embedding_enabled = False
-            return
         try:
-            self._embedder = TextEmbedding()
-            entries: List[Tuple[str, str]] = []
-            for intent, syns in self.intent_synonyms.items():
-                for s in syns:
-                    entries.append((intent, s))
-            for key in HARDCODED_RESPONSES.keys():
-                entries.append((key, key))
-            seen = set()
-            deduped: List[Tuple[str, str]] = []
-            for intent, text in entries:
-                t = text.strip().lower()
-                if t and t not in seen:
-                    seen.add(t)
-                    deduped.append((intent, text))
-            self.embedding_entries = deduped
-            texts = [t for _, t in self.embedding_entries]
-            vectors = list(self._embedder.embed(texts))
-            self.embedding_vectors = [self._l2_normalize(list(v)) for v in vectors]
+            if self._get_embedder() is None:
+                self.embedding_enabled = False
+                return
+            self.embedding_entries = self.pack.index_entries
+            model_name = str(getattr(self._embedder, "model_name", None) or type(self._embedder).__name__)
+            matrix = self.pack.embeddings(model_name)
+            if matrix is None:
+                texts = [t for _, t in self.embedding_entries]
+                matrix = self._embed_corpus(self._embedder, texts)
+                self.pack.store_embeddings(model_name, matrix)
+            self.embedding_matrix, self.embedding_quantized = self._quantize("intents", matrix)
+            if self.embedding_quantized is not None:
+                # Rescoring reads the memory-mapped rows: the pack's resident float32 copy is not needed
+                self.pack.keep_embeddings(model_name, self.embedding_matrix)
         except Exception:
             self.embedding_enabled = False
 
+    def _relevance_training_set(self) -> Tuple[List[str], List[int], str]:
+        return relevance_training_set(self.pack)
+
+    def fit_relevance_classifier(self) -> RelevanceClassifier:
+        """Fit the relevance classifier on the labeled examples using the shared embedder."""
+        texts, labels, examples_hash = self._relevance_training_set()
+        X = self._embed_corpus(self._embedder, texts)
+        model_name = str(getattr(self._embedder, "model_name", None) or type(self._embedder).__name__)
+        return RelevanceClassifier.fit(X, np.array(labels), model_name, examples_hash)
+
+    def _load_relevance_classifier(self):
+        _, _, examples_hash = self._relevance_training_set()
+        model_name = str(getattr(self._embedder, "model_name", None) or type(self._embedder).__name__)
+        try:
+            clf = RelevanceClassifier.load(self.relevance_model_path)
+            if clf.model_name == model_name and clf.examples_hash == examples_hash:
+                self.relevance_classifier = clf
+                return
+        except Exception:
+            pass
+        # Missing or stale model file: fit in memory (a few hundred cached vectors)
+        try:
+            self.relevance_classifier = self.fit_relevance_classifier()
+        except Exception:
+            self.relevance_classifier = None
+
+    def classify_relevance(self, prompt: str) -> bool | None:
+        """Local relevance verdict, or None when unavailable or inside the uncertainty band."""
+        if self.relevance_classifier is None or not self.models_ready.is_set():
+            return None
+        try:
+            proba = self.relevance_classifier.predict_proba(self.embed_query(prompt))
+        except Exception:
+            return None
+        if proba >= self.relevance_band_high:
+            self._count("relevance_local_relevant")
+            return True
+        if proba <= self.relevance_band_low:
+            self._count("relevance_local_offtopic")
+            return False
+        self._count("relevance_uncertain")
+        return None
+
     def _list_knowledge_files(self) -> List[Path]:
         base = Path(self.rag_knowledge_dir)
         if not base.exists() or not base.is_dir():
@@ -805,133 +2079,757 @@ class VisaAssistant:
                 files.append(p)
         return files
 
-    def _read_text_file(self, p: Path) -> str:
+    def _file_digest(self, p: Path) -> str:
+        h = hashlib.sha256()
+        with open(p, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _iter_file_chunks(self, p: Path) -> Iterator[str]:
+        """Stream a knowledge file as sentence-aligned chunks of at most RAG_CHUNK_CHARS.
+
+        The file is read in bounded lines, so the reader holds at most a few
+        chunks of text no matter how long a line is.
+        Chunks close on sentence, list-item and paragraph boundaries; headings
+        always start a new chunk, and up to RAG_CHUNK_OVERLAP characters of
+        trailing sentences carry over into the next chunk of the same section.
+        Markdown frontmatter, tiny chunks and repeated chunks are skipped.
+        """
+        budget, overlap = self.rag_chunk_chars, self.rag_chunk_overlap
+        pieces: List[Tuple[bool, str]] = []  # (starts_paragraph, sentence) of the open chunk
+        size = 0
+        fresh = 0  # sentences added since the last close; carried overlap alone is not a chunk
+        seen = set()
+
+        def cost(par: bool, sentence: str) -> int:
+            # Characters a sentence adds to the chunk text, joiner included
+            return len(sentence) + (2 if par else 1)
+
+        def close(carry: bool) -> Iterator[str]:
+            nonlocal pieces, size, fresh
+            text = "".join(("\n\n" if par else " ") + sent for par, sent in pieces).strip() if fresh else ""
+            kept: List[Tuple[bool, str]] = []
+            if carry:
+                used = 0
+                for par, sent in reversed(pieces):
+                    used += cost(par, sent)
+                    if used > overlap:
+                        break
+                    kept.insert(0, (par, sent))
+            pieces, size, fresh = kept, sum(cost(par, sent) for par, sent in kept), 0
+            if len(text) >= 40 and text[:80] not in seen:
+                seen.add(text[:80])
+                yield text
+
+        def add(sentence: str, starts_paragraph: bool) -> Iterator[str]:
+            nonlocal size, fresh
+            if fresh and size + len(sentence) > budget:
+                yield from close(carry=True)
+            if size + len(sentence) > budget:
+                pieces.clear()
+                size = 0
+            pieces.append((starts_paragraph, sentence))
+            size += cost(starts_paragraph, sentence)
+            fresh += 1
+
+        pending = ""
+        new_paragraph = True
+
+        def drain(final: bool) -> Iterator[str]:
+            """Emit the complete sentences buffered in pending (all of it when final)."""
+            nonlocal pending, new_paragraph
+            parts = SENTENCE_BOUNDARY.split(pending)
+            pending = "" if final else parts.pop()
+            for sentence in parts:
+                pos = 0
+                while len(sentence) - pos > budget:
+                    # Over-long sentence: cut at the last space inside the budget
+                    cut = sentence.rfind(" ", pos, pos + budget)
+                    cut = cut if cut > pos else pos + budget
+                    yield from add(sentence[pos:cut].strip(), new_paragraph)
+                    new_paragraph = False
+                    pos = cut
+                tail = sentence[pos:].strip()
+                if tail:
+                    yield from add(tail, new_paragraph)
+                    new_paragraph = False
+
+        def flush_long() -> Iterator[str]:
+            """Flush an over-long pending line up to its last space.
+
+            The bounded readline may have cut the line mid-word; the partial
+            word stays pending so the next fragment completes it.
+            """
+            nonlocal pending
+            cut = pending.rfind(" ") if continued else -1
+            rest = pending[cut:].lstrip() if cut > 0 else ""
+            pending = pending[:cut] if cut > 0 else pending
+            yield from drain(final=True)
+            pending = rest
+
+        with open(p, "r", encoding="utf-8", errors="ignore") as fh:
+            in_frontmatter = False
+            continued = False
+            # Bounded reads: a huge single-line export arrives in pieces of a few chunks
+            for lineno, raw in enumerate(iter(lambda: fh.readline(4 * budget), "")):
+                if continued:
+                    # Rest of a line split by the bounded read: glue it on verbatim
+                    pending += raw.rstrip("\n")
+                    continued = not raw.endswith("\n")
+                    yield from drain(final=False)
+                    if len(pending) > budget:
+                        yield from flush_long()
+                    continue
+                continued = not raw.endswith("\n")
+                # Keep trailing whitespace of a split line: the word boundary may sit right there
+                line = raw.lstrip() if continued else raw.strip()
+                if lineno == 0 and line.strip() == "---":
+                    in_frontmatter = True
+                    continue
+                if in_frontmatter:
+                    in_frontmatter = line.strip() != "---"
+                    continue
+                if not line.strip() or line.startswith("#") or LIST_ITEM.match(line):
+                    yield from drain(final=True)
+                    new_paragraph = True
+                    if not line.strip():
+                        continue
+                    if line.startswith("#"):
+                        yield from close(carry=False)
+                pending = f"{pending} {line}" if pending else line
+                yield from drain(final=False)
+                # Guard against endless lines without sentence punctuation
+                if len(pending) > budget:
+                    yield from flush_long()
+        yield from drain(final=True)
+        yield from close(carry=False)
+
+    def _index_file(self, embedder, store: SQLiteStore | None, p: Path) -> Tuple[List[str], List[str], List[np.ndarray]]:
+        """Chunk, store and embed one file in RAG_EMBED_BATCH batches; returns (ids, texts, vector blocks).
+
+        Chunking and embedding work one batch at a time, but the returned texts
+        and vectors cover the whole file: they become rows of the in-memory index.
+        """
+        ids: List[str] = []
+        texts: List[str] = []
+        blocks: List[np.ndarray] = []
+        chunks = self._iter_file_chunks(p)
+        while True:
+            batch = list(islice(chunks, self.rag_embed_batch))
+            if not batch:
+                break
+            batch_ids = [EmbeddingCache.text_key(t) for t in batch]
+            if store is not None:
+                try:
+                    store.set_many(list(zip(batch_ids, batch)))
+                except Exception:
+                    self._count("rag_persist_errors")  # re-chunked from the file after a restart
+            blocks.append(self._embed_corpus(embedder, batch))
+            ids.extend(batch_ids)
+            texts.extend(batch)
+        return ids, texts, blocks
+
+    def _load_knowledge_manifest(self, model_name: str) -> dict:
         try:
-            return p.read_text(encoding="utf-8", errors="ignore")
+            manifest = json.loads((self.rag_cache_dir / "manifest.json").read_text(encoding="utf-8"))
+            if manifest.get("model") == model_name and manifest.get("chunker") == self.rag_chunker_id:
+                return manifest.get("files", {})
         except Exception:
-            try:
-                return p.read_text(errors="ignore")
-            except Exception:
-                return ""
+            pass
+        return {}
 
-    def _chunk_text(self, text: str, source: str, chunk_size: int = 900, overlap: int = 150) -> List[Tuple[str, str]]:
-        chunks: List[Tuple[str, str]] = []
-        t = text.strip()
-        if not t:
-            return chunks
-        start = 0
-        n = len(t)
-        while start < n:
-            end = min(n, start + chunk_size)
-            chunk = t[start:end]
-            chunks.append((source, chunk))
-            if end == n:
-                break
-            start = max(end - overlap, start + 1)
-        return chunks
+    def _save_knowledge_manifest(self, model_name: str, files: dict):
+        path = self.rag_cache_dir / "manifest.json"
+        # Per-process temp name: every worker rebuilds and saves the shared manifest
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        self.rag_cache_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            tmp.write_text(
+                json.dumps({"model": model_name, "chunker": self.rag_chunker_id, "files": files}, indent=1),
+                encoding="utf-8",
+            )
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
 
     def _build_rag_index(self):
-        files = self._list_knowledge_files()
-        if not files:
-            self.rag_enabled = False
+        """Bring the knowledge index up to date with KNOWLEDGE_DIR and swap it in.
+
+        Unchanged files (same mtime and size, or same hash) keep their chunk ids
+        and reuse rows from the live index, or their stored texts and cached
+        vectors after a restart; only new or edited files are chunked and embedded.
+        Live rows are reused only if they were built from the content hash the
+        manifest now records; the manifest is shared with other worker processes,
+        which may have re-indexed a file since this process loaded it.
+        """
+        embedder = self._get_embedder()
+        if embedder is None:
             return
+        started = time.perf_counter()
+        model_name = str(getattr(embedder, "model_name", None) or type(embedder).__name__)
+        if self._rag_chunk_store is None:
+            try:
+                self.rag_cache_dir.mkdir(parents=True, exist_ok=True)
+                self._rag_chunk_store = SQLiteStore(self.rag_cache_dir / "chunks.sqlite3", "knowledge_chunks")
+            except Exception:
+                # Read-only disk: index straight from the files (re-chunked after every restart)
+                self._count("rag_persist_errors")
+        store = self._rag_chunk_store
+        old_manifest = self._load_knowledge_manifest(model_name)
+        live = self.rag_index
+
+        manifest: dict = {}
+        fresh: dict = {}  # source -> (texts, vector blocks) for files indexed in this pass
+        stats = {"files": 0, "reused": 0, "rechunked": 0, "removed": 0, "reindexed_chunks": 0}
+        for f in sorted(self._list_knowledge_files()):
+            source = str(f)
+            try:
+                st_ = f.stat()
+                entry = old_manifest.get(source)
+                if entry and entry["mtime"] == st_.st_mtime and entry["size"] == st_.st_size:
+                    manifest[source] = entry
+                    stats["reused"] += 1
+                    continue
+                digest = self._file_digest(f)
+                if entry and entry["sha256"] == digest:
+                    manifest[source] = dict(entry, mtime=st_.st_mtime, size=st_.st_size)
+                    stats["reused"] += 1
+                    continue
+                ids, texts, blocks = self._index_file(embedder, store, f)
+            except Exception:
+                continue
+            fresh[source] = (texts, blocks)
+            manifest[source] = {"mtime": st_.st_mtime, "size": st_.st_size, "sha256": digest, "chunk_ids": ids}
+            stats["rechunked"] += 1
+        stats["files"] = len(manifest)
+        stats["removed"] = len(set(old_manifest) - set(manifest))
+
+        # Unchanged files after a restart: texts come from the chunk store
+        wanted = [
+            cid for source, entry in manifest.items()
+            if source not in fresh and (source not in live.files or live.digests.get(source) != entry["sha256"])
+            for cid in entry["chunk_ids"]
+        ]
+        stored: dict = {}
+        if wanted and store is not None:
+            try:
+                stored = store.get_many(wanted)
+            except Exception:
+                self._count("rag_persist_errors")
+
         chunks: List[Tuple[str, str]] = []
-        for f in files:
-            txt = self._read_text_file(f)
-            chunks.extend(self._chunk_text(txt, source=str(f)))
-        cleaned: List[Tuple[str, str]] = []
-        seen = set()
-        for src, ch in chunks:
-            c = ch.strip()
-            if len(c) < 40:
+        blocks: List[np.ndarray] = []
+        files: dict = {}
+        digests: dict = {}
+        for source, entry in manifest.items():
+            start = len(chunks)
+            ids = entry["chunk_ids"]
+            rows = live.files.get(source)
+            if source in fresh:
+                texts, file_blocks = fresh[source]
+                chunks.extend((source, t) for t in texts)
+                blocks.extend(file_blocks)
+                stats["reindexed_chunks"] += len(texts)
+            elif rows and live.digests.get(source) == entry["sha256"] and rows[1] - rows[0] == len(ids):
+                chunks.extend(live.chunks[rows[0]:rows[1]])
+                blocks.append(live.vectors[rows[0]:rows[1]])
+            else:
+                texts = [stored.get(cid) for cid in ids]
+                if all(texts):
+                    file_blocks = [self._embed_corpus(embedder, texts)] if texts else []
+                else:
+                    # Chunk store lost rows (deleted or corrupted cache): re-chunk the file
+                    try:
+                        ids, texts, file_blocks = self._index_file(embedder, store, Path(source))
+                    except Exception:
+                        ids, texts, file_blocks = [], [], []
+                    manifest[source] = dict(entry, chunk_ids=ids)
+                chunks.extend((source, t) for t in texts)
+                blocks.extend(file_blocks)
+                stats["reindexed_chunks"] += len(texts)
+            if len(chunks) > start:
+                files[source] = (start, len(chunks))
+                digests[source] = manifest[source]["sha256"]
+
+        vectors = (
+            np.ascontiguousarray(np.vstack(blocks), dtype=np.float32) if blocks
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        vectors, quantized = self._quantize("knowledge", vectors)
+        self.rag_index = KnowledgeIndex(chunks, vectors, files, quantized, digests)
+        self.knowledge_version = hashlib.sha256(
+            json.dumps(sorted((source, entry["chunk_ids"]) for source, entry in manifest.items())).encode("utf-8")
+        ).hexdigest()[:16]
+        # Persist only after the swap: a read-only or full disk must not discard the rebuilt index
+        try:
+            self._save_knowledge_manifest(model_name, manifest)
+            if store is not None:
+                store.retain(cid for entry in manifest.values() for cid in entry["chunk_ids"])
+        except Exception:
+            self._count("rag_persist_errors")  # the next build re-checks files against the old manifest
+        self._collect_embedding_cache(model_name, manifest)
+        stats["chunks"] = len(chunks)
+        stats["build_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+        self._rag_last_build = stats
+
+    def _collect_embedding_cache(self, model_name: str, manifest: dict):
+        """Drop cached embeddings of texts no index uses any more (edited or deleted chunks)."""
+        cache = self._embedding_caches.get(model_name)
+        if cache is None:
+            return
+        try:
+            referenced = {cid for entry in manifest.values() for cid in entry["chunk_ids"]}
+            referenced.update(EmbeddingCache.text_key(t) for _, t in self.pack.index_entries)
+            referenced.update(EmbeddingCache.text_key(t) for t in self._relevance_training_set()[0])
+            self._count("embedding_cache_gc_rows", cache.retain(referenced))
+        except Exception:
+            self._count("embedding_cache_gc_errors")
+
+    def refresh_knowledge(self, wait: bool = False) -> bool:
+        """Rebuild the knowledge index on a background thread.
+
+        Returns False when a rebuild is already running. The live index keeps
+        serving until the new one is swapped in.
+        """
+        if not self._rag_build_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self._build_rag_index()
+            except Exception:
+                self._count("rag_rebuild_errors")
+            finally:
+                self._rag_last_scan = time.monotonic()
+                self._rag_build_lock.release()
+                # Set after the first build, even a failed one (rag_rebuild_errors counts it)
+                self.knowledge_ready.set()
+
+        worker = threading.Thread(target=run, name="state101-knowledge-index", daemon=True)
+        worker.start()
+        if wait:
+            worker.join()
+        return True
+
+    def maybe_refresh_knowledge(self):
+        """Rescan KNOWLEDGE_DIR at most every RAG_REFRESH_INTERVAL_S seconds."""
+        if (
+            self.rag_enabled and self.rag_refresh_interval > 0
+            and self._rag_last_scan
+            and time.monotonic() - self._rag_last_scan >= self.rag_refresh_interval
+        ):
+            self.refresh_knowledge()
+
+    def _load_storage_index(self):
+        try:
+            store = VectorStoreIndex.open(self.storage_dir, self.storage_cache_dir)
+            if store is not None and self.embedding_quantization == "int8" and len(store):
+                store.quantized = QuantizedIndex(store.vectors, self.quant_candidates)
+            self.storage_index = store
+            self.storage_index_error = None
+        except Exception as e:
+            # Invalid, empty or unreadable store: knowledge/ retrieval keeps working without it
+            self._count("storage_index_errors")
+            self.storage_index = None
+            self.storage_index_error = f"{type(e).__name__}: {e}"
+
+    def _quantize(self, name: str, matrix: np.ndarray) -> Tuple[np.ndarray, QuantizedIndex | None]:
+        """With EMBEDDING_QUANTIZATION="int8", move matrix to a memory-mapped file and build its int8 codes."""
+        if self.embedding_quantization != "int8" or not matrix.size:
+            return matrix, None
+        try:
+            base = Path(self.embedding_cache_dir) / "quantized"
+            base.mkdir(parents=True, exist_ok=True)
+            # Content-named file: a rebuild never rewrites a file another index still maps
+            path = base / f"{name}-{hashlib.sha256(matrix.tobytes()).hexdigest()[:16]}.npy"
+            if not path.exists():
+                tmp = path.with_name(f"{path.name}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp")
+                try:
+                    with open(tmp, "wb") as fh:
+                        np.save(fh, matrix)
+                    os.replace(tmp, path)
+                finally:
+                    tmp.unlink(missing_ok=True)
+            # Lease the generation before mapping it so other workers' GC keeps it
+            (base / f"{path.stem}.{os.getpid()}.lease").touch()
+            matrix = np.load(path, mmap_mode="r")
+            self._collect_quantized(base, name, path)
+        except Exception:
+            pass  # keep the in-memory floats for rescoring
+        return matrix, QuantizedIndex(matrix, self.quant_candidates)
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        """Whether a process with this pid still runs (assumed yes where it cannot be checked)."""
+        if pid == os.getpid():
+            return True
+        if os.name == "nt":
+            return True  # os.kill(pid, 0) would terminate it on Windows
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True  # exists but belongs to another user
+        return True
+
+    def _collect_quantized(self, base: Path, name: str, current: Path) -> None:
+        """Delete older `name` generations that no live process holds a lease on.
+
+        Each process leases the generation it maps; leases of dead processes are
+        dropped first. This process keeps its own previous lease until its next
+        rebuild, so queries still scanning the old index are never cut off.
+        """
+        holders = {}
+        for lease in base.glob(f"{name}-*.lease"):
+            stem, _, pid = lease.stem.rpartition(".")
+            if not pid.isdigit() or not self._pid_alive(int(pid)):
+                lease.unlink(missing_ok=True)
                 continue
-            key = (src, c[:80])
-            if key in seen:
+            holders.setdefault(stem, []).append(lease)
+        for old in base.glob(f"{name}-*.npy"):
+            if old == current or old.stem in holders:
                 continue
-            seen.add(key)
-            cleaned.append((src, c))
-        self.rag_chunks = cleaned
+            try:
+                old.unlink()
+            except OSError:
+                pass  # still open somewhere (Windows); retried on the next build
+        mine = f".{os.getpid()}.lease"
+        for stem, leases in holders.items():
+            if stem != current.stem:
+                for lease in leases:
+                    if lease.name.endswith(mine):
+                        lease.unlink(missing_ok=True)  # our old generation is collectable next time
+
+    def _vector_search(self, matrix: np.ndarray, q_vec: np.ndarray, k: int,
+                       quantized: QuantizedIndex | None = None) -> List[Tuple[int, float]]:
+        """(row, cosine) of the k best rows, best first: int8 scan + exact rescoring when quantized."""
+        if quantized is not None:
+            return quantized.search(q_vec, k)
+        scores = matrix @ q_vec
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def _top_rows(self, matrix: np.ndarray, q_vec: np.ndarray, k: int,
+                  quantized: QuantizedIndex | None = None) -> List[Tuple[int, float]]:
+        """(row, score) of the k best rows at or above RAG_MIN_SCORE, best first."""
+        return [(i, score) for i, score in self._vector_search(matrix, q_vec, k, quantized) if score >= self.rag_min_score]
+
+    def retrieve(self, prompt: str, k: int | None = None) -> List[Tuple[str, str, float]]:
+        """Return up to k (source, chunk, score) knowledge chunks, best first."""
+        index, store = self.rag_index, self.storage_index
+        if not self.rag_enabled or not self.models_ready.is_set() or (not index.vectors.size and store is None):
+            return []
+        k = k or self.rag_top_k
+        q_vec = self.embed_query(prompt)
+        hits: List[Tuple[str, str, float]] = []
+        if index.vectors.size:
+            hits.extend((index.chunks[i][0], index.chunks[i][1], score) for i, score in self._top_rows(index.vectors, q_vec, k, index.quantized))
+        # A store embedded with a different model (other dimension) cannot be scored
+        if store is not None and store.dim == q_vec.shape[0]:
+            hits.extend((store.source(i), store.text(i), score) for i, score in self._top_rows(store.vectors, q_vec, k, store.quantized))
+        hits.sort(key=lambda hit: -hit[2])
+        return hits[:k]
+
+    def pack_facts(self) -> dict:
+        """Compact FACTS snapshot for the fallback, taken from HARDCODED_RESPONSES."""
+        keys = [
+            "location", "hours", "contact", "services", "legit", "visa type", "qualifications",
+            "age limit", "gender", "graduates", "requirements", "appointment", "walk in",
+            "what happens after", "application status", "nationwide", "price", "payment methods",
+            "consultation free", "orientation", "other countries", "social media", "scammers",
+        ]
+        return {key: HARDCODED_RESPONSES[key] for key in keys if key in HARDCODED_RESPONSES}
+
+    def facts_version(self) -> str:
+        """Version of everything the facts fallback is grounded on (knowledge pack + knowledge files)."""
+        return f"{self.content_version}:{self.knowledge_version}"
+
+    @staticmethod
+    def answer_entities(prompt: str) -> List[str]:
+        """Countries, visa types and numbers named in a question (see ANSWER_CACHE_ENTITY_TERMS)."""
+        text = f" {normalize_text(prompt)} "
+        found = {canon for term, canon in ANSWER_CACHE_ENTITY_TERMS.items() if f" {term} " in text}
+        found.update(re.findall(r"\d+", text))
+        return sorted(found)
+
+    def answer_signature(self, prompt: str, context: List[Tuple[str, str, float]]) -> str:
+        """What must match exactly before a cached LLM answer is reused: entities and retrieved chunks."""
+        chunks = sorted(hashlib.sha1(f"{source}\0{chunk}".encode("utf-8")).hexdigest()[:12] for source, chunk, _ in context)
+        return "|".join([",".join(self.answer_entities(prompt)), ",".join(chunks)])
+
+    def cached_llm_answer(self, prompt: str, context: List[Tuple[str, str, float]]) -> str | None:
+        """A previous LLM answer to a near-identical question under the current facts, if any."""
+        if self.semantic_answer_cache is None or not self.models_ready.is_set() or self._embedder is None:
+            return None
+        try:
+            hit = self.semantic_answer_cache.lookup(
+                self.embed_query(prompt), self.facts_version(), self.answer_signature(prompt, context)
+            )
+        except Exception:
+            return None
+        return hit[0] if hit else None
 
-        TextEmbedding = self._import_fastembed()
-        if TextEmbedding is None:
-            self.rag_vectors = []
+    def remember_llm_answer(self, prompt: str, context: List[Tuple[str, str, float]], answer: str):
+        if self.semantic_answer_cache is None or not answer or not self.models_ready.is_set() or self._embedder is None:
             return
         try:
-            embedder = TextEmbedding()
-            texts = [c for _, c in self.rag_chunks]
-            vecs = list(embedder.embed(texts))
-            self.rag_vectors = [self._l2_normalize(list(v)) for v in vecs]
+            self.semantic_answer_cache.add(
+                self.embed_query(prompt), self.facts_version(), answer, self.answer_signature(prompt, context)
+            )
+        except Exception:
+            pass
+
+    def purge_answer_caches(self) -> dict:
+        """Admin purge (?purge_cache=<ADMIN_TOKEN>): drop routed and LLM-generated answers."""
+        purged = {"answer_cache": len(self.answer_cache)}
+        self.answer_cache.clear()
+        if self.semantic_answer_cache is not None:
+            purged["semantic_answer_cache"] = self.semantic_answer_cache.purge()
+        return purged
+
+    def _facts_messages(self, prompt: str, context: List[Tuple[str, str, float]]) -> List[dict]:
+        excerpts = "\n\n".join(
+            f"[{i}] ({Path(source).name}) {chunk}" for i, (source, chunk, _) in enumerate(context, 1)
+        )
+        content = (
+            f"FACTS:\n{json.dumps(self.facts, ensure_ascii=False, indent=1)}\n\n"
+            f"CONTEXT:\n{excerpts or '(none)'}\n\n"
+            f"Question: {prompt}"
+        )
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT + FACTS_FALLBACK_RULES},
+            {"role": "user", "content": content},
+        ]
+
+    def facts_answer(
+        self, prompt: str, context: List[Tuple[str, str, float]], quota: SessionQuota | None = None
+    ) -> str | None:
+        """Facts-backed LLM fallback grounded on FACTS plus the retrieved chunks."""
+        if not self.smart_facts_mode or not self.allow_remote("groq", quota):
+            return None
+        try:
+            self._count("facts_llm_calls")
+            resp = self._remote_call(
+                "groq",
+                self.groq.complete,
+                model=self.fallback_model,
+                messages=self._facts_messages(prompt, context),
+                temperature=0.2,
+                max_tokens=self.fallback_max_tokens,
+            )
+            answer = (resp.choices[0].message.content or "").strip()
+        except Exception:
+            self._count("facts_llm_errors")
+            self._mark_degraded(quota)
+            return None
+        return answer or None
+
+    def facts_answer_stream(
+        self, prompt: str, context: List[Tuple[str, str, float]], quota: SessionQuota | None = None
+    ) -> StreamingAnswer | None:
+        """Streaming variant of facts_answer(); returns once the response has started.
+
+        A failure before the stream opens returns None so the cascade falls
+        through; a failure mid-stream ends the reply with the contact block.
+        """
+        if not self.smart_facts_mode or not self.allow_remote("groq", quota):
+            return None
+        breaker = self.breakers["groq"]
+        started = time.perf_counter()
+        try:
+            self._count("facts_llm_calls")
+            stream = self.groq.complete(
+                model=self.fallback_model,
+                messages=self._facts_messages(prompt, context),
+                temperature=0.2,
+                max_tokens=self.fallback_max_tokens,
+                stream=True,
+            )
         except Exception:
-            self.rag_vectors = []
+            breaker.record(False, (time.perf_counter() - started) * 1000.0)
+            self._count("facts_llm_errors")
+            self._mark_degraded(quota)
+            return None
+        deltas = (chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+        answer = StreamingAnswer(
+            deltas,
+            fallback=self.get_canonical_response("contact") or "",
+            on_error=lambda: self._count("facts_llm_errors"),
+        )
+        # The breaker judges the whole stream: mid-stream failures and total duration count
+        answer.on_complete(lambda _: breaker.record(not answer.failed, (time.perf_counter() - started) * 1000.0))
+        return answer
 
-    def _cosine_sim(self, a: List[float], b: List[float]) -> float:
-        return sum(x*y for x, y in zip(a, b))
+    def _cosine_sim(self, a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.dot(a, b))
 
     def _normalize(self, text: str) -> str:
-        return re.sub(r'[^\w\s]', '', text.lower()).strip()
+        return normalize_text(text)
+
+    def exact_route(self, prompt: str) -> str | None:
+        """Answer prompts that are literally one of the HARDCODED_RESPONSES keys."""
+        return self.pack.exact(self._normalize(prompt))
+
+    def lexicon_route(self, prompt: str) -> str | None:
+        """Answer common Tagalog/Taglish questions from TAGALOG_INTENT_LEXICON."""
+        hit = self._lexicon_matcher.match(self._normalize(prompt))
+        return self.get_canonical_response(hit[0]) if hit else None
+
+    def is_probably_english(self, prompt: str) -> bool:
+        """Offline check: most tokens are common English or domain vocabulary."""
+        tokens = self._normalize(prompt).split()
+        if not tokens:
+            return True
+        known = sum(1 for t in tokens if t in self._english_vocab or t.isdigit())
+        return known / len(tokens) >= self.english_fastpath_ratio
+
+    def needs_translation(self, prompt: str) -> bool:
+        return len(prompt.split()) > 2 and not self.is_probably_english(prompt)
+
+    def match_intent_phrase(self, prompt: str) -> Tuple[str, str] | None:
+        """Return (intent, synonym) for the first synonym found in the prompt."""
+        return self._intent_matcher.match(self._normalize(prompt))
 
     def match_intent(self, prompt: str) -> str | None:
-        norm = self._normalize(prompt)
-        for key, synonyms in self.intent_synonyms.items():
-            for s in synonyms:
-                s_norm = self._normalize(s)
-                pattern = r"\b" + re.escape(s_norm) + r"\b"
-                if re.search(pattern, norm):
-                    return key
-        return None
+        hit = self.match_intent_phrase(prompt)
+        return hit[0] if hit else None
 
     def get_canonical_response(self, intent: str) -> str | None:
-        if intent in HARDCODED_RESPONSES:
-            return HARDCODED_RESPONSES[intent]
-        mapping = {
-            "location": "location",
-            "hours": "hours",
-            "contact": "contact",
-            "website": "website",
-            "services": "services",
-            "legit": "legit",
-            "visa type": "visa type",
-            "qualifications": "qualifications",
-            "requirements": "requirements",
-            "appointment": "appointment",
-            "greeting": "hello",
-            "goodbye": "goodbye",
-        }
-        key = mapping.get(intent)
-        if key and key in HARDCODED_RESPONSES:
-            return HARDCODED_RESPONSES[key]
-        return None
+        return self.pack.answer(intent)
+
+    def semantic_candidates(self, prompt: str, k: int = 5, score_cutoff: float | None = None) -> List[Tuple[str, str, float]]:
+        """Return up to k (intent, phrase, score) fuzzy candidates, best first.
+
+        Scoring runs inside rapidfuzz; entries below score_cutoff (default:
+        SEMANTIC_THRESHOLD) are pruned there instead of in Python.
+        """
+        if not self.semantic_enabled or not self.semantic_choices:
+            return []
+        cutoff = self.semantic_threshold if score_cutoff is None else score_cutoff
+        hits = process.extract(
+            self._normalize(prompt),
+            self.semantic_choices,
+            scorer=fuzz.token_set_ratio,
+            processor=None,
+            limit=k,
+            score_cutoff=cutoff,
+        )
+        return [(self.semantic_entries[i][0], self.semantic_entries[i][1], float(score)) for _, score, i in hits]
 
     def semantic_route(self, prompt: str) -> str | None:
-        if not self.semantic_enabled:
+        if not self.semantic_enabled or not self.semantic_choices:
             return None
-        norm_prompt = self._normalize(prompt)
-        best_intent = None
-        best_score = -1.0
-        for intent, phrase in self.semantic_entries:
-            score = fuzz.token_set_ratio(norm_prompt, self._normalize(phrase))
-            if score > best_score:
-                best_score = score
-                best_intent = intent
-        if best_score >= self.semantic_threshold and best_intent:
-            return self.get_canonical_response(best_intent)
+        hit = process.extractOne(
+            self._normalize(prompt),
+            self.semantic_choices,
+            scorer=fuzz.token_set_ratio,
+            processor=None,
+            score_cutoff=self.semantic_threshold,
+        )
+        if hit:
+            return self.get_canonical_response(self.semantic_entries[hit[2]][0])
         return None
 
+    def _embedding_hits(self, prompt: str, k: int) -> List[Tuple[int, float]]:
+        """(entry index, cosine) of the k intent entries closest to the prompt."""
+        if not self.models_ready.is_set() or not self.embedding_enabled or not self.embedding_matrix.size:
+            return []
+        return self._vector_search(self.embedding_matrix, self.embed_query(prompt), k, self.embedding_quantized)
+
+    def embed_query(self, prompt: str) -> np.ndarray:
+        """Normalized query embedding, shared across sessions via query_embedding_cache."""
+        key = self._normalize(prompt)
+        q_vec = self.query_embedding_cache.get(key)
+        if q_vec is None:
+            q_vec = self._l2_normalize(next(iter(self._embedder.embed([prompt]))))
+            self.query_embedding_cache.set(key, q_vec)
+        return q_vec
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counters_lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def allow_remote(self, service: str, quota: SessionQuota | None = None) -> bool:
+        """Check the breaker and take a rate-limit token for one remote call.
+
+        Marks the quota when the call is refused, so the reply can degrade.
+        """
+        # Breaker first, so an open breaker does not spend rate-limit tokens
+        breaker = self.breakers[service]
+        if not breaker.allow():
+            self._count(f"breaker_skipped_{service}")
+        elif self.rate_limiter.acquire(service, quota.session_id if quota else None):
+            return True
+        else:
+            breaker.release()  # a refused call must not use up the half-open probe
+            self._count(f"rate_limited_{service}")
+        if quota is not None:
+            quota.limited = True
+            quota.degraded = True
+        return False
+
+    @staticmethod
+    def _mark_degraded(quota: SessionQuota | None):
+        if quota is not None:
+            quota.degraded = True
+
+    def _remote_call(self, service: str, fn, *args, **kwargs):
+        """Run one remote call and report its outcome and latency to the service's breaker."""
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.breakers[service].record(False, (time.perf_counter() - started) * 1000.0)
+            raise
+        self.breakers[service].record(True, (time.perf_counter() - started) * 1000.0)
+        return result
+
+    def metrics(self) -> dict:
+        """Cache counters for the routing diagnostics panel."""
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return {
+            "content_version": self.content_version,
+            "health": self.health(),
+            "counters": counters,
+            "answer_cache": self.answer_cache.stats(),
+            "semantic_answer_cache": (
+                self.semantic_answer_cache.stats() if self.semantic_answer_cache is not None else None
+            ),
+            "query_embedding_cache": self.query_embedding_cache.stats(),
+            "relevance_cache": self.relevance_cache.stats(),
+            "translation_cache": self.translation_cache.stats(),
+            "rate_limits": self.rate_limiter.stats(),
+            "groq_pool": self.groq.stats(),
+            "breakers": {name: breaker.stats() for name, breaker in self.breakers.items()},
+            "embedding_cache_rows": {name: len(c) for name, c in self._embedding_caches.items()},
+            "storage_index_nodes": len(self.storage_index) if self.storage_index is not None else None,
+            "storage_index_error": self.storage_index_error,
+            "quantization": self.embedding_quantization,
+            "knowledge_index": dict(
+                self._rag_last_build, live_chunks=len(self.rag_index), rebuilding=self._rag_build_lock.locked()
+            ),
+        }
+
+    def embed_top_k(self, prompt: str, k: int = 5) -> List[Tuple[str, str, float]]:
+        """Return up to k (intent, phrase, score) candidates, best first."""
+        try:
+            hits = self._embedding_hits(prompt, k)
+        except Exception:
+            return []
+        return [(self.embedding_entries[i][0], self.embedding_entries[i][1], score) for i, score in hits]
+
     def embed_route(self, prompt: str) -> str | None:
-        if not self.embedding_enabled or not self._embedder or not self.embedding_vectors:
-            return None
         try:
-            q_vec = list(self._embedder.embed([prompt]))[0]
-            q_vec = self._l2_normalize(list(q_vec))
-            best_idx = -1
-            best_score = -1.0
-            for i, v in enumerate(self.embedding_vectors):
-                score = sum(a*b for a, b in zip(q_vec, v))
-                if score > best_score:
-                    best_score = score
-                    best_idx = i
-            if best_idx >= 0 and best_score >= self.embedding_threshold:
-                intent = self.embedding_entries[best_idx][0]
+            hits = self._embedding_hits(prompt, 1)
+            if hits and hits[0][1] >= self.embedding_threshold:
+                intent = self.embedding_entries[hits[0][0]][0]
                 return self.get_canonical_response(intent)
         except Exception:
             return None
@@ -958,13 +2856,16 @@ class VisaAssistant:
             return best_key
         return None
 
+    def mentions_offtopic(self, prompt: str) -> bool:
+        normalized_prompt = prompt.lower()
+        return any(keyword in normalized_prompt for keyword in self.offtopic_keywords)
+
     def is_relevant_query(self, prompt):
         if not self.domain_gating_enabled:
             return True
         normalized_prompt = prompt.lower()
-        for keyword in self.offtopic_keywords:
-            if keyword in normalized_prompt:
-                return False
+        if self.mentions_offtopic(prompt):
+            return False
         greetings = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"]
         tokens = normalized_prompt.split()
         if any(g in normalized_prompt for g in greetings) and len(tokens) <= 3:
@@ -974,11 +2875,44 @@ class VisaAssistant:
             return False
         return True
 
-    def check_query_relevance(self, prompt: str) -> bool:
+    def translate_to_english(self, prompt: str, quota: SessionQuota | None = None) -> str:
+        """Detect the prompt's language and translate non-English prompts; never raises.
+
+        Over the translator rate limit, or while its breaker is open, the
+        prompt is returned untranslated.
+        """
         try:
-            cache_key = self._normalize(prompt)
-            if cache_key in self._relevance_cache:
-                return self._relevance_cache[cache_key]
+            if self.needs_translation(prompt):
+                lang = detect(prompt)
+                if lang != "en":
+                    cache_key = f"{lang}:{self._normalize(prompt)}"
+                    cached = self.translation_cache.get(cache_key)
+                    if cached is not None:
+                        return cached
+                    if not self.allow_remote("translate", quota):
+                        return prompt
+                    self._count("translations")
+                    translator = GoogleTranslator(source=lang, target="en")
+                    try:
+                        translated = self._remote_call("translate", translator.translate, prompt) or prompt
+                    except Exception:
+                        self._count("translation_errors")
+                        self._mark_degraded(quota)
+                        return prompt
+                    self.translation_cache.set(cache_key, translated)
+                    return translated
+        except Exception:
+            self._count("translation_errors")
+        return prompt
+
+    def check_query_relevance(self, prompt: str, quota: SessionQuota | None = None) -> bool:
+        try:
+            cache_key = f"{self.llm_relevance_model}:{self._normalize(prompt)}"
+            cached = self.relevance_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            if not self.allow_remote("groq", quota):
+                return self.llm_relevance_fail_open
             relevance_system = (
                 "You are a strict query filter for State101 Travel (US/Canada visa assistance). "
                 "Output exactly one token: RELEVANT or OFFTOPIC."
@@ -990,7 +2924,11 @@ class VisaAssistant:
                 f"User query: \"{prompt}\"\n\n"
                 "Answer: RELEVANT or OFFTOPIC"
             )
-            resp = self.client.chat.completions.create(
+            self._count("relevance_llm_calls")
+            resp = self._remote_call(
+                "groq",
+                self.groq.complete,
+                read_timeout=self.relevance_timeout,
                 model=self.llm_relevance_model,
                 messages=[
                     {"role": "system", "content": relevance_system},
@@ -1001,70 +2939,292 @@ class VisaAssistant:
             )
             label = (resp.choices[0].message.content or "").strip().upper()
             is_rel = label.startswith("RELEVANT") and "OFFTOPIC" not in label
-            if len(self._relevance_cache) > 500:
-                self._relevance_cache.clear()
-            self._relevance_cache[cache_key] = is_rel
+            self.relevance_cache.set(cache_key, is_rel)
             return is_rel
         except Exception:
+            self._count("relevance_llm_errors")
+            self._mark_degraded(quota)
             return True if self.llm_relevance_fail_open else False
 
-    @sleep_and_retry
-    @limits(calls=10, period=60)
+
+@st.cache_resource(show_spinner=False)
+def get_routing_engine() -> RoutingEngine:
+    """Build the RoutingEngine once per process; every session reuses it."""
+    return RoutingEngine()
+
+
+class VisaAssistant:
+    """Per-session conversation state on top of the shared RoutingEngine."""
+
+    def __init__(self, engine: RoutingEngine | None = None):
+        self.engine = engine or get_routing_engine()
+        self.daily_count = 0
+        self.last_call = 0
+        # (stage, answered, elapsed_ms) for each stage run by the last generate()
+        self.last_route_trace: List[Tuple[str, bool, float]] = []
+        # (source, chunk, score) knowledge chunks found by the "rag" stage for this prompt
+        self.last_retrieval: List[Tuple[str, str, float]] = []
+        self.last_latency_ms = 0.0
+        self.session_id = uuid.uuid4().hex
+        # Replaced on every generate(); background calls keep the quota they were given
+        self.quota = SessionQuota(self.session_id)
+        self._stages = {
+            "exact": self.engine.exact_route,
+            "intent": self._intent_stage,
+            "lexicon": self.engine.lexicon_route,
+            "domain": self._domain_stage,
+            "semantic": self.engine.semantic_route,
+            "embedding": self.engine.embed_route,
+            "fuzzy": self._fuzzy_stage,
+            "rag": self._rag_stage,
+            "relevance": self._relevance_stage,
+            "facts": self._facts_stage,
+        }
+
     def generate(self, prompt):
+        started = time.perf_counter()
+        self.quota = SessionQuota(self.session_id)
         try:
-            if len(prompt.split()) > 2:
-                lang = detect(prompt)
-                if lang != "en":
-                    prompt = GoogleTranslator(source=lang, target="en").translate(prompt)
-        except:
-            pass
+            return self._cached_generate(prompt)
+        finally:
+            self.last_latency_ms = (time.perf_counter() - started) * 1000.0
+
+    def typing_padding_ms(self) -> int:
+        """Client-side typing time needed to bring the last reply up to THINKING_DELAY_MS."""
+        return max(0, int(self.engine.thinking_delay * 1000.0 - self.last_latency_ms))
+
+    def _cached_generate(self, prompt):
+        # facts_version() covers the pack and the knowledge files: a knowledge rebuild
+        # retires cached facts-fallback answers along with the routed ones
+        cache_key = (self.engine.facts_version(), self.engine._normalize(prompt))
+        cached = self.engine.answer_cache.get(cache_key)
+        if cached is not None:
+            self.last_route_trace = [("answer_cache", True, 0.0)]
+            return cached
+        # Answers routed before warmup finished lack the embedding/classifier/RAG stages
+        ready = self.engine.fully_ready()
+        answer = self._generate(prompt)
+        if not ready:
+            return answer
+        if self.quota.degraded:
+            # A remote call was refused or failed: serve the reply, but don't pin it in the shared cache
+            return answer
+        if isinstance(answer, StreamingAnswer):
+            # Streamed replies are cached once the caller has drained them (unless they broke off)
+            answer.on_complete(lambda text: None if answer.failed else self.engine.answer_cache.set(cache_key, text))
+        else:
+            self.engine.answer_cache.set(cache_key, answer)
+        return answer
+
+    def _generate(self, prompt: str) -> str | StreamingAnswer:
+        self.last_route_trace = []
+        self.last_retrieval = []
+        # Table lookups (incl. the Tagalog lexicon) first: no detection or translation needed
+        lexical = [s for s in self.engine.routing_stages if s in LEXICAL_STAGES]
+        answer = self._third_party_reply(prompt) or self.route(prompt, lexical)
+        if not answer:
+            if self.engine.speculative_routing:
+                answer = self._route_speculative(prompt)
+            else:
+                answer = self._route_sequential(prompt)
+        if answer:
+            return answer
 
-        try:
-            time.sleep(self.thinking_delay)
-        except Exception:
-            pass
+        # Default response
+        return "😊 I specialize in State101 Travel's US and Canada visa services. How can I help you today?"
 
-        # Relevance check
-        if self.third_party_guard_enabled:
+    def _third_party_reply(self, prompt: str) -> str | None:
+        if self.engine.third_party_guard_enabled:
             text = prompt.lower()
-            mentions_third_party = any(t in text for t in self.third_party_place_terms)
-            refers_to_us = any(m in text for m in self._us_reference_markers)
+            mentions_third_party = any(t in text for t in self.engine.third_party_place_terms)
+            refers_to_us = any(m in text for m in self.engine._us_reference_markers)
             if mentions_third_party and not refers_to_us:
                 return "😊 I specialize in State101 Travel's US and Canada visa services. Please ask about visa requirements, our process, appointments, or contact info."
+        return None
 
-        if self.llm_relevance_enabled:
-            if not self.check_query_relevance(prompt):
-                return "😊 I specialize in State101 Travel's US and Canada visa services. How can I help you with your visa application?"
+    def route(self, prompt: str, stages: List[str] | None = None) -> str | None:
+        """Run the routing cascade in cost order and stop at the first stage that answers."""
+        for name in (self.engine.routing_stages if stages is None else stages):
+            started = time.perf_counter()
+            try:
+                answer = self._stages[name](prompt)
+            except Exception:
+                answer = None
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            self.last_route_trace.append((name, bool(answer), elapsed_ms))
+            if answer:
+                return answer
+        return None
+
+    def _route_sequential(self, prompt: str) -> str | None:
+        translated = self.engine.translate_to_english(prompt, self.quota)
+        if translated == prompt:
+            stages = [s for s in self.engine.routing_stages if s not in LEXICAL_STAGES]
+            return self.route(prompt, stages)
+        return self._third_party_reply(translated) or self.route(translated)
+
+    def _route_speculative(self, prompt: str) -> str | None:
+        """Overlap translation, local routing and the LLM relevance tie-breaker.
+
+        The tie-breaker judges the same text as in _route_sequential. English
+        prompts start it (when the offline classifier is unsure) while the
+        local stages run. Prompts that need translation get one background task
+        that translates and then judges the translation; the semantic/embedding/
+        fuzzy/RAG stages wait only for the translation. A fallback-bound
+        message thus waits for the slowest remote call instead of the sum of
+        them. Translation uses this call's quota, so a straggler cannot mark
+        the next message as limited; the tie-breaker reports on its own quota,
+        merged in only when its verdict is used, so a speculative call made
+        moot by a local answer cannot keep that answer out of the cache.
+        """
+        engine = self.engine
+        quota = self.quota
+        judge_quota = SessionQuota(quota.session_id)
+        local_stages = [s for s in engine.routing_stages if s not in REMOTE_STAGES]
+        nonlexical_stages = [s for s in local_stages if s not in LEXICAL_STAGES]
+        fallback_stages = [s for s in engine.routing_stages if s in REMOTE_STAGES and s != "relevance"]
+        gate = "relevance" in engine.routing_stages
+        settled = threading.Event()
+        verdict: Future | None = None
+        relevant = None
+        try:
+            if engine.needs_translation(prompt):
+                translation: Future = Future()
+                verdict = engine.executor.submit(
+                    self._translate_then_judge, prompt, translation, gate, quota, judge_quota, settled
+                )
+                translated = self._await(translation, prompt)
+                if translated != prompt:
+                    answer = self._third_party_reply(translated) or self.route(translated, local_stages)
+                else:
+                    answer = self.route(prompt, nonlexical_stages)
+                if not gate:
+                    verdict = None
+            else:
+                translated = prompt
+                relevant = engine.classify_relevance(prompt) if gate else None
+                if gate and relevant is None and engine.llm_relevance_enabled:
+                    verdict = engine.executor.submit(engine.check_query_relevance, prompt, judge_quota)
+                answer = self.route(prompt, nonlexical_stages)
+            if answer:
+                return answer
+            if not gate:
+                return self.route(translated, fallback_stages)
+
+            started = time.perf_counter()
+            if relevant is None and verdict is not None:
+                relevant = self._await(verdict, engine.llm_relevance_fail_open)
+                quota.limited = quota.limited or judge_quota.limited
+                quota.degraded = quota.degraded or judge_quota.degraded
+            elif relevant is None:
+                relevant = self._is_relevant(translated, quota)
+            reply = None if relevant else self._offtopic_reply()
+            self.last_route_trace.append(("relevance", bool(reply), (time.perf_counter() - started) * 1000.0))
+            return reply or self.route(translated, fallback_stages)
+        finally:
+            settled.set()
+            if verdict is not None:
+                verdict.cancel()
+
+    def _translate_then_judge(
+        self, prompt: str, translation: Future, judge: bool, quota: SessionQuota,
+        judge_quota: SessionQuota, settled: threading.Event,
+    ) -> bool | None:
+        """Background half of _route_speculative: publish the translation, then judge its relevance."""
+        try:
+            translated = self.engine.translate_to_english(prompt, quota)
+        except Exception:
+            translated = prompt
+        translation.set_result(translated)
+        if not judge or settled.is_set():
+            return None  # a local stage already answered
+        return self._is_relevant(translated, judge_quota)
+
+    def _await(self, future: Future, default):
+        try:
+            return future.result(timeout=self.engine.speculative_timeout)
+        except Exception:
+            return default
+
+    def _intent_stage(self, prompt: str) -> str | None:
+        intent = self.engine.match_intent(prompt)
+        return self.engine.get_canonical_response(intent) if intent else None
+
+    def _fuzzy_stage(self, prompt: str) -> str | None:
+        fuzzy_intent = self.engine.fuzzy_fact_match(prompt)
+        return self.engine.get_canonical_response(fuzzy_intent) if fuzzy_intent else None
+
+    def _rag_stage(self, prompt: str) -> None:
+        """Retrieve knowledge chunks for the facts fallback; never answers by itself."""
+        self.engine.maybe_refresh_knowledge()
+        self.last_retrieval = self.engine.retrieve(prompt)
+        return None
+
+    def _facts_stage(self, prompt: str) -> str | StreamingAnswer | None:
+        started = time.perf_counter()
+        context = self.last_retrieval
+        cached = self.engine.cached_llm_answer(prompt, context)
+        self.last_route_trace.append(("semantic_answer_cache", bool(cached), (time.perf_counter() - started) * 1000.0))
+        if cached:
+            return cached
+        if self.engine.llm_streaming:
+            answer = self.engine.facts_answer_stream(prompt, self.last_retrieval, self.quota)
+            if answer is not None:
+                answer.on_complete(lambda _: self.last_route_trace.extend([
+                    ("first_token", True, answer.first_token_ms or 0.0),
+                    ("stream_complete", True, answer.total_ms or 0.0),
+                ]))
+                answer.on_complete(
+                    lambda text: None if answer.failed else self.engine.remember_llm_answer(prompt, context, text)
+                )
+            return answer or self._busy_reply()
+        answer = self.engine.facts_answer(prompt, self.last_retrieval, self.quota)
+        if answer:
+            self.engine.remember_llm_answer(prompt, context, answer)
+        return answer or self._busy_reply()
+
+    def _busy_reply(self) -> str | None:
+        """Reply when a remote call was refused (rate limit or open breaker); None otherwise."""
+        if not self.quota.limited:
+            return None
+        contact = self.engine.get_canonical_response("contact") or ""
+        return (
+            "😊 I can't look this up in detail right now. "
+            f"Please try again in a minute or reach our team directly:\n\n{contact}"
+        ).strip()
+
+    def _offtopic_reply(self) -> str:
+        return "😊 I specialize in State101 Travel's US and Canada visa services. How can I help you with your visa application?"
+
+    def _domain_stage(self, prompt: str) -> str | None:
+        """Local off-topic keyword gate, ahead of the semantic/embedding stages.
+
+        Without the LLM tie-breaker this is the full is_relevant_query() gate;
+        with it, only explicit off-topic vocabulary is rejected here and vaguer
+        prompts are left to the relevance stage.
+        """
+        engine = self.engine
+        if not engine.domain_gating_enabled:
+            return None
+        if engine.llm_relevance_enabled:
+            offtopic = engine.mentions_offtopic(prompt)
         else:
-            if not self.is_relevant_query(prompt):
-                return "😊 I specialize in State101 Travel's US and Canada visa services. How can I help you with your visa application?"
-
-        # Intent matching
-        intent = self.match_intent(prompt)
-        if intent:
-            canonical = self.get_canonical_response(intent)
-            if canonical:
-                return canonical
-
-        # Semantic routing
-        sem_answer = self.semantic_route(prompt)
-        if sem_answer:
-            return sem_answer
-
-        # Embedding routing
-        emb_answer = self.embed_route(prompt)
-        if emb_answer:
-            return emb_answer
-
-        # Fuzzy matching
-        fuzzy_intent = self.fuzzy_fact_match(prompt)
-        if fuzzy_intent:
-            canonical = self.get_canonical_response(fuzzy_intent)
-            if canonical:
-                return canonical
+            offtopic = not engine.is_relevant_query(prompt)
+        return self._offtopic_reply() if offtopic else None
+
+    def _is_relevant(self, prompt: str, quota: SessionQuota) -> bool:
+        relevant = self.engine.classify_relevance(prompt)
+        if relevant is None:
+            # Classifier unavailable or unsure: fall back to the LLM tie-breaker
+            if self.engine.llm_relevance_enabled:
+                relevant = self.engine.check_query_relevance(prompt, quota)
+            else:
+                relevant = self.engine.is_relevant_query(prompt)
+        return relevant
 
-        # Default response
-        return "😊 I specialize in State101 Travel's US and Canada visa services. How can I help you today?"
+    def _relevance_stage(self, prompt: str) -> str | None:
+        """Only reached when no local stage answered; rejects off-topic prompts."""
+        return None if self._is_relevant(prompt, self.quota) else self._offtopic_reply()
 
 # ========== COLOR THEMES ==========
 COLOR_THEMES = {
@@ -1841,11 +4001,58 @@ def apply_theme(theme_name):
         transform: scale(1.06);
         box-shadow: 0 6px 18px rgba(0,0,0,0.18);
     }}
+
+    /* Typing indicator shown in the browser before fast replies */
+    .typing-dots {{
+        display: inline-flex;
+        gap: 4px;
+        overflow: hidden;
+        max-height: 1.5em;
+        padding: 0.4em 0;
+    }}
+    .typing-dots span {{
+        width: 7px;
+        height: 7px;
+        border-radius: 50%;
+        background-color: {theme['accent']};
+        animation: typing-blink 1s infinite ease-in-out;
+    }}
+    .typing-dots span:nth-child(2) {{ animation-delay: 0.15s; }}
+    .typing-dots span:nth-child(3) {{ animation-delay: 0.3s; }}
+    @keyframes typing-blink {{
+        0%, 80%, 100% {{ opacity: 0.25; }}
+        40% {{ opacity: 1; }}
+    }}
+    @keyframes typing-hide {{
+        to {{ max-height: 0; padding: 0; visibility: hidden; }}
+    }}
+    @keyframes typing-reveal {{
+        from {{ max-height: 0; overflow: hidden; visibility: hidden; }}
+        to {{ visibility: visible; }}
+    }}
     </style>
     """
     st.markdown(css, unsafe_allow_html=True)
 
 
+def typing_indicator(delay_ms: int, key: str) -> str:
+    """HTML for a typing animation that hides the rest of its chat message for delay_ms.
+
+    The wait happens entirely in the browser (CSS animation delays), so the
+    script thread is free as soon as the answer is ready.
+    """
+    message = f'div[data-testid="stChatMessage"]:has(.typing-{key})'
+    return f"""
+    <style>
+    .typing-{key} {{ animation: typing-hide 0s linear {delay_ms}ms forwards; }}
+    {message} [data-testid="stMarkdownContainer"]:not(:has(.typing-{key})) {{
+        animation: typing-reveal 0s linear {delay_ms}ms both;
+    }}
+    </style>
+    <div class="typing-dots typing-{key}"><span></span><span></span><span></span></div>
+    """
+
+
 # ========== MAIN APP ==========
 def main():
     # Use company logo as page icon (favicon) when available
@@ -1856,6 +4063,20 @@ def main():
         page_icon=page_icon,
         layout="centered"
     )
+
+    # Start the shared engine (and its background model warmup) on the very first
+    # page view, so fastembed is loading while the user reads the terms.
+    engine = get_routing_engine()
+    if "health" in st.query_params:
+        st.json(engine.health())
+        st.stop()
+    if "purge_cache" in st.query_params:
+        admin_token = str(st.secrets.get("ADMIN_TOKEN", ""))
+        if admin_token and hmac.compare_digest(st.query_params["purge_cache"].encode("utf-8"), admin_token.encode("utf-8")):
+            st.json({"purged": engine.purge_answer_caches()})
+        else:
+            st.error("Not authorized.")
+        st.stop()
     
     # Initialize theme in session state
     if "theme" not in st.session_state:
@@ -2085,10 +4306,214 @@ def main():
     user_prompt = st.chat_input("Ask about US and Canada visas...")
     
     if user_prompt:
+        # Render the new turn in place (no st.rerun): hardcoded answers appear at
+        # once, LLM fallback replies stream in token by token.
         st.session_state.messages.append({"role": "user", "content": user_prompt})
-        bot_response = st.session_state.chatbot.generate(user_prompt)
+        with chat_container:
+            with st.chat_message("user"):
+                st.markdown(user_prompt)
+            with st.chat_message("assistant"):
+                bot_response = st.session_state.chatbot.generate(user_prompt)
+                if isinstance(bot_response, StreamingAnswer):
+                    st.write_stream(bot_response)
+                    bot_response = bot_response.text
+                else:
+                    padding_ms = st.session_state.chatbot.typing_padding_ms()
+                    if padding_ms:
+                        st.markdown(typing_indicator(padding_ms, str(len(st.session_state.messages))), unsafe_allow_html=True)
+                    st.markdown(bot_response)
         st.session_state.messages.append({"role": "assistant", "content": bot_response})
-        st.rerun()
+
+    # Optional routing diagnostics (same pattern as DEBUG_SUBMISSION)
+    if bool(st.secrets.get("DEBUG_ROUTING", False)):
+        with st.expander("Routing diagnostics (for developers)"):
+            st.write({
+                "last_route": st.session_state.chatbot.last_route_trace,
+                "last_latency_ms": round(st.session_state.chatbot.last_latency_ms, 1),
+                "engine": st.session_state.chatbot.engine.metrics(),
+            })
+
+# ========== OFFLINE COMMANDS ==========
+def train_relevance_command(args: List[str]) -> int:
+    """python app.py train-relevance [output.npz] — fit and save the relevance classifier.
+
+    Needs only fastembed and the knowledge pack: no RoutingEngine, so no
+    GROQ_API_KEY or other remote credentials.
+    """
+    if _FASTEMBED_TEXTEMBEDDING is None:
+        print("fastembed is not available; cannot train the relevance classifier.")
+        return 1
+    embedder = _FASTEMBED_TEXTEMBEDDING()
+    out_path = args[0] if args else st.secrets.get("RELEVANCE_MODEL_PATH", "models/relevance_classifier.npz")
+    texts, labels, examples_hash = relevance_training_set(KNOWLEDGE_PACK)
+    X = EmbeddingCache._normalized(embedder.embed(texts))
+    model_name = str(getattr(embedder, "model_name", None) or type(embedder).__name__)
+    clf = RelevanceClassifier.fit(X, np.array(labels), model_name, examples_hash)
+    preds = [clf.predict_proba(x) >= 0.5 for x in X]
+    accuracy = sum(int(p) == y for p, y in zip(preds, labels)) / len(labels)
+    clf.save(out_path)
+    print(f"Saved {out_path}: {len(labels)} examples ({sum(labels)} on-topic), "
+          f"training accuracy {accuracy:.3f}, model {clf.model_name}")
+    return 0
+
+
+def compile_storage_command(args: List[str]) -> int:
+    """python app.py compile-storage [storage_dir] [out_dir] — convert storage/ into the binary index."""
+    storage_dir = args[0] if args else "storage"
+    out_dir = args[1] if len(args) > 1 else ".cache/storage"
+    started = time.perf_counter()
+    try:
+        meta = VectorStoreIndex.compile(storage_dir, out_dir)
+    except (OSError, ValueError) as e:
+        print(f"Cannot compile {storage_dir}: {e}")
+        return 1
+    compiled_ms = (time.perf_counter() - started) * 1000.0
+    started = time.perf_counter()
+    store = VectorStoreIndex.open(storage_dir, out_dir)
+    opened_ms = (time.perf_counter() - started) * 1000.0
+    print(f"Compiled {len(meta['nodes'])} nodes (dim {meta['dim']}) into {out_dir} in {compiled_ms:.1f} ms; "
+          f"opens in {opened_ms:.1f} ms ({len(store)} nodes)")
+    return 0
+
+
+def _benchmark_search(matrix: np.ndarray, queries: np.ndarray, k: int, candidates: int) -> dict:
+    """Compare exact float32 top-k against int8 scan + float rescoring on the same queries."""
+    quantized = QuantizedIndex(matrix, candidates)
+    started = time.perf_counter()
+    exact = []
+    for q in queries:
+        scores = matrix @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        exact.append(top[np.argsort(-scores[top], kind="stable")])
+    exact_ms = (time.perf_counter() - started) * 1000.0 / len(queries)
+    started = time.perf_counter()
+    approx = [[i for i, _ in quantized.search(q, k)] for q in queries]
+    int8_ms = (time.perf_counter() - started) * 1000.0 / len(queries)
+    raw = [quantized.approx_scores(q) for q in queries[:50]]
+    return {
+        "float32_mb": matrix.nbytes / 1e6,
+        "int8_mb": quantized.nbytes / 1e6,
+        "exact_ms": exact_ms,
+        "int8_ms": int8_ms,
+        "recall": float(np.mean([len(set(a) & set(e.tolist())) / k for a, e in zip(approx, exact)])),
+        "top1": float(np.mean([a[0] == e[0] for a, e in zip(approx, exact)])),
+        "max_score_err": float(max(np.abs(r - matrix @ q).max() for r, q in zip(raw, queries[:50]))),
+    }
+
+
+def bench_quantization_command(args: List[str]) -> int:
+    """python app.py bench-quantization [rows] [queries] — int8 vs float32 retrieval accuracy and latency."""
+    rows = int(args[0]) if args else 50000
+    n_queries = int(args[1]) if len(args) > 1 else 200
+    rng = np.random.default_rng(0)
+    suites = []
+    # Clustered synthetic corpus at fastembed's 384 dims, queries are perturbed corpus rows
+    centers = rng.standard_normal((256, 384)).astype(np.float32)
+    corpus = centers[rng.integers(0, 256, rows)] + 0.6 * rng.standard_normal((rows, 384)).astype(np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = corpus[rng.integers(0, rows, n_queries)] + 0.3 * rng.standard_normal((n_queries, 384)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    suites.append((f"synthetic {rows}x384", corpus, queries.astype(np.float32)))
+    try:
+        engine = RoutingEngine()
+        engine.models_ready.wait()
+        if engine.embedding_matrix.size:
+            intent_matrix = np.asarray(engine.embedding_matrix, dtype=np.float32)
+            texts = RELEVANCE_ONTOPIC_EXAMPLES + RELEVANCE_OFFTOPIC_EXAMPLES
+            suites.append(("intent index", intent_matrix, engine._embed_corpus(engine._embedder, texts)))
+    except Exception as e:
+        print(f"(skipping the live intent index: {type(e).__name__}: {e})")
+
+    k = 5
+    print(f"{'index':<22}{'rescore':>8}{'f32 MB':>9}{'int8 MB':>9}{'f32 ms':>9}{'int8 ms':>9}"
+          f"{'recall@5':>10}{'top1':>7}{'max err':>9}")
+    for name, matrix, qs in suites:
+        for candidates in (k, 4 * k, 32, 128):
+            r = _benchmark_search(matrix, qs, k, candidates)
+            print(f"{name:<22}{candidates:>8}{r['float32_mb']:>9.2f}{r['int8_mb']:>9.2f}{r['exact_ms']:>9.3f}"
+                  f"{r['int8_ms']:>9.3f}{r['recall']:>10.3f}{r['top1']:>7.3f}{r['max_score_err']:>9.4f}")
+    return 0
+
+
+def calibrate_answer_cache_command(args: List[str]) -> int:
+    """python app.py calibrate-answer-cache [pairs.jsonl] — pick SEMANTIC_ANSWER_CACHE_THRESHOLD.
+
+    Scores question pairs ({"a", "b", "same"} per line, or the built-in
+    ANSWER_CACHE_CALIBRATION_PAIRS) with the router's embedding model and
+    reports, per threshold, how many paraphrases would hit and how many
+    different questions would wrongly hit, with and without the entity check.
+    """
+    if args:
+        with open(args[0], encoding="utf-8") as fh:
+            pairs = [(r["a"], r["b"], bool(r["same"])) for r in map(json.loads, fh) if r]
+    else:
+        pairs = list(ANSWER_CACHE_CALIBRATION_PAIRS)
+    if _FASTEMBED_TEXTEMBEDDING is None:
+        print("fastembed is not available; cannot calibrate the answer cache.")
+        return 1
+    embedder = _FASTEMBED_TEXTEMBEDDING()
+    vecs = np.asarray(list(embedder.embed([t for a, b, _ in pairs for t in (a, b)])), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    scores = np.einsum("ij,ij->i", vecs[0::2], vecs[1::2])
+    same = np.array([s for _, _, s in pairs])
+    entity_ok = np.array([
+        RoutingEngine.answer_entities(a) == RoutingEngine.answer_entities(b) for a, b, _ in pairs
+    ])
+    print(f"{len(pairs)} pairs ({int(same.sum())} paraphrases) with {getattr(embedder, 'model_name', '?')}")
+    print(f"{'threshold':>10}{'paraphrase hits':>17}{'false hits':>12}{'false hits w/ entities':>24}")
+    for threshold in np.arange(0.80, 0.99, 0.02):
+        hit = scores >= threshold
+        print(f"{threshold:>10.2f}{int((hit & same).sum()):>17}{int((hit & ~same).sum()):>12}"
+              f"{int((hit & ~same & entity_ok).sum()):>24}")
+    safe = [t for t in np.arange(0.80, 0.995, 0.005) if not ((scores >= t) & ~same & entity_ok).any()]
+    if safe:
+        print(f"lowest threshold without false hits (entity check on): {safe[0]:.3f}")
+    return 0
+
+
+def compile_pack_command(args: List[str]) -> int:
+    """python app.py compile-pack [--no-embed] — recompile data/knowledge_pack.json and cache alias embeddings.
+
+    Embeds with fastembed directly (no RoutingEngine, so no GROQ_API_KEY);
+    without fastembed the pack is compiled and the embeddings wait for the first start.
+    """
+    started = time.perf_counter()
+    try:
+        pack = KnowledgePack.load(force=True)
+    except (OSError, ValueError) as e:
+        print(f"Cannot compile {KNOWLEDGE_PACK_PATH}: {e}")
+        return 1
+    compiled_ms = (time.perf_counter() - started) * 1000.0
+    alias_bytes = sum(len(pack.bodies[i].encode("utf-8")) for i in pack.aliases.values())
+    body_bytes = sum(len(b.encode("utf-8")) for b in pack.bodies)
+    print(f"{len(pack.aliases)} aliases -> {len(pack.bodies)} unique answers "
+          f"({alias_bytes / 1024:.1f} KiB as a flat dict, {body_bytes / 1024:.1f} KiB interned), "
+          f"{len(pack.intents)} intents, {len(pack.index_entries)} index entries; compiled in {compiled_ms:.1f} ms")
+    if "--no-embed" not in args:
+        if _FASTEMBED_TEXTEMBEDDING is None:
+            print("fastembed is not available; embeddings will be computed at first start.")
+            return 0
+        embedder = _FASTEMBED_TEXTEMBEDDING()
+        model_name = str(getattr(embedder, "model_name", None) or type(embedder).__name__)
+        matrix = pack.embeddings(model_name)
+        if matrix is None:
+            matrix = EmbeddingCache._normalized(embedder.embed([t for _, t in pack.index_entries]))
+            pack.store_embeddings(model_name, matrix)
+        print(f"Stored {matrix.shape} alias embeddings in {pack.cache_path}")
+    return 0
+
+
+CLI_COMMANDS = {
+    "train-relevance": train_relevance_command,
+    "compile-storage": compile_storage_command,
+    "bench-quantization": bench_quantization_command,
+    "compile-pack": compile_pack_command,
+    "calibrate-answer-cache": calibrate_answer_cache_command,
+}
+
 
 if __name__ == "__main__":
+    # `streamlit run app.py` passes no command, so it always falls through to main()
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
     main()
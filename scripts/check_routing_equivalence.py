@@ -0,0 +1,140 @@
+"""Compare local routing of the working tree against app.py at another git revision.
+
+    python scripts/check_routing_equivalence.py [--baseline REV] [--prompts N] [--seed S]
+                                                [--embedder module:Class] [--show K]
+
+Runs the alias keys, every intent synonym and lexicon phrase, and N random
+prompts built from their vocabulary through each routing stage that both
+versions implement (exact, intent, lexicon, semantic, embedding, fuzzy) and
+reports, per stage, how many answers differ. Semantic and embedding differences where both
+answers come from equally scored phrases are counted as ties, not
+mismatches. Exits 1 when any stage has a real mismatch.
+
+Run it from the app directory: both versions read .streamlit/secrets.toml
+(GROQ_API_KEY is needed to construct them; no remote call is made). The
+default baseline is the repository's first commit. --embedder replaces
+fastembed's TextEmbedding in both versions with any class exposing
+embed(texts), e.g. to compare offline.
+"""
+
+import argparse
+import importlib
+import random
+import subprocess
+import sys
+import types
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import app  # noqa: E402
+
+STAGES = {
+    "exact": (["exact_route"], lambda e, p: e.exact_route(p)),
+    "intent": (["match_intent"], lambda e, p: e.get_canonical_response(e.match_intent(p) or "")),
+    "lexicon": (["lexicon_route"], lambda e, p: e.lexicon_route(p)),
+    "semantic": (["semantic_route"], lambda e, p: e.semantic_route(p)),
+    "embedding": (["embed_route"], lambda e, p: e.embed_route(p)),
+    "fuzzy": (["fuzzy_fact_match"], lambda e, p: e.get_canonical_response(e.fuzzy_fact_match(p) or "")),
+}
+
+
+def load_revision(rev: str) -> types.ModuleType:
+    """Import app.py as it was at rev, as a separate module."""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:app.py"], cwd=ROOT, check=True, capture_output=True, text=True, encoding="utf-8"
+    ).stdout
+    module = types.ModuleType("baseline_app")
+    module.__file__ = str(ROOT / "app.py")  # resolve data/ paths against this checkout
+    sys.modules["baseline_app"] = module
+    exec(compile(source, f"{rev}:app.py", "exec"), module.__dict__)
+    return module
+
+
+def build_engine(module: types.ModuleType):
+    """The routing object of a revision: RoutingEngine, or VisaAssistant before it existed."""
+    engine = module.RoutingEngine() if hasattr(module, "RoutingEngine") else module.VisaAssistant()
+    ready = getattr(engine, "models_ready", None)
+    if ready is not None:
+        ready.wait()
+    return engine
+
+
+def make_prompts(count: int, seed: int) -> List[str]:
+    keys = list(app.HARDCODED_RESPONSES)
+    synonyms = [s for spec in app.KNOWLEDGE_PACK.intents.values() for s in spec["synonyms"]]
+    synonyms += [s for phrases in app.TAGALOG_INTENT_LEXICON.values() for s in phrases]
+    vocab = sorted({w for text in keys + synonyms for w in text.split()}
+                   | {"please", "the", "my", "visa", "tell", "me", "about", "office", "is", "what", "how", "po"})
+    rng = random.Random(seed)
+    prompts = keys + synonyms + [k.upper() + "?" for k in keys]
+    prompts += [" ".join(rng.choice(vocab) for _ in range(rng.randint(1, 7))) for _ in range(count)]
+    return prompts
+
+
+def is_tie(engine, stage: str, prompt: str, old_answer, new_answer) -> bool:
+    """Whether old_answer is backed by a phrase scoring as high as the one behind new_answer."""
+    if stage == "semantic":
+        candidates = engine.semantic_candidates(prompt, k=50, score_cutoff=0)
+        tolerance = 0.0
+    elif stage == "embedding":
+        candidates = engine.embed_top_k(prompt, k=50)
+        tolerance = 1e-5
+    else:
+        return False
+    if not candidates or old_answer is None or new_answer is None:
+        return False
+    top = candidates[0][2]
+    return any(
+        engine.get_canonical_response(intent) == old_answer
+        for intent, _, score in candidates
+        if score >= top - tolerance
+    )
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", help="git revision to compare against (default: first commit)")
+    parser.add_argument("--prompts", type=int, default=5000, help="random prompts on top of keys and synonyms")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--embedder", help="module:Class used instead of fastembed.TextEmbedding")
+    parser.add_argument("--show", type=int, default=5, help="mismatches printed per stage")
+    args = parser.parse_args(argv)
+
+    baseline = args.baseline or subprocess.run(
+        ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout.split()[0]
+    old_module = load_revision(baseline)
+    if args.embedder:
+        mod_name, _, cls_name = args.embedder.partition(":")
+        embedder_cls = getattr(importlib.import_module(mod_name), cls_name)
+        app._FASTEMBED_TEXTEMBEDDING = old_module._FASTEMBED_TEXTEMBEDDING = embedder_cls
+    old_engine, new_engine = build_engine(old_module), build_engine(app)
+
+    prompts = make_prompts(args.prompts, args.seed)
+    print(f"{len(prompts)} prompts, baseline {baseline[:12]}")
+    failed = False
+    for stage, (methods, route) in STAGES.items():
+        if not all(hasattr(e, m) for e in (old_engine, new_engine) for m in methods):
+            print(f"{stage:>10}: skipped (not in both versions)")
+            continue
+        mismatches, ties = [], 0
+        for prompt in prompts:
+            old_answer, new_answer = route(old_engine, prompt), route(new_engine, prompt)
+            if old_answer == new_answer:
+                continue
+            if is_tie(new_engine, stage, prompt, old_answer, new_answer):
+                ties += 1
+            else:
+                mismatches.append((prompt, old_answer, new_answer))
+        print(f"{stage:>10}: {len(mismatches)} mismatches, {ties} equal-score ties")
+        for prompt, old_answer, new_answer in mismatches[: args.show]:
+            print(f"{'':>12}{prompt!r}: {str(old_answer)[:40]!r} -> {str(new_answer)[:40]!r}")
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
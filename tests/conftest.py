@@ -0,0 +1,154 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# app.py lives at the repository root, not in a package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class FakeClock:
+    """Stand-in for time.monotonic / time.time that only moves when told to."""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import app
+
+    fake = FakeClock()
+    monkeypatch.setattr(app.time, "monotonic", fake)
+    monkeypatch.setattr(app.time, "time", fake)
+    return fake
+
+
+class FakeEmbedding:
+    """Offline stand-in for fastembed.TextEmbedding: hashed bag of words, 64 dims."""
+
+    model_name = "test/hash-embed"
+
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+
+    def _vector(self, text: str):
+        import hashlib
+        import re
+
+        import numpy as np
+
+        vec = np.zeros(64, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = int(hashlib.md5(token.encode("utf-8")).hexdigest(), 16)
+            vec[h % 64] += 1.0
+            vec[(h >> 8) % 64] += 0.5
+        vec[63] += 0.01  # no all-zero rows
+        return vec
+
+    def embed(self, texts, **kwargs):
+        texts = list(texts)
+        self.batches.append(texts)
+        for text in texts:
+            yield self._vector(text)
+
+
+class FakeGroq:
+    """Scripted stand-in for groq.Groq.
+
+    chat.completions.create() records its kwargs and plays the next reply:
+    a string (message content), a list of strings (stream deltas, for
+    stream=True) or an exception to raise. Without replies it answers
+    "RELEVANT".
+    """
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        reply = self.replies.pop(0) if self.replies else "RELEVANT"
+        if isinstance(reply, BaseException):
+            raise reply
+        if kwargs.get("stream"):
+            return FakeStream(reply if isinstance(reply, list) else [reply])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+class FakeStream:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            if isinstance(delta, BaseException):
+                raise delta
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    def close(self):
+        self.closed = True
+
+
+class EchoTranslator:
+    """Offline stand-in for deep_translator.GoogleTranslator: returns the text unchanged."""
+
+    def __init__(self, source="auto", target="en"):
+        self.source, self.target = source, target
+
+    def translate(self, text):
+        return text
+
+
+@pytest.fixture
+def secrets(monkeypatch, tmp_path):
+    """st.secrets for a RoutingEngine that never touches the network or the repo's caches."""
+    import app
+
+    values = {
+        "GROQ_API_KEY": "test-key",
+        "MODEL_WARMUP_BACKGROUND": False,
+        "RAG_BACKGROUND_BUILD": False,
+        "EMBEDDING_CACHE_DIR": str(tmp_path / "embeddings"),
+        "RAG_CACHE_DIR": str(tmp_path / "knowledge-cache"),
+        "KNOWLEDGE_DIR": str(tmp_path / "knowledge"),
+        "TRANSLATION_CACHE_DB": str(tmp_path / "translations.sqlite3"),
+        "RELEVANCE_MODEL_PATH": str(tmp_path / "relevance.npz"),
+    }
+    monkeypatch.setattr(app.st, "secrets", values)
+    monkeypatch.setattr(app, "_FASTEMBED_TEXTEMBEDDING", FakeEmbedding)
+    monkeypatch.setattr(app, "GoogleTranslator", EchoTranslator)
+    # Pack embeddings for the fake model go to a private artifact, not .cache/ of the checkout
+    pack = app.KnowledgePack.load(app.KNOWLEDGE_PACK_PATH, tmp_path / "pack")
+    monkeypatch.setattr(app, "KNOWLEDGE_PACK", pack)
+    return values
+
+
+@pytest.fixture
+def make_engine(secrets):
+    """Build RoutingEngines from `secrets` plus overrides; each gets a FakeGroq as .fake_groq."""
+    import app
+
+    engines = []
+
+    def build(*replies, **overrides):
+        secrets.update(overrides)
+        engine = app.RoutingEngine()
+        engine.fake_groq = FakeGroq(*replies)
+        engine.groq.client = engine.fake_groq
+        engines.append(engine)
+        return engine
+
+    yield build
+    for engine in engines:
+        engine.executor.shutdown(wait=True, cancel_futures=True)
+        engine.groq.http_client.close()
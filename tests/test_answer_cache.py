@@ -0,0 +1,34 @@
+import app
+
+QUESTION = "tell me about the consultation fee payment"
+
+
+def write_fees(tmp_path, text):
+    knowledge = tmp_path / "knowledge"
+    knowledge.mkdir(exist_ok=True)
+    (knowledge / "fees.md").write_text(f"# Fees\n{text}\n", encoding="utf-8")
+
+
+def test_routed_answers_are_shared_across_sessions(make_engine):
+    engine = make_engine()
+    first, second = app.VisaAssistant(engine), app.VisaAssistant(engine)
+    answer = first.generate("what are your office hours")
+    assert second.generate("What are your office hours?") == answer
+    assert second.last_route_trace == [("answer_cache", True, 0.0)]
+
+
+def test_facts_answers_expire_with_a_knowledge_rebuild(make_engine, tmp_path):
+    write_fees(tmp_path, "The consultation fee is paid in cash at the office before the interview starts.")
+    engine = make_engine(
+        "first answer", "second answer",
+        RAG_ENABLED=True, SMART_FACTS_MODE=True, LLM_STREAMING=False, ROUTING_STAGES=["rag", "facts"],
+    )
+    assistant = app.VisaAssistant(engine)
+    assert assistant.generate(QUESTION) == "first answer"
+    assert assistant.generate(QUESTION) == "first answer"
+    assert len(engine.fake_groq.calls) == 1
+
+    write_fees(tmp_path, "The consultation fee can now also be paid by bank transfer or GCash before the interview.")
+    engine.refresh_knowledge(wait=True)
+    assert assistant.generate(QUESTION) == "second answer"
+    assert len(engine.fake_groq.calls) == 2
@@ -0,0 +1,62 @@
+import random
+import types
+
+import pytest
+
+import app
+
+
+def chunks(tmp_path, text, budget=200, overlap=60):
+    path = tmp_path / "doc.md"
+    path.write_text(text, encoding="utf-8")
+    engine = types.SimpleNamespace(rag_chunk_chars=budget, rag_chunk_overlap=overlap)
+    return list(app.RoutingEngine._iter_file_chunks(engine, path))
+
+
+def test_chunks_close_on_sentences_with_overlap(tmp_path):
+    sentences = [f"Sentence number {i} talks about visa fees in detail." for i in range(12)]
+    out = chunks(tmp_path, " ".join(sentences) + "\n")
+    assert all(len(c) <= 200 for c in out)
+    assert all(c.endswith(".") for c in out)
+    for prev, nxt in zip(out, out[1:]):
+        carried = nxt[: nxt.index(".") + 1]
+        assert prev.endswith(carried) and len(carried) <= 60
+    assert all(any(s in c for c in out) for s in sentences)
+
+
+def test_headings_start_chunks_and_frontmatter_is_skipped(tmp_path):
+    text = (
+        "---\ntitle: Fees\n---\n"
+        "# Fees\nThe visa application fee is paid at the bank before the interview.\n\n"
+        "# Hours\nThe office opens at nine in the morning and closes at six.\n"
+    )
+    out = chunks(tmp_path, text)
+    assert out == [
+        "# Fees The visa application fee is paid at the bank before the interview.",
+        "# Hours The office opens at nine in the morning and closes at six.",
+    ]
+
+
+def test_tiny_and_repeated_chunks_are_dropped(tmp_path):
+    para = "Bring your passport, two photos and the printed confirmation page."
+    out = chunks(tmp_path, f"Short.\n\n# A\n{para}\n\n# B\n{para}\n", overlap=0)
+    assert out == [f"# A {para}", f"# B {para}"]
+    assert chunks(tmp_path, "Too short.\n") == []
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_long_lines_keep_words_and_budget(tmp_path, seed):
+    """Lines longer than the bounded read are cut between words, never inside one."""
+    rng = random.Random(seed)
+    words = {"".join(rng.choice("abcdefghij") for _ in range(rng.randint(3, 14))) for _ in range(400)}
+    vocab = sorted(words)
+    lines = []
+    for _ in range(rng.randint(1, 4)):
+        # No sentence punctuation: only the length cut can split these lines
+        lines.append(" ".join(rng.choice(vocab) for _ in range(rng.randint(50, 600))))
+    budget = rng.choice([200, 257, 400])
+    out = chunks(tmp_path, "\n".join(lines) + "\n", budget=budget, overlap=budget // 4)
+    assert out
+    for chunk in out:
+        assert len(chunk) <= budget
+        assert set(chunk.split()) <= words, chunk
@@ -0,0 +1,106 @@
+import app
+
+
+def make_breaker(**kwargs):
+    options = dict(failure_rate=0.5, slow_call_ms=1000, window=10, min_calls=4, open_seconds=30)
+    options.update(kwargs)
+    return app.CircuitBreaker("groq", **options)
+
+
+def test_breaker_needs_min_calls_before_opening(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_opens_at_failure_rate(clock):
+    breaker = make_breaker()
+    for ok in (True, True, True, False):
+        breaker.record(ok)
+    assert breaker.state == "closed"  # 1/4 failed
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == "closed"  # 3/7
+    breaker.record(False)
+    assert breaker.state == "open"  # 4/8
+
+
+def test_slow_call_counts_as_failure(clock):
+    breaker = make_breaker(min_calls=2)
+    breaker.record(True, elapsed_ms=999)
+    breaker.record(True, elapsed_ms=1001)
+    assert breaker.state == "open"
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record(False)
+    clock.advance(29.9)
+    assert not breaker.allow()
+    clock.advance(0.1)
+    assert breaker.allow()  # the single probe
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # no second call while the probe is out
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.allow()
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record(False)
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open" and breaker.opens == 2
+    assert not breaker.allow()
+    clock.advance(30)
+    assert breaker.allow()
+
+
+def test_lost_probe_lets_another_through(clock):
+    breaker = make_breaker(min_calls=1)
+    breaker.record(False)
+    clock.advance(30)
+    assert breaker.allow()
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()  # the first probe never recorded an outcome
+
+
+def test_release_hands_back_the_probe(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(False)
+    clock.advance(30)
+    assert breaker.allow() and breaker.state == "half_open"
+    breaker.release()
+    assert breaker.state == "open"
+    assert breaker.allow()  # the next caller probes right away
+    breaker.record(True)
+    assert breaker.state == "closed"
+    breaker.release()  # nothing to hand back while closed
+    assert breaker.state == "closed"
+
+
+def test_rate_limited_call_keeps_the_probe(make_engine, clock):
+    engine = make_engine(RATE_LIMIT_GROQ_SESSION_PER_MIN=1)
+    quota = app.SessionQuota("s1")
+    breaker = engine.breakers["groq"]
+    breaker._open()
+    clock.advance(breaker.open_seconds)
+    assert engine.allow_remote("groq", quota)  # the probe
+    breaker.record(False)  # ...which failed: open again
+    clock.advance(breaker.open_seconds)
+    # The session's bucket is empty: refused, and the probe goes to the next caller
+    assert not engine.allow_remote("groq", quota) and quota.limited
+    assert breaker.state == "open"
+    assert engine.allow_remote("groq", app.SessionQuota("s2"))
+    assert breaker.state == "half_open"
@@ -0,0 +1,118 @@
+import numpy as np
+
+import app
+
+
+class CountingEmbedder:
+    def __init__(self, dim: int = 4):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        for text in texts:
+            vec = np.zeros(self.dim, dtype=np.float32)
+            vec[len(text) % self.dim] = 1.0
+            vec[0] += 0.5
+            yield vec
+
+
+def test_embedding_cache_embeds_only_misses(tmp_path):
+    embed = CountingEmbedder()
+    cache = app.EmbeddingCache(str(tmp_path), "model/a")
+    first = cache.embed(["one", "three", "one"], embed)
+    assert embed.calls == [["one", "three"]]
+    assert first.shape == (3, 4) and first.dtype == np.float32
+    assert np.allclose(np.linalg.norm(first, axis=1), 1.0)
+
+    cache.embed(["three", "seven"], embed)
+    assert embed.calls[-1] == ["seven"]
+
+    # A new instance (next process) reads the memory-mapped matrix back
+    reloaded = app.EmbeddingCache(str(tmp_path), "model/a")
+    assert len(reloaded) == 3
+    again = reloaded.embed(["one", "three"], CountingEmbedder())
+    assert np.allclose(again, first[:2])
+
+
+def test_embedding_cache_reembeds_batch_on_dimension_change(tmp_path):
+    cache = app.EmbeddingCache(str(tmp_path), "model/a")
+    cache.embed(["one", "three"], CountingEmbedder(dim=4))
+    wider = CountingEmbedder(dim=6)
+    out = cache.embed(["one", "new"], wider)
+    # The miss reveals the new width; "one" was cached at the old one, so the whole batch is redone
+    assert wider.calls == [["new"], ["one", "new"]]
+    assert out.shape == (2, 6)
+    assert len(cache) == 2
+
+
+def test_embedding_cache_ignores_other_models(tmp_path):
+    app.EmbeddingCache(str(tmp_path), "model/a").embed(["one"], CountingEmbedder())
+    assert len(app.EmbeddingCache(str(tmp_path), "model/b")) == 0
+
+
+def test_embedding_cache_appends_only_new_rows(tmp_path):
+    cache = app.EmbeddingCache(str(tmp_path), "model/a")
+    cache.embed(["one", "three"], CountingEmbedder())
+    first_shard = sorted(cache.shard_dir.glob("*.npy"))
+    cache.embed(["seven"], CountingEmbedder())
+    shards = sorted(cache.shard_dir.glob("*.npy"))
+    # Earlier shards are left untouched; the new one holds just the miss
+    assert shards[0] == first_shard[0] and len(shards) == 2
+    assert [len(np.load(p)) for p in shards] == [2, 1]
+
+
+def test_embedding_cache_merges_small_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.EmbeddingCache, "MAX_SHARDS", 4)
+    cache = app.EmbeddingCache(str(tmp_path), "model/a")
+    texts = [f"text {i}" for i in range(10)]
+    expected = cache.embed(texts, CountingEmbedder())
+    for i in range(5):
+        cache.embed([f"extra {i}"], CountingEmbedder())
+    assert len(list(cache.shard_dir.glob("*.npy"))) <= 4
+    reloaded = app.EmbeddingCache(str(tmp_path), "model/a")
+    assert len(reloaded) == 15
+    embed = CountingEmbedder()
+    assert np.allclose(reloaded.embed(texts, embed), expected) and embed.calls == []
+
+
+def test_embedding_cache_retain_drops_unreferenced_rows(tmp_path):
+    cache = app.EmbeddingCache(str(tmp_path), "model/a")
+    cache.embed(["one", "three"], CountingEmbedder())
+    cache.embed(["seven"], CountingEmbedder())
+    assert cache.retain([app.EmbeddingCache.text_key("three")]) == 2
+    assert cache.retain([app.EmbeddingCache.text_key("three")]) == 0
+    assert len(list(cache.shard_dir.glob("*.npy"))) == 1
+    reloaded = app.EmbeddingCache(str(tmp_path), "model/a")
+    assert len(reloaded) == 1
+    embed = CountingEmbedder()
+    reloaded.embed(["one", "three"], embed)
+    assert embed.calls == [["one"]]
+
+
+def test_embedding_cache_writers_do_not_cross(tmp_path):
+    # Two workers append to the same directory; every key stays paired with its own vector
+    a = app.EmbeddingCache(str(tmp_path), "model/a")
+    b = app.EmbeddingCache(str(tmp_path), "model/a")
+    from_a = a.embed(["one", "three"], CountingEmbedder())
+    from_b = b.embed(["seven", "eleven"], CountingEmbedder())
+    reloaded = app.EmbeddingCache(str(tmp_path), "model/a")
+    assert len(reloaded) == 4
+    both = reloaded.embed(["one", "three", "seven", "eleven"], CountingEmbedder())
+    assert np.allclose(both, np.vstack([from_a, from_b]))
+
+
+def test_knowledge_rebuild_collects_edited_chunks(make_engine, secrets, tmp_path):
+    knowledge = tmp_path / "knowledge"
+    knowledge.mkdir()
+    doc = knowledge / "fees.md"
+    doc.write_text("# Fees\n" + "The consultation fee is paid at the office. " * 3 + "\n", encoding="utf-8")
+    engine = make_engine(RAG_ENABLED=True)
+    old_ids = [cid for entry in engine._load_knowledge_manifest("test/hash-embed").values() for cid in entry["chunk_ids"]]
+    cache = engine._embedding_caches["test/hash-embed"]
+    assert all(cid.encode() in cache._rows for cid in old_ids)
+
+    doc.write_text("# Fees\n" + "Payment is made online by bank transfer. " * 3 + "\n", encoding="utf-8")
+    engine._build_rag_index()
+    assert not any(cid.encode() in cache._rows for cid in old_ids)
+    assert engine.metrics()["counters"]["embedding_cache_gc_rows"] >= len(old_ids)
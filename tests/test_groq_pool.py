@@ -0,0 +1,75 @@
+import httpx
+import pytest
+from conftest import FakeGroq
+from groq import APIConnectionError, APIStatusError
+
+import app
+
+REQUEST = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+
+
+def status_error(code: int) -> APIStatusError:
+    return APIStatusError(f"HTTP {code}", response=httpx.Response(code, request=REQUEST), body=None)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+    made = []
+
+    def build(*replies, **kwargs):
+        groq_pool = app.GroqPool("test-key", **kwargs)
+        groq_pool.client = FakeGroq(*replies)
+        groq_pool.sleeps = sleeps
+        made.append(groq_pool)
+        return groq_pool
+
+    yield build
+    for groq_pool in made:
+        groq_pool.http_client.close()
+
+
+def test_transient_errors_are_retried_with_backoff(pool):
+    groq_pool = pool(APIConnectionError(request=REQUEST), status_error(503), "ok")
+    resp = groq_pool.complete(model="m", messages=[])
+    assert resp.choices[0].message.content == "ok"
+    stats = groq_pool.stats()
+    assert stats["retries"] == 2 and stats["errors"] == 0 and stats["in_flight"] == 0
+    assert len(groq_pool.sleeps) == 2 and all(0.0 <= s <= 2.0 for s in groq_pool.sleeps)
+    assert all(call["timeout"].read == groq_pool.read_timeout for call in groq_pool.client.calls)
+
+
+def test_client_errors_are_not_retried(pool):
+    groq_pool = pool(status_error(400), "unused")
+    with pytest.raises(APIStatusError):
+        groq_pool.complete(model="m", messages=[])
+    assert len(groq_pool.client.calls) == 1
+    assert groq_pool.stats()["errors"] == 1 and groq_pool.stats()["retries"] == 0
+
+
+def test_retries_stop_when_the_budget_is_spent(pool):
+    groq_pool = pool(*[status_error(429)] * 4, retry_budget_max=1.0, retry_ratio=0.0, max_retries=3)
+    with pytest.raises(APIStatusError):
+        groq_pool.complete(model="m", messages=[])
+    # One retry from the budget, then the error surfaces instead of a third attempt
+    assert len(groq_pool.client.calls) == 2
+    stats = groq_pool.stats()
+    assert stats["retries"] == 1 and stats["retry_budget_exhausted"] == 1 and stats["retry_budget"] == 0
+
+
+def test_calls_earn_back_the_budget(pool):
+    groq_pool = pool(retry_budget_max=2.0, retry_ratio=0.5)
+    groq_pool._retry_tokens = 0.0
+    for _ in range(3):
+        groq_pool.complete(model="m", messages=[])
+    assert groq_pool.stats()["retry_budget"] == 1.5
+
+
+def test_stream_holds_its_slot_until_consumed(pool):
+    groq_pool = pool(["Hel", "lo"])
+    stream = groq_pool.complete(model="m", messages=[], stream=True, read_timeout=5)
+    assert groq_pool.stats()["in_flight"] == 1
+    assert groq_pool.client.calls[0]["timeout"].read == 5
+    assert "".join(chunk.choices[0].delta.content for chunk in stream) == "Hello"
+    assert groq_pool.stats()["in_flight"] == 0 and groq_pool.stats()["peak_in_flight"] == 1
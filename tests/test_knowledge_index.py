@@ -0,0 +1,62 @@
+import app
+
+FEES = "# Fees\n" + "The consultation fee is paid at the office before the interview. " * 3 + "\n"
+HOURS = "# Hours\n" + "The office is open from nine to five on weekdays. " * 3 + "\n"
+
+
+def write_knowledge(tmp_path):
+    knowledge = tmp_path / "knowledge"
+    knowledge.mkdir()
+    (knowledge / "fees.md").write_text(FEES, encoding="utf-8")
+    return knowledge
+
+
+def test_rebuild_reuses_unchanged_files(make_engine, tmp_path):
+    knowledge = write_knowledge(tmp_path)
+    engine = make_engine(RAG_ENABLED=True)
+    assert engine._rag_last_build["rechunked"] == 1
+    (knowledge / "hours.md").write_text(HOURS, encoding="utf-8")
+    engine._build_rag_index()
+    assert engine._rag_last_build["reused"] == 1 and engine._rag_last_build["rechunked"] == 1
+    assert {source.split("/")[-1] for source, _ in engine.rag_index.chunks} == {"fees.md", "hours.md"}
+
+
+def test_manifest_write_uses_a_per_process_temp_file(make_engine, secrets, tmp_path, monkeypatch):
+    write_knowledge(tmp_path)
+    temp_names = []
+    replace = app.os.replace
+
+    def spy(src, dst):
+        temp_names.append(str(src))
+        replace(src, dst)
+
+    monkeypatch.setattr(app.os, "replace", spy)
+    make_engine(RAG_ENABLED=True)
+    cache_dir = tmp_path / "knowledge-cache"
+    assert f"manifest.json.{app.os.getpid()}.tmp" in [name.split("/")[-1] for name in temp_names]
+    assert (cache_dir / "manifest.json").exists()
+    assert not list(cache_dir.glob("*.tmp"))
+
+
+def test_failed_manifest_write_keeps_the_rebuilt_index(make_engine, tmp_path, monkeypatch):
+    write_knowledge(tmp_path)
+
+    def fail(self, model_name, files):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(app.RoutingEngine, "_save_knowledge_manifest", fail)
+    engine = make_engine(RAG_ENABLED=True)
+    assert len(engine.rag_index.chunks) > 0
+    assert engine.metrics()["counters"]["rag_persist_errors"] == 1
+    assert engine.retrieve("when is the consultation fee paid")
+
+
+def test_read_only_cache_dir_still_builds_the_index(make_engine, tmp_path):
+    write_knowledge(tmp_path)
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("", encoding="utf-8")
+    engine = make_engine(RAG_ENABLED=True, RAG_CACHE_DIR=str(blocker / "knowledge-cache"))
+    assert len(engine.rag_index.chunks) > 0
+    assert engine.metrics()["counters"]["rag_persist_errors"] >= 1
+    engine._build_rag_index()  # no manifest: the file is indexed again, from the live rows
+    assert len(engine.rag_index.chunks) > 0
@@ -0,0 +1,119 @@
+import json
+
+import numpy as np
+import pytest
+
+import app
+
+
+SOURCE = {
+    "responses": [
+        {"answer": "We are in Quezon City.", "aliases": ["location", "where are you"]},
+        {"answer": "Open 9-6, Monday to Saturday.", "aliases": ["hours"]},
+    ],
+    "intents": {
+        "location": {"response": "location", "synonyms": ["address", "office location"]},
+        "hours": {"response": "hours", "synonyms": ["opening hours", "Hours"]},
+    },
+}
+
+
+@pytest.fixture
+def pack_file(tmp_path):
+    path = tmp_path / "knowledge_pack.json"
+    path.write_text(json.dumps(SOURCE), encoding="utf-8")
+    return path
+
+
+def test_pack_tables(pack_file, tmp_path):
+    pack = app.KnowledgePack.load(pack_file, tmp_path / "cache")
+    assert pack.answer("where are you") == "We are in Quezon City."
+    assert pack.answer("hours") == "Open 9-6, Monday to Saturday."
+    assert pack.answer("location") is pack.answer("where are you")  # one shared body
+    assert pack.exact(app.normalize_text("Where are you?")) == "We are in Quezon City."
+    assert pack.answer("unknown") is None
+    texts = [text.lower() for _, text in pack.index_entries]
+    assert len(texts) == len(set(texts))  # "Hours" is deduplicated against the alias
+    assert pack.responses() == {
+        "location": "We are in Quezon City.",
+        "where are you": "We are in Quezon City.",
+        "hours": "Open 9-6, Monday to Saturday.",
+    }
+
+
+@pytest.mark.parametrize("broken, message", [
+    ({"responses": [{"answer": "a", "aliases": ["x"]}, {"answer": "b", "aliases": ["x"]}]}, "more than one"),
+    ({"responses": [{"answer": "a", "aliases": ["x"]}], "intents": {"i": {"response": "y"}}}, "unknown response"),
+])
+def test_pack_compile_rejects_bad_sources(broken, message):
+    with pytest.raises(ValueError, match=message):
+        app.KnowledgePack.compile_source(broken, "hash")
+
+
+def test_pack_artifact_reused_until_source_or_format_changes(pack_file, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    app.KnowledgePack.load(pack_file, cache_dir)
+    compiled = []
+    original = app.KnowledgePack.compile_source
+
+    def counting(source, source_hash):
+        compiled.append(source_hash)
+        return original(source, source_hash)
+
+    monkeypatch.setattr(app.KnowledgePack, "compile_source", staticmethod(counting))
+    app.KnowledgePack.load(pack_file, cache_dir)
+    assert compiled == []
+
+    monkeypatch.setattr(app.KnowledgePack, "FORMAT_VERSION", app.KnowledgePack.FORMAT_VERSION + 1)
+    app.KnowledgePack.load(pack_file, cache_dir)
+    assert len(compiled) == 1
+
+    source = dict(SOURCE, responses=SOURCE["responses"][:1], intents={})
+    pack_file.write_text(json.dumps(source), encoding="utf-8")
+    pack = app.KnowledgePack.load(pack_file, cache_dir)
+    assert len(compiled) == 2 and pack.answer("hours") is None
+
+
+def test_pack_embeddings_round_trip(pack_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+    pack = app.KnowledgePack.load(pack_file, cache_dir)
+    rows = len(pack.index_entries)
+    assert pack.embeddings("model/a") is None
+    pack.store_embeddings("model/a", np.ones((rows, 3)))
+    pack.store_embeddings("model/b", np.zeros((rows, 2)))
+
+    reloaded = app.KnowledgePack.load(pack_file, cache_dir)
+    assert reloaded.embeddings("model/a").shape == (rows, 3)
+    assert reloaded.embeddings("model/b").dtype == np.float32
+    reloaded.store_embeddings("model/c", np.ones((rows - 1, 3)))
+    assert reloaded.embeddings("model/c") is None  # wrong row count is never served
+
+
+@pytest.fixture
+def offline_pack(pack_file, tmp_path, monkeypatch):
+    """compile-pack against pack_file, with no secrets and no RoutingEngine available."""
+    load = app.KnowledgePack.load
+    monkeypatch.setattr(app.KnowledgePack, "load", lambda force=False: load(pack_file, tmp_path / "cache", force=force))
+    monkeypatch.setattr(app.st, "secrets", {})
+
+    def no_engine():
+        raise AssertionError("compile-pack must not need a RoutingEngine")
+
+    monkeypatch.setattr(app, "RoutingEngine", no_engine)
+    return lambda: load(pack_file, tmp_path / "cache")
+
+
+def test_compile_pack_embeds_without_groq(offline_pack, monkeypatch):
+    from conftest import FakeEmbedding
+
+    monkeypatch.setattr(app, "_FASTEMBED_TEXTEMBEDDING", FakeEmbedding)
+    assert app.compile_pack_command([]) == 0
+    matrix = offline_pack().embeddings(FakeEmbedding.model_name)
+    assert matrix is not None and matrix.shape == (len(offline_pack().index_entries), 64)
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+
+
+def test_compile_pack_without_fastembed(offline_pack, monkeypatch, capsys):
+    monkeypatch.setattr(app, "_FASTEMBED_TEXTEMBEDDING", None)
+    assert app.compile_pack_command([]) == 0
+    assert "computed at first start" in capsys.readouterr().out
@@ -0,0 +1,33 @@
+import app
+
+
+def test_lru_evicts_least_recently_used():
+    cache = app.LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_ttl_expires_entries(clock):
+    cache = app.LRUCache(maxsize=8, ttl_seconds=10)
+    cache.set("a", 1)
+    clock.advance(10)
+    assert cache.get("a") == 1  # exactly at the TTL is still fresh
+    clock.advance(0.5)
+    assert cache.get("a", "gone") == "gone"
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["hits"] == 1 and stats["misses"] == 1
+    assert len(cache) == 0
+
+
+def test_lru_backing_store_survives_restart(tmp_path):
+    path = str(tmp_path / "answers.sqlite3")
+    first = app.LRUCache(maxsize=4, backing=app.SQLiteStore(path, "answers"))
+    first.set("k", "v")
+    second = app.LRUCache(maxsize=4, backing=app.SQLiteStore(path, "answers"))
+    assert second.get("k") == "v"
+    assert second.stats()["backing_hits"] == 1
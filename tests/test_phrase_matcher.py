@@ -0,0 +1,37 @@
+import random
+import re
+
+import app
+
+
+def regex_scan(entries, prompt):
+    """The per-message loop PhraseMatcher replaced: first synonym found with \\b...\\b wins."""
+    norm = app.normalize_text(prompt)
+    for label, phrase in entries:
+        pattern = r"\b" + re.escape(app.normalize_text(phrase)) + r"\b"
+        if re.search(pattern, norm):
+            return label
+    return None
+
+
+def test_phrase_matcher_whole_tokens_and_priority():
+    matcher = app.PhraseMatcher(
+        [("fees", "visa fee"), ("visa", "visa"), ("hours", "open"), ("dup", "Visa Fee!")],
+        app.normalize_text,
+    )
+    assert len(matcher) == 3  # "Visa Fee!" normalizes to an already registered phrase
+    assert matcher.match("how much is the visa fee") == ("fees", "visa fee")
+    assert matcher.match("is the office open for visa") == ("visa", "visa")  # registered before "open"
+    assert matcher.match("visas opened") is None  # no partial tokens
+    assert matcher.match("") is None
+
+
+def test_phrase_matcher_matches_regex_scan_on_pack_synonyms():
+    entries = [(name, s) for name, spec in app.KNOWLEDGE_PACK.intents.items() for s in spec["synonyms"]]
+    matcher = app.PhraseMatcher(entries, app.normalize_text)
+    vocab = sorted({w for _, s in entries for w in app.normalize_text(s).split()} | {"the", "po", "please", "what"})
+    rng = random.Random(3)
+    for _ in range(3000):
+        prompt = " ".join(rng.choice(vocab) for _ in range(rng.randint(1, 7)))
+        hit = matcher.match(app.normalize_text(prompt))
+        assert (hit[0] if hit else None) == regex_scan(entries, prompt), prompt
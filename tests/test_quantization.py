@@ -0,0 +1,70 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import app
+
+
+def unit_rows(n: int, dim: int, seed: int = 3) -> np.ndarray:
+    rows = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", ""])
+    proc.wait()
+    return proc.pid
+
+
+def test_quantized_search_rescores_exactly():
+    matrix = unit_rows(500, 32)
+    index = app.QuantizedIndex(matrix, candidates=16)
+    assert index.nbytes < matrix.nbytes / 3
+    q = matrix[123]
+    hits = index.search(q, 3)
+    assert hits[0][0] == 123 and abs(hits[0][1] - 1.0) < 1e-5
+    exact = matrix @ q
+    assert all(abs(score - exact[row]) < 1e-5 for row, score in hits)
+
+
+def test_int8_intent_index_maps_its_floats(make_engine):
+    engine = make_engine(EMBEDDING_QUANTIZATION="int8")
+    assert engine.embedding_quantized is not None
+    assert isinstance(engine.embedding_matrix, np.memmap)
+    # The pack holds the same memory-map instead of a resident float32 copy
+    resident = list(engine.pack._embeddings.values())
+    assert len(resident) == 1 and resident[0] is engine.embedding_matrix
+    assert engine.embed_route("what are your office hours") == engine.get_canonical_response("hours")
+
+
+def test_old_generations_are_kept_while_leased(make_engine, secrets, tmp_path):
+    engine = make_engine()
+    base = tmp_path / "quantized"
+    base.mkdir()
+    live_holder, dead_holder = base / "knowledge-aaaa.npy", base / "knowledge-bbbb.npy"
+    for path in (live_holder, dead_holder):
+        np.save(path, unit_rows(4, 8))
+    (base / f"knowledge-aaaa.{app.os.getppid()}.lease").touch()
+    (base / f"knowledge-bbbb.{dead_pid()}.lease").touch()
+    current = base / "knowledge-cccc.npy"
+    np.save(current, unit_rows(4, 8))
+
+    engine._collect_quantized(base, "knowledge", current)
+    assert live_holder.exists() and current.exists()
+    assert not dead_holder.exists()
+    assert not list(base.glob("knowledge-bbbb.*.lease"))
+
+
+def test_rebuild_releases_its_own_previous_generation(make_engine, secrets, tmp_path):
+    engine = make_engine()
+    engine.embedding_quantization = "int8"
+    base = tmp_path / "embeddings" / "quantized"
+    first = Path(engine._quantize("knowledge", unit_rows(6, 8, seed=1))[0].filename)
+    second = Path(engine._quantize("knowledge", unit_rows(6, 8, seed=2))[0].filename)
+    # Our lease moved to the new generation; the old file is kept until the next build
+    assert [lease.name.split(".")[0] for lease in base.glob("knowledge-*.lease")] == [second.stem]
+    assert first.exists()
+    engine._quantize("knowledge", unit_rows(6, 8, seed=3))
+    assert not first.exists() and second.exists()
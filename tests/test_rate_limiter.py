@@ -0,0 +1,54 @@
+import app
+
+
+def drain(limiter, service, session_id=None, attempts=1000):
+    """Acquire until refused; returns how many tokens were granted."""
+    granted = 0
+    while granted < attempts and limiter.acquire(service, session_id):
+        granted += 1
+    return granted
+
+
+def test_bucket_burst_then_continuous_refill(clock):
+    limiter = app.RateLimiter({"groq": (60, 0)})
+    assert drain(limiter, "groq") == 60  # burst of one minute's allowance
+    clock.advance(0.5)
+    assert not limiter.acquire("groq")  # half a token is not enough
+    clock.advance(0.5)
+    assert limiter.acquire("groq")  # 60/min refills one token per second
+    clock.advance(3600)
+    assert drain(limiter, "groq") == 60  # refill is capped at the burst
+    assert limiter.stats()["rejected"]["groq"] == 3
+
+
+def test_session_buckets_are_independent(clock):
+    limiter = app.RateLimiter({"groq": (100, 3)})
+    assert drain(limiter, "groq", "alice") == 3
+    assert drain(limiter, "groq", "bob") == 3
+    clock.advance(20)  # 3/min: one token back
+    assert drain(limiter, "groq", "alice") == 1
+
+
+def test_refused_acquire_charges_no_bucket(clock):
+    limiter = app.RateLimiter({"groq": (5, 2)})
+    assert drain(limiter, "groq", "alice") == 2
+    # alice's refusals must not drain the shared global bucket
+    for _ in range(10):
+        assert not limiter.acquire("groq", "alice")
+    assert drain(limiter, "groq", "bob") == 2
+    assert drain(limiter, "groq", "carol") == 1  # global: 5 - 2 - 2
+
+
+def test_zero_limit_disables_bucket():
+    limiter = app.RateLimiter({"translator": (0, 0)})
+    assert drain(limiter, "translator", "alice", attempts=500) == 500
+    assert drain(limiter, "unknown-service", attempts=50) == 50
+
+
+def test_sqlite_buckets_are_shared(tmp_path, clock):
+    db = str(tmp_path / "limits.sqlite3")
+    first = app.RateLimiter({"groq": (10, 0)}, db_path=db)
+    second = app.RateLimiter({"groq": (10, 0)}, db_path=db)
+    assert first.stats()["backend"] == "sqlite"
+    assert drain(first, "groq", attempts=4) == 4
+    assert drain(second, "groq") == 6
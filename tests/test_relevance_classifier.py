@@ -0,0 +1,70 @@
+import numpy as np
+from conftest import FakeEmbedding
+
+import app
+
+
+class FixedClassifier:
+    def __init__(self, proba):
+        self.proba = proba
+
+    def predict_proba(self, vec):
+        return self.proba
+
+
+def test_fit_separates_classes_and_round_trips(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(80, 16))
+    X[:40, 0] += 3.0
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    y = np.array([1] * 40 + [0] * 40)
+    clf = app.RelevanceClassifier.fit(X, y, "model/a", "hash")
+    probas = np.array([clf.predict_proba(x) for x in X])
+    assert ((probas >= 0.5) == y.astype(bool)).mean() > 0.9
+
+    path = tmp_path / "relevance.npz"
+    clf.save(str(path))
+    loaded = app.RelevanceClassifier.load(str(path))
+    assert (loaded.model_name, loaded.examples_hash) == ("model/a", "hash")
+    assert np.isclose(loaded.predict_proba(X[0]), clf.predict_proba(X[0]), atol=1e-5)
+
+
+def test_engine_loads_a_trained_model_instead_of_fitting(make_engine, secrets, monkeypatch):
+    monkeypatch.setattr(app, "_FASTEMBED_TEXTEMBEDDING", FakeEmbedding)
+    assert app.train_relevance_command([secrets["RELEVANCE_MODEL_PATH"]]) == 0
+
+    def no_fit(self):
+        raise AssertionError("a matching model file must be loaded, not refitted")
+
+    monkeypatch.setattr(app.RoutingEngine, "fit_relevance_classifier", no_fit)
+    engine = make_engine()
+    assert engine.relevance_classifier.model_name == FakeEmbedding.model_name
+
+
+def test_stale_model_file_is_refitted(make_engine, secrets):
+    app.RelevanceClassifier(np.zeros(64), 0.0, "other/model", "stale").save(secrets["RELEVANCE_MODEL_PATH"])
+    engine = make_engine()
+    assert engine.relevance_classifier.model_name == FakeEmbedding.model_name
+
+
+def test_confident_verdicts_skip_the_llm(make_engine):
+    engine = make_engine()
+    assistant = app.VisaAssistant(engine)
+    engine.relevance_classifier = FixedClassifier(0.01)
+    assert engine.classify_relevance("anything") is False
+    assert assistant._relevance_stage("anything") == assistant._offtopic_reply()
+    engine.relevance_classifier = FixedClassifier(0.99)
+    assert assistant._relevance_stage("anything") is None
+    assert engine.fake_groq.calls == []
+    counters = engine.metrics()["counters"]
+    assert counters["relevance_local_offtopic"] == 2 and counters["relevance_local_relevant"] == 1
+
+
+def test_uncertain_verdict_falls_back_to_the_llm(make_engine):
+    engine = make_engine("OFFTOPIC")
+    assistant = app.VisaAssistant(engine)
+    engine.relevance_classifier = FixedClassifier((engine.relevance_band_low + engine.relevance_band_high) / 2)
+    assert engine.classify_relevance("anything") is None
+    assert assistant._relevance_stage("anything") == assistant._offtopic_reply()
+    assert len(engine.fake_groq.calls) == 1
+    assert engine.metrics()["counters"]["relevance_uncertain"] == 2
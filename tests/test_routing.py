@@ -0,0 +1,124 @@
+import threading
+
+import app
+
+FEES = "# Fees\n" + "The consultation fee is paid at the office before the interview. " * 3 + "\n"
+UNANSWERED = "quokka zephyr marmalade gizmo"
+
+
+def stages_run(assistant):
+    return [name for name, _, _ in assistant.last_route_trace]
+
+
+def test_rag_stage_skipped_without_facts_fallback(make_engine, tmp_path, monkeypatch):
+    (tmp_path / "knowledge").mkdir()
+    (tmp_path / "knowledge" / "fees.md").write_text(FEES, encoding="utf-8")
+    engine = make_engine(RAG_ENABLED=True, SMART_FACTS_MODE=False)
+    retrievals = []
+    monkeypatch.setattr(engine, "retrieve", lambda prompt, *a, **kw: retrievals.append(prompt) or [])
+    assistant = app.VisaAssistant(engine)
+    for speculative in (True, False):
+        engine.speculative_routing = speculative
+        assistant.generate(UNANSWERED)
+        assert "rag" not in stages_run(assistant) and "facts" not in stages_run(assistant)
+    assert retrievals == []
+
+
+def test_rag_stage_feeds_the_facts_fallback(make_engine, tmp_path):
+    (tmp_path / "knowledge").mkdir()
+    (tmp_path / "knowledge" / "fees.md").write_text(FEES, encoding="utf-8")
+    engine = make_engine("RELEVANT", "The fee is paid at the office.", RAG_ENABLED=True, SMART_FACTS_MODE=True,
+                         LLM_STREAMING=False)
+    assistant = app.VisaAssistant(engine)
+    assert assistant.generate(UNANSWERED) == "The fee is paid at the office."
+    assert stages_run(assistant)[-4:] == ["rag", "relevance", "semantic_answer_cache", "facts"]
+    assert [source.split("/")[-1] for source, _, _ in assistant.last_retrieval] == ["fees.md"]
+    assert "consultation fee" in engine.fake_groq.calls[-1]["messages"][1]["content"]
+
+
+def unsure_engine(make_engine, *replies, **overrides):
+    """An engine whose offline relevance classifier never decides, so the LLM tie-breaker runs."""
+    engine = make_engine(*replies, **overrides)
+    engine.classify_relevance = lambda prompt: None
+    return engine
+
+
+def test_speculative_judges_the_translation_like_sequential(make_engine):
+    engine = unsure_engine(make_engine, "OFFTOPIC")
+    engine.needs_translation = lambda prompt: True
+    engine.translate_to_english = lambda prompt, quota=None: "zebra pizza karaoke tonight"
+    assistant = app.VisaAssistant(engine)
+
+    speculative = assistant._route_speculative("pizza karaoke mamayang gabi zebra")
+    sequential = assistant._route_sequential("pizza karaoke mamayang gabi zebra")
+    assert speculative == sequential == assistant._offtopic_reply()
+    # One Groq call (the verdict is cached), made on the translated text
+    assert len(engine.fake_groq.calls) == 1
+    assert '"zebra pizza karaoke tonight"' in engine.fake_groq.calls[0]["messages"][1]["content"]
+
+
+def test_speculative_overlaps_the_tie_breaker_with_local_stages(make_engine):
+    engine = unsure_engine(make_engine)
+    engine.needs_translation = lambda prompt: False
+    started = threading.Event()
+    check = engine.check_query_relevance
+
+    def tie_breaker(prompt, quota=None):
+        started.set()
+        return check(prompt, quota)
+
+    engine.check_query_relevance = tie_breaker
+    assistant = app.VisaAssistant(engine)
+    overlapped = []
+    assistant._stages["fuzzy"] = lambda prompt: overlapped.append(started.wait(5)) or None
+    assistant._route_speculative(UNANSWERED)
+    assert overlapped == [True]
+
+
+def test_refused_speculative_call_does_not_block_caching(make_engine):
+    engine = unsure_engine(make_engine)
+    engine.needs_translation = lambda prompt: False
+
+    def refused(prompt, quota=None):
+        quota.limited = quota.degraded = True
+        return engine.llm_relevance_fail_open
+
+    engine.check_query_relevance = refused
+    assistant = app.VisaAssistant(engine)
+    assistant._stages["fuzzy"] = lambda prompt: "local answer"
+    assert assistant.generate(UNANSWERED) == "local answer"
+    assert not assistant.quota.degraded
+    assert len(engine.answer_cache) == 1
+
+    # When the verdict is what the reply rests on, its refusal counts
+    assistant._stages["fuzzy"] = lambda prompt: None
+    engine.answer_cache.clear()
+    assistant.generate(UNANSWERED)
+    assert assistant.quota.limited and assistant.quota.degraded
+
+
+def test_offtopic_keywords_are_rejected_before_semantic_stages(make_engine):
+    engine = make_engine()
+    assistant = app.VisaAssistant(engine)
+    semantic_calls = []
+    assistant._stages["semantic"] = lambda prompt: semantic_calls.append(prompt)
+    assert assistant.generate("share a good recipe for chicken adobo") == assistant._offtopic_reply()
+    assert stages_run(assistant)[-1] == "domain" and semantic_calls == []
+    assert engine.fake_groq.calls == []
+    # Table lookups still come first
+    assert assistant.generate("hours") == engine.get_canonical_response("hours")
+
+
+def test_keyword_gate_without_llm_tie_breaker(make_engine):
+    vague = "tell me something nice about the moon and the stars"
+    engine = make_engine(LLM_RELEVANCE_ENABLED=False)
+    assistant = app.VisaAssistant(engine)
+    assert assistant.generate(vague) == assistant._offtopic_reply()
+    assert stages_run(assistant)[-1] == "domain"
+
+    # With the tie-breaker enabled, vague prompts are left to the relevance stage
+    engine.llm_relevance_enabled = True
+    assistant._stages["semantic"] = assistant._stages["embedding"] = lambda prompt: None
+    engine.answer_cache.clear()
+    assistant.generate(vague)
+    assert "domain" in stages_run(assistant) and stages_run(assistant)[-1] != "domain"
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import app
+
+
+def unit(*values):
+    vec = np.asarray(values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_semantic_cache_threshold_version_and_signature():
+    cache = app.SemanticAnswerCache(capacity=4, threshold=0.95)
+    cache.add(unit(1, 0, 0), "v1", "answer", signature="us")
+    assert cache.lookup(unit(1, 0.1, 0), "v1", "us")[0] == "answer"
+    assert cache.lookup(unit(1, 1, 0), "v1", "us") is None  # cosine 0.71
+    assert cache.lookup(unit(1, 0, 0), "v2", "us") is None
+    assert cache.lookup(unit(1, 0, 0), "v1", "canada") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3
+
+
+def test_semantic_cache_ttl(clock):
+    cache = app.SemanticAnswerCache(capacity=2, threshold=0.9, ttl_seconds=60)
+    cache.add(unit(1, 0), "v", "answer")
+    clock.advance(61)
+    assert cache.lookup(unit(1, 0), "v") is None
+
+
+def test_semantic_cache_overwrites_least_recently_used(clock):
+    cache = app.SemanticAnswerCache(capacity=2, threshold=0.99)
+    cache.add(unit(1, 0, 0), "v", "x")
+    clock.advance(1)
+    cache.add(unit(0, 1, 0), "v", "y")
+    clock.advance(1)
+    assert cache.lookup(unit(1, 0, 0), "v")[0] == "x"  # "y" becomes the LRU row
+    clock.advance(1)
+    cache.add(unit(0, 0, 1), "v", "z")
+    assert cache.lookup(unit(0, 1, 0), "v") is None
+    assert cache.lookup(unit(1, 0, 0), "v")[0] == "x"
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+def test_semantic_cache_same_question_replaces_its_row():
+    cache = app.SemanticAnswerCache(capacity=4, threshold=0.9)
+    cache.add(unit(1, 0), "v", "old")
+    cache.add(unit(1, 0), "v", "new")
+    assert len(cache) == 1
+    assert cache.lookup(unit(1, 0), "v")[0] == "new"
+    assert cache.purge() == 1 and len(cache) == 0
+
+
+@pytest.mark.parametrize("dim", [3, 5])
+def test_semantic_cache_dimension_mismatch_is_a_miss(dim):
+    cache = app.SemanticAnswerCache(capacity=2, threshold=0.5)
+    cache.add(unit(1, 0, 0, 0), "v", "answer")
+    assert cache.lookup(unit(*([1.0] * dim)), "v") is None
@@ -0,0 +1,61 @@
+import app
+
+PROMPT = "quokka zephyr marmalade gizmo"
+
+
+def test_streaming_answer_accumulates_and_completes():
+    answer = app.StreamingAnswer(iter(["Hello", "", " there"]), fallback="contact us")
+    finished = []
+    answer.on_complete(finished.append)
+    assert list(answer) == ["Hello", " there"]
+    assert answer.text == "Hello there" and not answer.failed and finished == ["Hello there"]
+    assert answer.first_token_ms is not None and answer.total_ms >= answer.first_token_ms
+    assert list(answer) == ["Hello there"]  # replaying a drained answer
+
+
+def test_streaming_answer_falls_back():
+    empty = app.StreamingAnswer(iter([]), fallback="contact us")
+    assert empty.consume() == "contact us" and empty.failed
+
+    errors = []
+
+    def broken():
+        yield "Partial"
+        raise ConnectionError("reset")
+
+    answer = app.StreamingAnswer(broken(), fallback="contact us", on_error=lambda: errors.append(1))
+    assert answer.consume() == "Partial\n\ncontact us"
+    assert answer.failed and errors == [1]
+
+
+def streaming_engine(make_engine, *replies):
+    engine = make_engine(*replies, SMART_FACTS_MODE=True, LLM_STREAMING=True)
+    engine.classify_relevance = lambda prompt: True
+    return engine
+
+
+def test_fallback_reply_streams_and_is_cached_once_drained(make_engine):
+    engine = streaming_engine(make_engine, ["The fee ", "is paid at the office."])
+    assistant = app.VisaAssistant(engine)
+    answer = assistant.generate(PROMPT)
+    assert isinstance(answer, app.StreamingAnswer)
+    assert engine.fake_groq.calls[-1]["stream"] is True
+    assert engine.groq.stats()["in_flight"] == 1 and len(engine.answer_cache) == 0
+
+    assert "".join(answer) == "The fee is paid at the office."
+    assert engine.groq.stats()["in_flight"] == 0
+    assert [name for name, _, _ in assistant.last_route_trace][-2:] == ["first_token", "stream_complete"]
+    assert engine.breakers["groq"].stats()["window_failures"] == 0
+    assert assistant.generate(PROMPT) == "The fee is paid at the office."  # from the answer cache
+    assert len(engine.fake_groq.calls) == 1
+
+
+def test_broken_stream_ends_with_contact_and_is_not_cached(make_engine):
+    engine = streaming_engine(make_engine, ["The fee ", ConnectionError("reset")])
+    assistant = app.VisaAssistant(engine)
+    text = assistant.generate(PROMPT).consume()
+    assert text.startswith("The fee") and engine.get_canonical_response("contact") in text
+    assert len(engine.answer_cache) == 0
+    assert engine.breakers["groq"].stats()["window_failures"] == 1
+    assert engine.metrics()["counters"]["facts_llm_errors"] == 1
+    assert engine.groq.stats()["in_flight"] == 0
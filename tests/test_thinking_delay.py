@@ -0,0 +1,28 @@
+import pytest
+
+import app
+
+
+def test_generate_never_sleeps(make_engine, monkeypatch):
+    def no_sleep(seconds):
+        raise AssertionError("generate() must not block the script thread")
+
+    engine = make_engine(THINKING_DELAY_MS=900)
+    monkeypatch.setattr(app.time, "sleep", no_sleep)
+    assistant = app.VisaAssistant(engine)
+    assert assistant.generate("hours") == engine.get_canonical_response("hours")
+    assert assistant.last_latency_ms < 900
+
+
+@pytest.mark.parametrize("delay_ms, latency_ms, padding", [(900, 100.0, 800), (900, 1200.0, 0), (0, 5.0, 0)])
+def test_typing_padding_tops_up_to_the_thinking_delay(make_engine, delay_ms, latency_ms, padding):
+    assistant = app.VisaAssistant(make_engine(THINKING_DELAY_MS=delay_ms))
+    assistant.last_latency_ms = latency_ms
+    assert assistant.typing_padding_ms() == padding
+
+
+def test_typing_indicator_is_scoped_to_its_message():
+    html = app.typing_indicator(750, "7")
+    assert "750ms" in html and "typing-7" in html
+    assert ":has(.typing-7)" in html  # hides only the message that holds this indicator
+    assert "typing-8" not in html
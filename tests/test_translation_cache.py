@@ -0,0 +1,67 @@
+import pytest
+
+import app
+
+PROMPT = "saan po ang opisina ninyo ngayon"
+
+
+class FakeTranslator:
+    calls = []
+    fail = False
+
+    def __init__(self, source, target):
+        self.source, self.target = source, target
+
+    def translate(self, text):
+        FakeTranslator.calls.append((self.source, text))
+        if FakeTranslator.fail:
+            raise ConnectionError("translator down")
+        return "where is your office now"
+
+
+@pytest.fixture
+def translator(monkeypatch):
+    FakeTranslator.calls = []
+    FakeTranslator.fail = False
+    monkeypatch.setattr(app, "detect", lambda text: "tl")
+    monkeypatch.setattr(app, "GoogleTranslator", FakeTranslator)
+    return FakeTranslator
+
+
+def test_translation_is_cached_across_processes(make_engine, translator):
+    engine = make_engine()
+    assert engine.translate_to_english(PROMPT) == "where is your office now"
+    assert engine.translate_to_english(PROMPT.upper() + "?") == "where is your office now"  # same normalized key
+    assert len(translator.calls) == 1
+
+    # A new engine (another worker, or after a restart) reads the SQLite table
+    translator.fail = True
+    restarted = make_engine()
+    assert restarted.translate_to_english(PROMPT) == "where is your office now"
+    assert len(translator.calls) == 1
+    assert restarted.metrics()["translation_cache"]["size"] >= 1
+
+
+def test_translations_expire_after_ttl(make_engine, translator, clock):
+    engine = make_engine(TRANSLATION_CACHE_TTL_S=60)
+    engine.translate_to_english(PROMPT)
+    clock.advance(61)
+    engine.translate_to_english(PROMPT)
+    assert len(translator.calls) == 2
+
+
+def test_failed_translation_is_not_cached(make_engine, translator):
+    engine = make_engine()
+    translator.fail = True
+    quota = app.SessionQuota()
+    assert engine.translate_to_english(PROMPT, quota) == PROMPT
+    assert quota.degraded
+    translator.fail = False
+    assert engine.translate_to_english(PROMPT) == "where is your office now"
+    assert len(translator.calls) == 2
+
+
+def test_english_prompts_skip_the_translator(make_engine, translator):
+    engine = make_engine()
+    assert engine.translate_to_english("what are your office hours") == "what are your office hours"
+    assert translator.calls == []
@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import pytest
+from conftest import FakeEmbedding
+
+import app
+
+TEXTS = {
+    "n1": ("Biometrics are taken at the visa application centre.", "biometrics.md"),
+    "n2": ("Processing takes about six weeks — sometimes longer.", "processing.md"),
+}
+
+
+def write_store(storage, texts=TEXTS, extra_vector=False):
+    storage.mkdir(exist_ok=True)
+    vectors = dict(zip([f"v{i}" for i in range(len(texts))], FakeEmbedding().embed([t for t, _ in texts.values()])))
+    embedding_dict = {vid: [float(x) * 3.0 for x in vec] for vid, vec in vectors.items()}  # not normalized
+    if extra_vector:
+        embedding_dict["orphan"] = embedding_dict["v0"]
+    nodes_dict = dict(zip(vectors, texts))
+    (storage / "default__vector_store.json").write_text(json.dumps({"embedding_dict": embedding_dict}), encoding="utf-8")
+    (storage / "docstore.json").write_text(json.dumps({
+        "docstore/data": {nid: {"__data__": {"text": text, "metadata": {"file_name": name}}}
+                          for nid, (text, name) in texts.items()},
+        "docstore/metadata": {nid: {"ref_doc_id": f"doc-{nid}", "doc_hash": "h"} for nid in texts},
+    }), encoding="utf-8")
+    (storage / "index_store.json").write_text(json.dumps({
+        "index_store/data": {"idx": {"__type__": "vector_store", "__data__": json.dumps({"nodes_dict": nodes_dict})}},
+    }), encoding="utf-8")
+
+
+def test_compile_and_open(tmp_path):
+    write_store(tmp_path / "storage")
+    store = app.VectorStoreIndex.open(tmp_path / "storage", tmp_path / "out")
+    assert len(store) == 2 and store.dim == 64
+    assert [store.text(i) for i in range(2)] == [text for text, _ in TEXTS.values()]
+    assert [store.source(i) for i in range(2)] == ["biometrics.md", "processing.md"]
+    assert isinstance(store.vectors, np.memmap)
+    assert np.allclose(np.linalg.norm(store.vectors, axis=1), 1.0)
+    assert not list((tmp_path / "out").glob("*.tmp"))
+
+
+def test_open_reuses_the_compiled_store_until_sources_change(tmp_path, monkeypatch):
+    write_store(tmp_path / "storage")
+    app.VectorStoreIndex.open(tmp_path / "storage", tmp_path / "out")
+    compile_store = app.VectorStoreIndex.compile
+    compiled = []
+    monkeypatch.setattr(app.VectorStoreIndex, "compile",
+                        classmethod(lambda cls, *args: compiled.append(args) or compile_store(*args)))
+    assert len(app.VectorStoreIndex.open(tmp_path / "storage", tmp_path / "out")) == 2
+    assert compiled == []
+
+    write_store(tmp_path / "storage", {"n1": TEXTS["n1"]})
+    assert len(app.VectorStoreIndex.open(tmp_path / "storage", tmp_path / "out")) == 1
+    assert len(compiled) == 1
+
+
+def test_inconsistent_store_is_rejected(tmp_path):
+    write_store(tmp_path / "storage", extra_vector=True)
+    with pytest.raises(ValueError, match="not in index_store.json"):
+        app.VectorStoreIndex.open(tmp_path / "storage", tmp_path / "out")
+    assert app.VectorStoreIndex.open(tmp_path / "missing", tmp_path / "out") is None
+
+
+def test_retrieve_searches_the_storage_index(make_engine, tmp_path):
+    write_store(tmp_path / "storage")
+    engine = make_engine(RAG_ENABLED=True, STORAGE_INDEX_ENABLED=True, STORAGE_DIR=str(tmp_path / "storage"),
+                         STORAGE_CACHE_DIR=str(tmp_path / "storage-cache"))
+    assert engine.storage_index is not None and engine.storage_index_error is None
+    hits = engine.retrieve("where are biometrics taken for the visa application")
+    assert hits[0][0] == "biometrics.md" and hits[0][1] == TEXTS["n1"][0]
+
+
+def test_broken_store_does_not_stop_the_engine(make_engine, tmp_path):
+    write_store(tmp_path / "storage", extra_vector=True)
+    engine = make_engine(RAG_ENABLED=True, STORAGE_INDEX_ENABLED=True, STORAGE_DIR=str(tmp_path / "storage"),
+                         STORAGE_CACHE_DIR=str(tmp_path / "storage-cache"))
+    assert engine.storage_index is None and "ValueError" in engine.storage_index_error
+    assert engine.metrics()["counters"]["storage_index_errors"] == 1
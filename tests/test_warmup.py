@@ -0,0 +1,40 @@
+import threading
+
+import app
+
+FEES = "# Fees\n" + "The consultation fee is paid at the office before the interview. " * 3 + "\n"
+
+
+def test_ready_waits_for_the_first_knowledge_index(make_engine, secrets, tmp_path, monkeypatch):
+    knowledge = tmp_path / "knowledge"
+    knowledge.mkdir()
+    (knowledge / "fees.md").write_text(FEES, encoding="utf-8")
+    release = threading.Event()
+    build = app.RoutingEngine._build_rag_index
+
+    def held_build(self):
+        release.wait(10)
+        build(self)
+
+    monkeypatch.setattr(app.RoutingEngine, "_build_rag_index", held_build)
+    engine = make_engine(RAG_ENABLED=True, RAG_BACKGROUND_BUILD=True)
+    assistant = app.VisaAssistant(engine)
+
+    assert engine.models_ready.is_set()
+    health = engine.health()
+    assert not health["ready"] and not health["knowledge_ready"]
+    assistant.generate("what are your office hours")
+    assert len(engine.answer_cache) == 0  # routed before RAG existed: not cached
+
+    release.set()
+    assert engine.knowledge_ready.wait(10)
+    health = engine.health()
+    assert health["ready"] and health["knowledge_chunks"] > 0
+    assistant.generate("what are your office hours")
+    assert len(engine.answer_cache) == 1
+
+
+def test_ready_right_after_warmup_without_rag(make_engine):
+    engine = make_engine()
+    assert engine.health()["ready"]
+    assert engine.health()["embedding_router"]